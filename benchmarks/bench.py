@@ -0,0 +1,169 @@
+"""Benchmarks for the parser hot paths.
+
+  python benchmarks/bench.py run [-k PATTERN] [-n REPEAT] [-o results.json]
+  python benchmarks/bench.py compare baseline.json results.json [--threshold 0.1]
+
+`run` renders each synthetic template (see `generator.py`) repeatedly and reports the median
+time per render and the peak memory allocated during one render, as measured by tracemalloc.
+`compare` reports the change of each benchmark against a baseline, and exits with status 1 if
+any of them got slower or allocates more memory than the thresholds allow.
+"""
+
+import os
+import re
+import sys
+import gc
+import json
+import argparse
+import platform
+import tempfile
+import statistics
+import tracemalloc
+from time import perf_counter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from mext import MextParser, __version__
+from generator import generate
+
+Cases = {
+  'literals': dict(size=200, whitespace_density=0.0),
+  'whitespace': dict(size=200, whitespace_density=0.8),
+  'trim_newline': dict(size=100, trim_newline=True, whitespace_density=0.5),
+  'skip_until': dict(size=50, skipped_branches=10),
+  'for_flat': dict(size=10, loop_depth=1, loop_length=100),
+  'for_nested': dict(size=5, loop_depth=3, loop_length=8),
+  'include_fanout': dict(size=20, include_fanout=5, include_depth=1),
+  'include_nested': dict(size=5, include_fanout=3, include_depth=3),
+  'include_nested_optimized': dict(size=5, include_fanout=3, include_depth=3, optimize=True),
+  'formatters': dict(size=50, formatters=['json', 'escape', 'fenced_block', 'upper']),
+  'formatters_cached': dict(size=50, formatters=['json', 'escape', 'fenced_block', 'upper'], formatter_cache=True),
+}
+
+def measure(case, repeat, min_time):
+  case = dict(case)
+  optimize = case.pop('optimize', False)
+  formatter_cache = case.pop('formatter_cache', False)
+
+  with tempfile.TemporaryDirectory() as folder:
+    template_fn, params = generate(folder, **case)
+    with open(template_fn) as f:
+      template = f.read()
+
+    parser = MextParser()
+    parser.enable_optimization(optimize)
+    if not formatter_cache:
+      # the same values are formatted on every render, which would only measure the cache hits
+      parser.formatter_caches.clear()
+    render = lambda: parser.parse(template=template, template_fn=template_fn, params=params)
+    output = render()
+
+    # calibrate the number of renders per sample so that each sample takes at least `min_time`
+    number = 1
+    while True:
+      start = perf_counter()
+      for _ in range(number):
+        render()
+      if perf_counter() - start >= min_time:
+        break
+      number *= 2
+
+    times = []
+    gc.collect()
+    for _ in range(repeat):
+      start = perf_counter()
+      for _ in range(number):
+        render()
+      times.append((perf_counter() - start) / number)
+
+    tracemalloc.start()
+    render()
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+  return {
+    'time': statistics.median(times),
+    'times': times,
+    'peak_memory': peak_memory,
+    'template_size': len(template),
+    'output_size': len(output),
+  }
+
+def run(args):
+  results = {}
+  for name, case in Cases.items():
+    if args.k is not None and not re.search(args.k, name):
+      continue
+    result = measure(case, args.repeat, args.min_time)
+    results[name] = result
+    print(f'{name:<28}{result["time"]*1e3:10.3f} ms{result["peak_memory"]/1024:10.1f} KiB')
+
+  if args.output is not None:
+    with open(args.output, 'w') as f:
+      json.dump({
+        'meta': {
+          'mext': __version__,
+          'python': platform.python_version(),
+          'platform': platform.platform(),
+        },
+        'benchmarks': results,
+      }, f, indent=2)
+
+def compare(args):
+  with open(args.baseline) as f:
+    baseline = json.load(f)['benchmarks']
+  with open(args.results) as f:
+    results = json.load(f)['benchmarks']
+
+  regressions = []
+  print(f'{"benchmark":<28}{"baseline":>12}{"current":>12}{"change":>9}{"memory":>9}')
+  for name, result in results.items():
+    if name not in baseline:
+      print(f'{name:<28}{"-":>12}{result["time"]*1e3:9.3f} ms')
+      continue
+    base = baseline[name]
+    change = result['time'] / base['time'] - 1
+    line = f'{name:<28}{base["time"]*1e3:9.3f} ms{result["time"]*1e3:9.3f} ms{change:+9.1%}'
+
+    memory_change = None
+    if 'peak_memory' in result and base.get('peak_memory'):
+      memory_change = result['peak_memory'] / base['peak_memory'] - 1
+      line += f'{memory_change:+9.1%}'
+
+    if change > args.threshold or (memory_change is not None and memory_change > args.memory_threshold):
+      regressions.append(name)
+      line += '  REGRESSION'
+    print(line)
+
+  for name in baseline.keys() - results.keys():
+    print(f'{name:<28}missing from the results')
+
+  if len(regressions) > 0:
+    print(f'\n{len(regressions)} regression(s): {", ".join(regressions)}')
+    sys.exit(1)
+
+def main(argv=sys.argv[1:]):
+  parser = argparse.ArgumentParser(description="Benchmark the mext parser.")
+  subparsers = parser.add_subparsers(dest='command', required=True)
+
+  run_parser = subparsers.add_parser('run', help="Run the benchmarks.")
+  run_parser.add_argument("-k", type=str, help="Only run the benchmarks whose name matches this regular expression.")
+  run_parser.add_argument("-n", "--repeat", type=int, default=7, help="The number of samples per benchmark.")
+  run_parser.add_argument("--min-time", type=float, default=0.05, help="The minimum duration of a sample in seconds.")
+  run_parser.add_argument("-o", "--output", type=str, help="Write the results as JSON to this file.")
+
+  compare_parser = subparsers.add_parser('compare', help="Compare results against a baseline.")
+  compare_parser.add_argument(dest="baseline", type=str, help="The results to compare against.")
+  compare_parser.add_argument(dest="results", type=str, help="The results to check.")
+  compare_parser.add_argument("--threshold", type=float, default=0.1, help="The allowed relative increase of the time.")
+  compare_parser.add_argument("--memory-threshold", type=float, default=0.1, help="The allowed relative increase of the peak memory.")
+
+  args = parser.parse_args(argv)
+  if args.command == 'run':
+    run(args)
+  else:
+    compare(args)
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,119 @@
+"""Synthetic templates for the benchmarks.
+
+`generate` builds a template and the params it needs from a few knobs, so that a benchmark
+case can stress one part of the parser at a time: literal text and whitespace handling,
+nested loops, skipped branches, includes, `@trim_newline` and formatters.
+"""
+
+import os
+import random
+
+from mext.libs.utils import ObjDict
+
+Words = ['alpha', 'beta', 'gamma', 'delta', 'epsilon', 'zeta', 'eta', 'theta']
+
+class TemplateSpec:
+  def __init__(self, size=20, loop_depth=0, loop_length=5, include_fanout=0, include_depth=1,
+      whitespace_density=0.2, trim_newline=False, formatters=(), skipped_branches=0, seed=0):
+    # the number of sections in the main template
+    self.size = size
+    self.loop_depth = loop_depth
+    self.loop_length = loop_length
+    # the number of partials included by each section, and how deep they include each other
+    self.include_fanout = include_fanout
+    self.include_depth = include_depth
+    # the fraction of lines that are indented or followed by blank lines
+    self.whitespace_density = whitespace_density
+    self.trim_newline = trim_newline
+    self.formatters = list(formatters)
+    # the number of `@if` blocks per section whose body is never rendered
+    self.skipped_branches = skipped_branches
+    self.seed = seed
+
+class Generator:
+  def __init__(self, spec: TemplateSpec):
+    self.spec = spec
+    self.random = random.Random(spec.seed)
+
+  def text(self, words=6):
+    spec = self.spec
+    line = ' '.join(self.random.choice(Words) for _ in range(words))
+    if self.random.random() < spec.whitespace_density:
+      line = '  ' + line + '  '
+    if self.random.random() < spec.whitespace_density:
+      line += '\n'
+    return line + '\n'
+
+  def loop(self, depth, body):
+    if depth == 0:
+      return body
+    varname = f'item{depth}'
+    iterable = 'items' if depth == self.spec.loop_depth else f'item{depth+1}.children'
+    inner = self.loop(depth-1, body)
+    return f'{{@for {varname} in {iterable}}}\n- {{{varname}.name}}\n{inner}{{@endfor}}\n'
+
+  def section(self, index, partials):
+    spec = self.spec
+    parts = [f'## Section {index}\n', self.text()]
+    if spec.trim_newline:
+      parts.append('{@trim_newline}\n')
+    parts.append('{@if show_details}\n' + self.text() + '{@endif}\n')
+    for _ in range(spec.skipped_branches):
+      parts.append('{@if hidden}\n' + ''.join(self.text() for _ in range(5)) + '{@else}\n' + self.text() + '{@endif}\n')
+    for format_name in spec.formatters:
+      varname = 'record' if format_name in ['json', 'repr'] else 'note'
+      parts.append(f'{{@format {format_name} {varname}}}\n')
+    if spec.loop_depth > 0:
+      parts.append(self.loop(spec.loop_depth, self.text(3)))
+    for partial in partials:
+      parts.append(f'{{@include "{partial}" title=name}}\n')
+    parts.append('{user.name} asked about {topic}.\n')
+    return ''.join(parts)
+
+  def partial(self, depth, partials):
+    parts = ['{@default title "untitled"}\n', '### {title}\n', self.text(), self.text()]
+    for partial in partials:
+      parts.append(f'{{@include "{partial}"}}\n')
+    return ''.join(parts)
+
+  def generate(self, folder):
+    """Write the template and its partials into `folder`, and return its path and params."""
+    spec = self.spec
+
+    children = []
+    for depth in range(spec.include_depth if spec.include_fanout > 0 else 0):
+      level = []
+      for index in range(spec.include_fanout):
+        fn = f'partial_{depth}_{index}.mext'
+        with open(os.path.join(folder, fn), 'w') as f:
+          f.write(self.partial(depth, children))
+        level.append(fn)
+      children = level
+    partials = children
+
+    template_fn = os.path.join(folder, 'main.mext')
+    with open(template_fn, 'w') as f:
+      f.write(''.join(self.section(index, partials) for index in range(spec.size)))
+    return template_fn, self.params()
+
+  def params(self):
+    spec = self.spec
+
+    def make_items(depth):
+      if depth == 0:
+        return []
+      return [{'name': f'{Words[i % len(Words)]}{i}', 'children': make_items(depth-1)} for i in range(spec.loop_length)]
+
+    return ObjDict.convert_recursively({
+      'show_details': True,
+      'hidden': False,
+      'name': 'partial',
+      'topic': 'benchmarks',
+      'user': {'name': 'Alice'},
+      'items': make_items(spec.loop_depth),
+      'note': 'line one\nline two with ``` fences\n' * 4,
+      'record': {'id': 1, 'tags': Words, 'nested': {'enabled': True, 'ratio': 0.5}},
+    })
+
+def generate(folder, **kwargs):
+  return Generator(TemplateSpec(**kwargs)).generate(folder)
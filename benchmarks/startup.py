@@ -0,0 +1,106 @@
+"""Measure the startup cost of `import mext` and of a `render-mext` run.
+
+The import time is read from `python -X importtime`, which reports the cumulative time
+spent importing each module. Each measurement is repeated in a fresh interpreter and the
+median is reported.
+
+  python benchmarks/startup.py [-n REPEAT] [-o results.json]
+"""
+
+import os
+import sys
+import json
+import argparse
+import tempfile
+import statistics
+import subprocess
+from time import perf_counter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def run_python(args, env=None):
+  env = {
+    **os.environ,
+    'PYTHONPATH': os.pathsep.join(filter(None, [ROOT, os.environ.get('PYTHONPATH')])),
+    **(env or {}),
+  }
+  start = perf_counter()
+  proc = subprocess.run([sys.executable, *args], capture_output=True, text=True, env=env, cwd=ROOT)
+  elapsed = perf_counter() - start
+  if proc.returncode != 0:
+    raise RuntimeError(f'Command failed: {args}\n{proc.stderr}')
+  return proc, elapsed
+
+def parse_importtime(stderr):
+  # lines look like "import time:   self [us] | cumulative | imported package"
+  modules = {}
+  for line in stderr.splitlines():
+    if not line.startswith('import time:') or 'self [us]' in line:
+      continue
+    self_us, cumulative_us, name = line[len('import time:'):].split('|')
+    modules[name.strip()] = (int(self_us), int(cumulative_us))
+  return modules
+
+def measure_import(module, repeat):
+  totals = []
+  loaded = None
+  for _ in range(repeat):
+    proc, _ = run_python(['-X', 'importtime', '-c', f'import {module}'])
+    modules = parse_importtime(proc.stderr)
+    totals.append(modules[module][1] / 1e6)
+    loaded = sorted(modules.keys())
+  return {
+    'time': statistics.median(totals),
+    'times': totals,
+    'modules': len(loaded),
+    'loaded': loaded,
+  }
+
+def measure_interpreter(repeat):
+  times = [run_python(['-c', 'pass'])[1] for _ in range(repeat)]
+  return {
+    'time': statistics.median(times),
+    'times': times,
+  }
+
+def measure_render(repeat):
+  with tempfile.TemporaryDirectory() as tmpdir:
+    template_fn = os.path.join(tmpdir, 'prompt.mext')
+    with open(template_fn, 'w') as f:
+      f.write('{@set name "startup"}\nHello {name}.\n')
+    times = [
+      run_python(['-m', 'mext.scripts.render_mext', template_fn, '--no-cache'])[1]
+      for _ in range(repeat)
+    ]
+  return {
+    'time': statistics.median(times),
+    'times': times,
+  }
+
+def main(argv=sys.argv[1:]):
+  parser = argparse.ArgumentParser(description="Measure the startup time of mext.")
+  parser.add_argument("-n", "--repeat", type=int, default=10, help="The number of fresh interpreters per measurement.")
+  parser.add_argument("-o", "--output", type=str, help="Write the results as JSON to this file.")
+  args = parser.parse_args(argv)
+
+  results = {
+    'interpreter': measure_interpreter(args.repeat),
+    'import mext': measure_import('mext', args.repeat),
+    'render-mext': measure_render(args.repeat),
+  }
+
+  for name, result in results.items():
+    line = f'{name:<16}{result["time"]*1e3:9.2f} ms'
+    if 'modules' in result:
+      line += f'  ({result["modules"]} modules)'
+    print(line)
+  heavy = [m for m in ['yaml', 'json', 'typing', 'traceback', 'pickle', 'hashlib'] if m in results['import mext']['loaded']]
+  if len(heavy) > 0:
+    print(f'import mext loads: {", ".join(heavy)}')
+
+  if args.output is not None:
+    with open(args.output, 'w') as f:
+      json.dump({'benchmarks': results}, f, indent=2)
+
+if __name__ == "__main__":
+  main()
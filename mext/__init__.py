@@ -1 +1,3 @@
-from mext.mext import Mext, MextParser
\ No newline at end of file
+__version__ = "0.1.1"
+
+from mext.mext import Mext, MextParser
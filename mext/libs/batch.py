@@ -0,0 +1,89 @@
+import os
+import sys
+import json
+from collections import deque
+from itertools import islice
+from contextlib import contextmanager
+
+from mext.libs.build import worker, init_worker
+from mext.libs.utils import ObjDict
+
+# the number of lines sent to a process at a time
+BATCH_LINES = 256
+
+def render_jsonl(template_fn, input, output, params_fns=[], jobs=1, optimize=False, cache_dir=None, disk_cache=True):
+  """Render `template_fn` once for each line of `input`, a JSON object of params, and write one
+  JSON object per line to `output`, in the same order.
+
+  A line is rendered with the params of `params_fns` overridden by its own. Its output is
+  `{"result": "..."}`, or `{"line": n, "error": "..."}` if it failed. Blank lines are skipped.
+  With `jobs` > 1, batches of lines are rendered in a pool of processes, with a bounded number
+  of batches pending so that the memory used does not grow with the input.
+  Returns the number of lines rendered and the number of lines that failed.
+  """
+  jobs = jobs if jobs > 0 else os.cpu_count()
+  options = ((optimize, disk_cache, cache_dir), params_fns)
+  batches = batch_lines(input)
+  counts = [0, 0]
+
+  def write(results):
+    for line, failed in results:
+      output.write(line + '\n')
+      counts[1 if failed else 0] += 1
+
+  if jobs == 1:
+    init_batch_worker(*options)
+    for batch in batches:
+      write(render_lines(template_fn, *batch))
+  else:
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=jobs, initializer=init_batch_worker, initargs=options) as executor:
+      pending = deque()
+      for batch in batches:
+        if len(pending) >= jobs * 4:
+          write(pending.popleft().result())
+        pending.append(executor.submit(render_lines, template_fn, *batch))
+      while len(pending) > 0:
+        write(pending.popleft().result())
+  return counts[0], counts[1]
+
+def batch_lines(input):
+  lineno = 0
+  while len(lines := list(islice(input, BATCH_LINES))) > 0:
+    yield lineno, lines
+    lineno += len(lines)
+
+def init_batch_worker(options, params_fns):
+  init_worker(*options)
+  # the files read by the renders are only needed by builds
+  worker.mext.disable_file_tracking()
+  worker.params = {}
+  for fn in params_fns:
+    worker.params.update(worker.mext.parser.load_data(fn))
+
+def render_lines(template_fn, lineno, lines):
+  """Render a batch of lines. Returns a `(JSON line, failed)` tuple for each line that is not blank."""
+  mext = worker.mext
+  results = []
+  for line in lines:
+    lineno += 1
+    if len(line.strip()) == 0:
+      continue
+    try:
+      row = json.loads(line)
+      if not isinstance(row, dict):
+        raise ValueError(f'Expected a JSON object, got {type(row).__name__}.')
+      result = mext.compose(template_fn=template_fn, params={**worker.params, **ObjDict.convert_recursively(row)})
+      results.append((json.dumps({'result': result}, ensure_ascii=False), False))
+    except Exception as e:
+      results.append((json.dumps({'line': lineno, 'error': f'{type(e).__name__}: {e}'}, ensure_ascii=False), True))
+  return results
+
+@contextmanager
+def open_jsonl(fn, mode):
+  """Open `fn`, or use stdin / stdout for `-`."""
+  if fn == '-':
+    yield sys.stdin if mode == 'r' else sys.stdout
+  else:
+    with open(fn, mode, encoding='utf-8') as f:
+      yield f
@@ -0,0 +1,205 @@
+import os
+import json
+from os import path
+
+from mext.libs.config_loader import CFG
+from mext.libs.compile_cache import CompileCache
+from mext.libs.utils import ObjDict, ensure_folder_exists, format_exception
+
+class Builder:
+  """Renders the jobs of a manifest in one process, or in a pool of `jobs` processes.
+
+  The manifest is a yaml or json file with a list of jobs, each with a `template`, an `output`
+  and optional `params` files. Params files listed under `defaults` apply to every job.
+  Paths are relative to the manifest.
+
+    defaults:
+      params: [common.yaml]
+    jobs:
+      - template: pages/index.mext
+        params: [pages/index.yaml]
+        output: site/index.md
+
+  A job is skipped when its output exists and none of the files it read in the last build
+  changed. Outputs are replaced atomically, and only when their content changed.
+
+  With `keep_workers`, the processes and their caches are kept for the following runs until
+  `close` is called.
+  """
+
+  StateVersion = 1
+
+  def __init__(self, manifest_fn, jobs=1, optimize=False, force=False, cache_dir=None, disk_cache=True, keep_workers=False):
+    self.manifest_fn = manifest_fn
+    self.jobs = jobs if jobs > 0 else os.cpu_count()
+    self.optimize = optimize
+    self.force = force
+    self.cache_dir = cache_dir
+    self.disk_cache = disk_cache
+    self.keep_workers = keep_workers
+    self.executor = None
+    self.initialized = False
+    # the files read by the jobs of the last run, see `watched_files`
+    self.inputs = {}
+    self.state_fn = path.join(path.dirname(manifest_fn), CompileCache.Folder,
+      f'{path.basename(manifest_fn)}.build.json')
+
+  def load_manifest(self):
+    manifest = CFG.load_config(self.manifest_fn)
+    folder = path.dirname(self.manifest_fn)
+    resolve = lambda fn: path.normpath(path.join(folder, fn))
+    default_params = (manifest.get('defaults') or {}).get('params', [])
+
+    jobs = []
+    for index, job in enumerate(manifest.get('jobs') or []):
+      if 'template' not in job or 'output' not in job:
+        raise ValueError(f'Job {index} in "{self.manifest_fn}" must have a template and an output.')
+      params = job.get('params', [])
+      if isinstance(params, str):
+        params = [params]
+      jobs.append({
+        'template': resolve(job['template']),
+        'params': [resolve(fn) for fn in [*default_params, *params]],
+        'output': resolve(job['output']),
+      })
+    return jobs
+
+  def load_state(self):
+    try:
+      with open(self.state_fn) as f:
+        state = json.load(f)
+      if state.get('version') != Builder.StateVersion or state.get('optimize') != self.optimize:
+        return {}
+      return state['outputs']
+    except Exception:
+      return {}
+
+  def save_state(self, outputs):
+    ensure_folder_exists(self.state_fn)
+    write_atomic(self.state_fn, json.dumps({
+      'version': Builder.StateVersion,
+      'optimize': self.optimize,
+      'outputs': outputs,
+    }, indent=1))
+
+  def is_up_to_date(self, job, entry):
+    if self.force or entry is None or not path.exists(job['output']):
+      return False
+    if entry['template'] != job['template'] or entry['params'] != job['params']:
+      return False
+    return all(stamp(fn) == value for fn, value in entry['inputs'].items())
+
+  def watched_files(self):
+    """The manifest and the files read by its jobs in the last run."""
+    return [self.manifest_fn, *dict.fromkeys(fn for inputs in self.inputs.values() for fn in inputs)]
+
+  def run(self):
+    jobs = self.load_manifest()
+    state = self.load_state()
+    summary = ObjDict({'rendered': 0, 'unchanged': 0, 'skipped': 0, 'failed': 0, 'errors': {}})
+    self.inputs = {}
+
+    pending = []
+    for job in jobs:
+      if self.is_up_to_date(job, entry := state.get(job['output'])):
+        summary.skipped += 1
+        self.inputs[job['output']] = list(entry['inputs'])
+      else:
+        pending.append(job)
+
+    def collect(job, result):
+      self.inputs[job['output']] = [job['template'], *job['params'], *result.inputs]
+      if result.error is not None:
+        summary.failed += 1
+        summary.errors[job['output']] = result.error
+        state.pop(job['output'], None)
+        return
+      summary.rendered += 1 if result.written else 0
+      summary.unchanged += 0 if result.written else 1
+      state[job['output']] = {
+        'template': job['template'],
+        'params': job['params'],
+        'inputs': result.inputs,
+      }
+
+    options = (self.optimize, self.disk_cache, self.cache_dir)
+    if self.jobs == 1 or (len(pending) <= 1 and self.executor is None):
+      if not self.initialized:
+        init_worker(*options)
+        self.initialized = True
+      for job in pending:
+        collect(job, build_job(job))
+    elif len(pending) > 0:
+      if self.executor is None:
+        from concurrent.futures import ProcessPoolExecutor
+        self.executor = ProcessPoolExecutor(max_workers=self.jobs, initializer=init_worker, initargs=options)
+      try:
+        chunksize = max(1, len(pending) // (self.jobs * 4))
+        for job, result in zip(pending, self.executor.map(build_job, pending, chunksize=chunksize)):
+          collect(job, result)
+      finally:
+        if not self.keep_workers:
+          self.close()
+
+    self.save_state(state)
+    return summary
+
+  def close(self):
+    if self.executor is not None:
+      self.executor.shutdown()
+      self.executor = None
+
+worker = ObjDict({'mext': None})
+
+def init_worker(optimize, disk_cache, cache_dir):
+  from mext import Mext, MextParser
+  if disk_cache:
+    MextParser.enable_disk_cache(cache_dir)
+  worker.mext = Mext()
+  worker.mext.parser.enable_optimization(optimize)
+  worker.mext.enable_file_tracking()
+
+def build_job(job):
+  mext = worker.mext
+  # the templates and the parsed params files are kept by the process while they are unchanged
+  mext.refresh_prompt_cache()
+  mext.files_read.clear()
+  try:
+    params = {}
+    for fn in job['params']:
+      params.update(mext.parser.load_data(fn))
+    result = mext.compose(template_fn=job['template'], params=params)
+    inputs = {fn: stamp(fn) for fn in [*job['params'], *mext.files_read]}
+    written = write_atomic(job['output'], result, skip_unchanged=True)
+  except Exception as e:
+    return ObjDict({'error': format_exception(e), 'inputs': list(mext.files_read), 'written': False})
+  return ObjDict({'error': None, 'inputs': inputs, 'written': written})
+
+def stamp(fn):
+  try:
+    stat = os.stat(fn)
+  except OSError:
+    return None
+  return [stat.st_mtime_ns, stat.st_size]
+
+def write_atomic(fn, content, skip_unchanged=False):
+  """Write `content` to `fn` through a temporary file. Returns False if the file was unchanged."""
+  if skip_unchanged and path.exists(fn):
+    try:
+      with open(fn, 'r') as f:
+        if f.read() == content:
+          return False
+    except (OSError, UnicodeDecodeError):
+      pass
+
+  ensure_folder_exists(fn)
+  tmp_fn = f'{fn}.{os.getpid()}.tmp'
+  try:
+    with open(tmp_fn, 'w') as f:
+      f.write(content)
+    os.replace(tmp_fn, fn)
+  except BaseException:
+    if path.exists(tmp_fn):
+      os.remove(tmp_fn)
+    raise
+  return True
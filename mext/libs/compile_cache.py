@@ -0,0 +1,74 @@
+import os
+import pickle
+import hashlib
+from os import path
+
+class CompileCache:
+  """Stores compiled templates on disk, similar to `__pycache__`.
+
+  By default the cache files are written to a `__mextcache__` folder next to the templates.
+  An entry is used only if it was written by the same version of Mext and the template
+  source it was compiled from is unchanged. Any failure falls back to compiling.
+  """
+
+  Folder = '__mextcache__'
+
+  def __init__(self, cache_dir=None, tag='mext'):
+    self.cache_dir = cache_dir
+    self.tag = tag
+    self.hits = 0
+    self.misses = 0
+
+  @staticmethod
+  def source_hash(source: str):
+    return hashlib.sha256(source.encode('utf-8', 'surrogatepass')).hexdigest()
+
+  def cache_path(self, template_fn):
+    basename = path.basename(template_fn)
+    if self.cache_dir is None:
+      folder = path.join(path.dirname(template_fn), CompileCache.Folder)
+    else:
+      folder = self.cache_dir
+      basename += '.' + hashlib.sha1(path.abspath(template_fn).encode()).hexdigest()[:16]
+    return path.join(folder, f'{basename}.{self.tag}.pickle')
+
+  def load(self, template_fn, source=None):
+    try:
+      with open(self.cache_path(template_fn), 'rb') as f:
+        entry = pickle.load(f)
+      if entry['tag'] != self.tag:
+        raise ValueError('Version mismatch.')
+      if source is None:
+        stat = os.stat(template_fn)
+        if (stat.st_mtime_ns, stat.st_size) != (entry['mtime_ns'], entry['size']):
+          with open(template_fn, 'r') as f:
+            source = f.read()
+      if source is not None and self.source_hash(source) != entry['source_hash']:
+        raise ValueError('Source changed.')
+      compiled = entry['compiled']
+    except Exception:
+      self.misses += 1
+      return None
+
+    self.hits += 1
+    return compiled
+
+  def store(self, template_fn, source, compiled):
+    cache_fn = self.cache_path(template_fn)
+    tmp_fn = f'{cache_fn}.{os.getpid()}.tmp'
+    try:
+      stat = os.stat(template_fn)
+      entry = {
+        'tag': self.tag,
+        'source_hash': self.source_hash(source),
+        'mtime_ns': stat.st_mtime_ns,
+        'size': stat.st_size,
+        'compiled': compiled,
+      }
+      os.makedirs(path.dirname(cache_fn), exist_ok=True)
+      with open(tmp_fn, 'wb') as f:
+        pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+      os.replace(tmp_fn, cache_fn)
+    except Exception:
+      if path.exists(tmp_fn):
+        os.remove(tmp_fn)
@@ -1,5 +1,3 @@
-import yaml
-import json
 import os
 from collections import namedtuple
 
@@ -59,8 +57,10 @@ class CFG:
         filetype = CFG.Extension2FileType[ext]
 
       if filetype == 'json':
+        import json
         configs = json.load(f)
       elif filetype == 'yaml':
+        import yaml
         configs = yaml.safe_load(f)
       else:
         raise ValueError(f'Unknown file type "{filetype}"')
@@ -0,0 +1,48 @@
+import re
+
+class DeferredResults:
+  """The results of the async formatters called during a render.
+
+  Each call writes a placeholder to the output, and the calls are awaited together by `gather`.
+  The coroutines are only created there, so nothing is left unawaited when a render fails.
+  `fill` then replaces the placeholders of a text with the results. The placeholders are made
+  of private use characters and a random token, so they can not be forged by the template.
+  """
+
+  def __init__(self):
+    import secrets
+    self.prefix = f'\ue000{secrets.token_hex(4)}:'
+    self.pattern = re.compile(re.escape(self.prefix) + r'(\d+)\ue001')
+    self.calls = []
+    self.results = []
+
+  def __len__(self):
+    return len(self.calls)
+
+  @property
+  def unresolved(self):
+    return len(self.results) < len(self.calls)
+
+  def add(self, call):
+    """Schedule `call`, an async function without arguments. Returns the placeholder of its result."""
+    self.calls.append(call)
+    return f'{self.prefix}{len(self.calls)-1}\ue001'
+
+  async def gather(self):
+    import asyncio
+    self.results.extend(map(str, await asyncio.gather(*(call() for call in self.calls[len(self.results):]))))
+
+  def resolve(self):
+    """Await the unresolved results outside of an event loop."""
+    import asyncio
+    try:
+      asyncio.get_running_loop()
+    except RuntimeError:
+      asyncio.run(self.gather())
+      return
+    raise RuntimeError('Async formatters can not be awaited by a render inside an event loop, render with `parse_async` instead.')
+
+  def fill(self, text):
+    if len(self.calls) == 0:
+      return text
+    return self.pattern.sub(lambda m: self.results[int(m[1])], text)
@@ -0,0 +1,141 @@
+import threading
+from bisect import bisect_left
+
+class Counter:
+  type = 'counter'
+
+  def __init__(self, name, help):
+    self.name = name
+    self.help = help
+    self.values = {}
+
+  def inc(self, labels, amount=1):
+    self.values[labels] = self.values.get(labels, 0) + amount
+
+  def snapshot(self):
+    return [{'labels': dict(labels), 'value': value} for labels, value in self.values.items()]
+
+  def exposition(self):
+    return [f'{self.name}{format_labels(labels)} {format_value(value)}' for labels, value in self.values.items()]
+
+class Histogram:
+  type = 'histogram'
+
+  def __init__(self, name, help, buckets):
+    self.name = name
+    self.help = help
+    self.buckets = tuple(sorted(buckets))
+    self.values = {}
+
+  def observe(self, labels, value):
+    if (state := self.values.get(labels)) is None:
+      # the count of each bucket, then the sum and the count of all observations
+      state = self.values[labels] = [[0] * (len(self.buckets)+1), 0.0, 0]
+    state[0][bisect_left(self.buckets, value)] += 1
+    state[1] += value
+    state[2] += 1
+
+  def cumulative(self, counts):
+    total = 0
+    for bound, count in zip([*self.buckets, float('inf')], counts):
+      total += count
+      yield bound, total
+
+  def snapshot(self):
+    return [{
+      'labels': dict(labels),
+      'buckets': {format_value(bound): count for bound, count in self.cumulative(counts)},
+      'sum': total,
+      'count': count,
+    } for labels, (counts, total, count) in self.values.items()]
+
+  def exposition(self):
+    lines = []
+    for labels, (counts, total, count) in self.values.items():
+      for bound, bucket_count in self.cumulative(counts):
+        lines.append(f'{self.name}_bucket{format_labels(labels + (("le", format_value(bound)),))} {bucket_count}')
+      lines.append(f'{self.name}_sum{format_labels(labels)} {format_value(total)}')
+      lines.append(f'{self.name}_count{format_labels(labels)} {count}')
+    return lines
+
+class MetricsRegistry:
+  """Counters and histograms of renders, exportable as a dict or in the Prometheus text format.
+
+  The metrics recorded by Mext are declared in `Metrics`. Label values are converted to strings,
+  and the `template` label of a template given as a string instead of a file is `<string>`.
+  """
+
+  LatencyBuckets = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+  SizeBuckets = (64, 256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+  Metrics = {
+    'mext_renders_total': ('counter', 'Number of renders.'),
+    'mext_render_errors_total': ('counter', 'Number of renders that raised an exception.'),
+    'mext_render_duration_seconds': ('histogram', 'Time spent rendering.', LatencyBuckets),
+    'mext_output_size_bytes': ('histogram', 'Length of the rendered results.', SizeBuckets),
+    'mext_includes_total': ('counter', 'Number of @include executed, by the including template.'),
+    'mext_imports_total': ('counter', 'Number of @import executed, by the importing template.'),
+    'mext_cache_hits_total': ('counter', 'Number of cache lookups that found an entry.'),
+    'mext_cache_misses_total': ('counter', 'Number of cache lookups that did not find an entry.'),
+    'mext_input_duration_seconds': ('histogram', 'Time spent in @input callbacks.', LatencyBuckets),
+  }
+
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.metrics = {}
+    for name, (metric_type, help, *buckets) in self.Metrics.items():
+      self.metrics[name] = Counter(name, help) if metric_type == 'counter' else Histogram(name, help, *buckets)
+
+  def inc(self, name, amount=1, **labels):
+    labels = make_labels(labels)
+    with self.lock:
+      self.metrics[name].inc(labels, amount)
+
+  def observe(self, name, value, **labels):
+    labels = make_labels(labels)
+    with self.lock:
+      self.metrics[name].observe(labels, value)
+
+  def cache_lookup(self, cache, hit):
+    self.inc('mext_cache_hits_total' if hit else 'mext_cache_misses_total', cache=cache)
+
+  def clear(self):
+    with self.lock:
+      for metric in self.metrics.values():
+        metric.values.clear()
+
+  def snapshot(self):
+    with self.lock:
+      return {
+        name: {
+          'type': metric.type,
+          'help': metric.help,
+          'values': metric.snapshot(),
+        }
+        for name, metric in self.metrics.items()
+      }
+
+  def to_prometheus(self):
+    lines = []
+    with self.lock:
+      for name, metric in self.metrics.items():
+        lines.append(f'# HELP {name} {metric.help}')
+        lines.append(f'# TYPE {name} {metric.type}')
+        lines.extend(metric.exposition())
+    return '\n'.join(lines) + '\n'
+
+def format_labels(labels):
+  if len(labels) == 0:
+    return ''
+  escape = lambda value: str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+  return '{' + ','.join(f'{key}="{escape(value)}"' for key, value in labels) + '}'
+
+def format_value(value):
+  if value == float('inf'):
+    return '+Inf'
+  if isinstance(value, float) and value.is_integer():
+    return str(int(value)) if abs(value) < 1e15 else repr(value)
+  return repr(value) if isinstance(value, float) else str(value)
+
+def make_labels(labels):
+  return tuple(sorted((key, str(value) if value is not None else '<string>') for key, value in labels.items()))
@@ -0,0 +1,91 @@
+from bisect import bisect_right
+
+class OutputBuffer:
+  """Accumulates rendered text without re-joining the whole output on every read.
+
+  Appended chunks are coalesced into segments lazily, so reading the text produced
+  since a given offset only joins the new chunks, and a full snapshot is cached
+  until the next append.
+  """
+
+  def __init__(self):
+    self.chunks = []
+    self.segments = []
+    self.segment_ends = []
+    self.num_chunks = 0
+    self.size = 0
+    self.snapshot = ''
+
+  def __len__(self):
+    return self.num_chunks
+
+  def tell(self):
+    return self.size
+
+  def append(self, text: str):
+    self.chunks.append(text)
+    self.num_chunks += 1
+    self.size += len(text)
+    self.snapshot = None
+
+  def clear(self):
+    self.__init__()
+
+  def coalesce(self):
+    if len(self.chunks) > 0:
+      self.segments.append(''.join(self.chunks) if len(self.chunks) > 1 else self.chunks[0])
+      self.segment_ends.append(self.size)
+      self.chunks = []
+
+  def getvalue(self):
+    if self.snapshot is None:
+      self.coalesce()
+      self.snapshot = ''.join(self.segments)
+      self.segments = [self.snapshot]
+      self.segment_ends = [self.size]
+    return self.snapshot
+
+  def read(self, start=0, end=None):
+    if end is None:
+      end = self.size
+    if start >= end:
+      return ''
+    if start == 0 and end == self.size:
+      return self.getvalue()
+
+    self.coalesce()
+    first = bisect_right(self.segment_ends, start)
+    last = bisect_right(self.segment_ends, end-1)
+    seg_start = self.segment_ends[first-1] if first > 0 else 0
+    text = ''.join(self.segments[first:last+1])
+    return text[start-seg_start:end-seg_start]
+
+  def view(self, start=0, final_strip=False):
+    return OutputView(self, start, final_strip=final_strip)
+
+class OutputView:
+  """A cheap handle on the rendered output up to the point it was created.
+
+  `delta` is the text produced since `start`; the full prefix is only materialized
+  when `prefix` is accessed or the view is converted with `str`.
+  """
+
+  def __init__(self, buffer: OutputBuffer, start=0, final_strip=False):
+    self.buffer = buffer
+    self.start = start
+    self.end = buffer.tell()
+    self.final_strip = final_strip
+
+  @property
+  def delta(self):
+    return self.buffer.read(self.start, self.end)
+
+  @property
+  def prefix(self):
+    prefix = self.buffer.read(0, self.end)
+    if self.final_strip:
+      prefix = prefix.strip()
+    return prefix
+
+  def __str__(self):
+    return self.prefix
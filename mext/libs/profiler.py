@@ -0,0 +1,124 @@
+from time import perf_counter
+
+class ProfileEntry:
+  __slots__ = ['calls', 'time', 'bytes']
+
+  def __init__(self):
+    self.calls = 0
+    self.time = 0.0
+    self.bytes = 0
+
+class RenderProfiler:
+  """Attributes render time and output size to the components of the rendered templates.
+
+  Times and sizes are exclusive: the time spent rendering an included template is attributed
+  to its own components, under a stack frame for the included file. Results accumulate over
+  all renders until `clear` is called.
+  """
+
+  LabelWidth = 60
+
+  def __init__(self):
+    self.clear()
+
+  def clear(self):
+    self.entries = {}
+    self.frames = []
+    # time and bytes of the nested components measured while rendering a component
+    self.nested = []
+    # the files containing the inlined includes being rendered
+    self.scope_fns = []
+    self.total_time = 0.0
+    self.renders = 0
+
+  def push_frame(self, template_fn):
+    self.frames.append(template_fn if template_fn is not None else '<template>')
+
+  def pop_frame(self):
+    self.frames.pop()
+
+  def start(self, parser):
+    self.nested.append([0.0, 0])
+    return (perf_counter(), tuple(self.frames), parser.template_fn, parser.results, parser.results.tell())
+
+  def stop(self, token, component):
+    start, frames, template_fn, results, size = token
+    elapsed = perf_counter() - start
+    size = results.tell() - size
+    nested_time, nested_bytes = self.nested.pop()
+    if len(self.nested) > 0:
+      self.nested[-1][0] += elapsed
+      self.nested[-1][1] += size
+    else:
+      self.total_time += elapsed
+
+    if component.op == 'enter_scope':
+      self.scope_fns.append(template_fn)
+    elif component.op == 'exit_scope':
+      # account the end of an inlined include to the include directive
+      frames = frames[:-1]
+      template_fn = self.scope_fns.pop()
+
+    key = (frames, template_fn, component.lineno, self.label(component))
+    if (entry := self.entries.get(key)) is None:
+      entry = self.entries[key] = ProfileEntry()
+    if component.op != 'exit_scope':
+      entry.calls += 1
+    entry.time += elapsed - nested_time
+    entry.bytes += max(size - nested_bytes, 0)
+
+  def label(self, component):
+    if component.field_name is None:
+      label = '<text>'
+    elif component.field_name.startswith('@'):
+      label = component.field_name
+    elif component.filters is not None:
+      label = f'{{{"|".join([component.field_name, *component.filters])}}}'
+    else:
+      label = f'{{{component.field_name}}}'
+    label = ' '.join(label.split())
+    if len(label) > self.LabelWidth:
+      label = label[:self.LabelWidth-3] + '...'
+    return label
+
+  def aggregate(self, key_fn):
+    results = {}
+    for key, entry in self.entries.items():
+      group = key_fn(key)
+      if (total := results.get(group)) is None:
+        total = results[group] = ProfileEntry()
+      total.calls += entry.calls
+      total.time += entry.time
+      total.bytes += entry.bytes
+    return sorted(results.items(), key=lambda item: -item[1].time)
+
+  def report(self, limit=20):
+    total_time = self.total_time or 1e-12
+    lines = [f'Rendered {self.renders} time(s) in {self.total_time*1e3:.3f} ms.']
+
+    def table(title, rows, describe):
+      lines.append('')
+      lines.append(f'{"time (ms)":>12}{"%":>8}{"calls":>9}{"bytes":>10}  {title}')
+      for group, entry in rows[:limit]:
+        lines.append(f'{entry.time*1e3:12.3f}{entry.time/total_time:8.1%}{entry.calls:9d}{entry.bytes:10d}  {describe(group)}')
+
+    table('Directive', self.aggregate(lambda key: (key[1], key[2], key[3])),
+      lambda group: f'{group[2]}  ({location(group[0], group[1])})')
+    table('Line', self.aggregate(lambda key: (key[1], key[2])),
+      lambda group: location(*group))
+    table('File', self.aggregate(lambda key: key[1]),
+      lambda group: group if group is not None else '<template>')
+    return '\n'.join(lines)
+
+  def collapsed_stacks(self, value='time'):
+    """Lines of `frame;frame;leaf value` for flamegraph tools, in microseconds or bytes."""
+    stacks = {}
+    for (frames, template_fn, lineno, label), entry in self.entries.items():
+      leaf = f'{label} ({location(template_fn, lineno)})'.replace(';', ',')
+      stack = ';'.join([*(frame.replace(';', ',') for frame in frames), leaf])
+      amount = round(entry.time * 1e6) if value == 'time' else entry.bytes
+      stacks[stack] = stacks.get(stack, 0) + amount
+    return '\n'.join(f'{stack} {amount}' for stack, amount in sorted(stacks.items()) if amount > 0)
+
+def location(template_fn, lineno):
+  return f'{template_fn if template_fn is not None else "<template>"}:{lineno}'
@@ -0,0 +1,173 @@
+import os
+import sys
+import json
+import asyncio
+import stat
+import signal
+from time import perf_counter, monotonic
+
+from mext.libs.build import worker, init_worker
+from mext.libs.utils import ObjDict
+
+class RenderServer:
+  """Renders templates for the clients of a Unix socket, with one JSON object per line.
+
+  A request is `{"id": ..., "template_fn": "prompt.mext", "params": {...}}`, or has the source
+  of the template in `template` instead of `template_fn`. Its response is `{"id": ..., "result": "..."}`,
+  or `{"id": ..., "error": "..."}`. `{"id": ..., "stats": true}` returns the stats of the server.
+
+  Clients may send requests without waiting for the responses, which come in the order of the
+  requests of each connection. With `jobs` > 1, renders run in a pool of processes, otherwise
+  in the event loop. The templates and the data files read by the renders stay cached while
+  they are unchanged.
+  """
+
+  # the number of requests of a connection being rendered or waiting for their response to be sent
+  PipelineDepth = 128
+  # the maximum length of a request line
+  LineLimit = 64 * 1024 * 1024
+
+  def __init__(self, socket_path, jobs=1, optimize=False, cache_dir=None, disk_cache=True):
+    self.socket_path = socket_path
+    self.jobs = jobs if jobs > 0 else os.cpu_count()
+    self.options = (optimize, disk_cache, cache_dir)
+    self.executor = None
+    # the renders submitted to the executor, cancelled when the server stops
+    self.futures = set()
+    self.started = None
+    self.counters = ObjDict({
+      'connections': 0,
+      'requests': 0,
+      'errors': 0,
+      'in_flight': 0,
+      'render_seconds': 0.0,
+    })
+
+  async def serve(self, ready=None):
+    """Serve until cancelled. `ready` is set once the socket accepts connections."""
+    if self.jobs == 1:
+      init_worker(*self.options)
+    else:
+      from concurrent.futures import ProcessPoolExecutor
+      self.executor = ProcessPoolExecutor(max_workers=self.jobs, initializer=init_worker, initargs=self.options)
+
+    remove_socket(self.socket_path)
+    server = await asyncio.start_unix_server(self.handle_connection, path=self.socket_path, limit=RenderServer.LineLimit)
+    self.started = monotonic()
+    try:
+      async with server:
+        if ready is not None:
+          ready.set()
+        await server.serve_forever()
+    finally:
+      if self.executor is not None:
+        # like shutdown(cancel_futures=True), which requires Python 3.9
+        for future in list(self.futures):
+          future.cancel()
+        self.executor.shutdown()
+        self.executor = None
+      remove_socket(self.socket_path)
+
+  async def handle_connection(self, reader, writer):
+    self.counters.connections += 1
+    responses = asyncio.Queue(maxsize=RenderServer.PipelineDepth)
+
+    async def write_responses():
+      while (response := await responses.get()) is not None:
+        writer.write((json.dumps(await response, ensure_ascii=False) + '\n').encode())
+        await writer.drain()
+
+    writer_task = asyncio.create_task(write_responses())
+    try:
+      while len(line := await reader.readline()) > 0:
+        await responses.put(asyncio.ensure_future(self.handle_request(line)))
+    except (ConnectionError, ValueError):
+      # the client is gone, or sent a line longer than LineLimit
+      pass
+    finally:
+      await responses.put(None)
+      try:
+        await writer_task
+      except ConnectionError:
+        pass
+      writer.close()
+      self.counters.connections -= 1
+
+  async def handle_request(self, line):
+    request_id = None
+    try:
+      request = json.loads(line)
+      if not isinstance(request, dict):
+        raise ValueError('A request must be a JSON object.')
+      request_id = request.get('id')
+      if request.get('stats'):
+        return {'id': request_id, 'stats': self.stats()}
+      if ('template' in request) == ('template_fn' in request):
+        raise ValueError('A request must have one of "template" or "template_fn".')
+    except ValueError as e:
+      self.counters.errors += 1
+      return {'id': request_id, 'error': f'Invalid request: {e}'}
+
+    self.counters.requests += 1
+    self.counters.in_flight += 1
+    start = perf_counter()
+    try:
+      if self.executor is None:
+        result = render_request(request)
+      else:
+        future = self.executor.submit(render_request, request)
+        self.futures.add(future)
+        future.add_done_callback(self.futures.discard)
+        result = await asyncio.wrap_future(future)
+      return {'id': request_id, 'result': result}
+    except Exception as e:
+      self.counters.errors += 1
+      return {'id': request_id, 'error': f'{type(e).__name__}: {e}'}
+    finally:
+      self.counters.in_flight -= 1
+      self.counters.render_seconds += perf_counter() - start
+
+  def stats(self):
+    counters = self.counters
+    return {
+      'uptime_seconds': monotonic() - self.started,
+      'jobs': self.jobs,
+      'connections': counters.connections,
+      'requests': counters.requests,
+      'errors': counters.errors,
+      'in_flight': counters.in_flight,
+      'mean_render_ms': 1000 * counters.render_seconds / counters.requests if counters.requests > 0 else 0.0,
+    }
+
+def render_request(request):
+  mext = worker.mext
+  mext.refresh_prompt_cache()
+  mext.files_read.clear()
+  params = ObjDict.convert_recursively(request.get('params') or {})
+  if 'template' in request:
+    return mext.compose(template=request['template'], params=params)
+  return mext.compose(template_fn=request['template_fn'], params=params)
+
+def remove_socket(socket_path):
+  try:
+    if stat.S_ISSOCK(os.stat(socket_path).st_mode):
+      os.remove(socket_path)
+  except FileNotFoundError:
+    pass
+
+def serve(socket_path, **kwargs):
+  """Run a RenderServer until SIGINT or SIGTERM."""
+  server = RenderServer(socket_path, **kwargs)
+
+  async def main():
+    task = asyncio.current_task()
+    loop = asyncio.get_running_loop()
+    for signum in [signal.SIGINT, signal.SIGTERM]:
+      loop.add_signal_handler(signum, task.cancel)
+    print(f'Serving on "{socket_path}" with {server.jobs} process(es).', file=sys.stderr)
+    try:
+      await server.serve()
+    except asyncio.CancelledError:
+      pass
+
+  asyncio.run(main())
@@ -0,0 +1,124 @@
+from itertools import islice
+from collections.abc import Mapping
+
+# the number of rows joined before writing them to the results
+WRITE_BATCH = 1024
+
+def get_columns(records, columns=None):
+  """Convert records to `(headers, columns)`, where each column is a list of values.
+
+  `records` can be a list of mappings, sequences or objects, a mapping of columns, or a
+  structured array (anything with `dtype.names`, such as a NumPy structured array).
+  `columns` selects the columns, as a list or a whitespace-separated string of keys,
+  each optionally followed by `=Header`.
+  """
+  if isinstance(columns, str):
+    columns = columns.split()
+  keys, headers = None, None
+  if columns is not None:
+    keys, headers = [], []
+    for column in columns:
+      key, _, header = column.partition('=') if isinstance(column, str) else (column, None, None)
+      keys.append(key)
+      headers.append(header or str(key))
+
+  if is_structured(records):
+    # a structured array is converted column by column, without going through its rows
+    if keys is None:
+      keys = list(records.dtype.names)
+    return headers or keys, [records[key].tolist() for key in keys]
+
+  if isinstance(records, Mapping):
+    if keys is None:
+      keys = list(records.keys())
+    values = [records[key] for key in keys]
+    return headers or [str(key) for key in keys], [value.tolist() if hasattr(value, 'tolist') else list(value) for value in values]
+
+  records = records.tolist() if hasattr(records, 'tolist') else list(records)
+  if len(records) == 0:
+    return headers or [], [[] for _ in keys or []]
+
+  first = records[0]
+  if isinstance(first, Mapping):
+    if keys is None:
+      keys = list(dict.fromkeys(key for record in records for key in record.keys()))
+    cols = [[record.get(key) for record in records] for key in keys]
+  elif isinstance(first, (list, tuple)):
+    if keys is None:
+      keys = list(range(max(map(len, records))))
+    else:
+      # sequences are accessed by position, keys only name the columns
+      keys = [key if isinstance(key, int) else index for index, key in enumerate(keys)]
+    cols = [[record[key] if key < len(record) else None for record in records] for key in keys]
+  else:
+    if keys is None:
+      raise TypeError(f"Columns must be given for records of type '{type(first).__name__}'")
+    cols = [[getattr(record, key, None) for record in records] for key in keys]
+  return headers or [str(key) for key in keys], cols
+
+def is_structured(records):
+  return getattr(getattr(records, 'dtype', None), 'names', None) is not None
+
+def format_cell(value):
+  return '' if value is None else str(value)
+
+def write_rows(write, rows, separator=''):
+  rows = iter(rows)
+  while len(batch := list(islice(rows, WRITE_BATCH))) > 0:
+    write(separator + '\n'.join(batch))
+    separator = '\n'
+
+def write_table(write, records, columns=None):
+  """Render records as a markdown table."""
+  headers, cols = get_columns(records, columns)
+  if len(headers) == 0:
+    return
+  escape = lambda value: format_cell(value).replace('|', '\\|').replace('\n', '<br>')
+  cells = [list(map(escape, col)) for col in cols]
+  write_rows(write, [
+    '| ' + ' | '.join(map(escape, headers)) + ' |',
+    '|' + '|'.join(['---'] * len(headers)) + '|',
+  ])
+  write_rows(write, ('| ' + ' | '.join(row) + ' |' for row in zip(*cells)), separator='\n')
+
+def write_csv(write, records, columns=None, delimiter=',', header=True):
+  """Render records as CSV, quoted as needed by the csv module."""
+  import csv
+  import io
+
+  headers, cols = get_columns(records, columns)
+  if len(headers) == 0:
+    return
+  rows = zip(*[list(map(format_cell, col)) for col in cols])
+  if header:
+    rows = [headers, *rows]
+
+  buffer = io.StringIO()
+  writer = csv.writer(buffer, delimiter=delimiter, lineterminator='\n')
+  rows = iter(rows)
+  separator = ''
+  while len(batch := list(islice(rows, WRITE_BATCH))) > 0:
+    writer.writerows(batch)
+    write(separator + buffer.getvalue()[:-1])
+    buffer.seek(0)
+    buffer.truncate()
+    separator = '\n'
+
+def write_bullets(write, items, columns=None, bullet='-', sep=': '):
+  """Render items as a bullet list. Nested lists are indented, and the columns of records
+  are joined with `sep`."""
+  if columns is not None or isinstance(items, Mapping) or is_structured(items) \
+      or (isinstance(items, (list, tuple)) and len(items) > 0 and isinstance(items[0], Mapping)):
+    _, cols = get_columns(items, columns)
+    items = [sep.join(map(format_cell, row)) for row in zip(*cols)]
+  elif hasattr(items, 'tolist'):
+    items = items.tolist()
+
+  def lines(items, indent):
+    for item in items:
+      if isinstance(item, (list, tuple)):
+        yield from lines(item, indent + '  ')
+      else:
+        yield f'{indent}{bullet} ' + format_cell(item).replace('\n', '\n' + indent + ' ' * (len(bullet)+1))
+
+  write_rows(write, lines(items, ''))
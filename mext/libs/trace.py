@@ -0,0 +1,70 @@
+from bisect import bisect_right
+from collections import deque
+
+from mext.libs.utils import ObjDict
+
+class RenderTrace:
+  """Records which component produced each piece of the output of a render.
+
+  Records are `(component index, output offset, length)` tuples kept in a ring buffer of
+  `capacity` entries, so only the end of a very large output is traced. With `sample_rate`
+  N, only 1 in N renders is traced; `sampled` tells whether the last render was.
+  """
+
+  def __init__(self, capacity=4096, sample_rate=1):
+    self.records = deque(maxlen=capacity)
+    self.sample_rate = sample_rate
+    self.renders = 0
+    self.sampled = False
+    self.components = None
+    self.template_fn = None
+    # the number of leading whitespaces removed by final_strip
+    self.strip_offset = 0
+
+  def __len__(self):
+    return len(self.records)
+
+  def __iter__(self):
+    return iter(self.records)
+
+  def begin(self, parser):
+    self.renders += 1
+    self.sampled = (self.renders - 1) % self.sample_rate == 0
+    if self.sampled:
+      self.records.clear()
+      self.components = parser.components
+      self.template_fn = parser.template_fn
+      self.strip_offset = 0
+    return self.sampled
+
+  def append(self, index, offset, length):
+    self.records.append((index, offset, length))
+
+  def finish(self, parser):
+    if parser.options['final_strip']:
+      output = parser.results.getvalue()
+      self.strip_offset = len(output) - len(output.lstrip())
+
+  def locate(self, offset):
+    """Find where the character at `offset` of the last traced result comes from.
+
+    Returns None for whitespace kept between components, or if the record was dropped.
+    """
+    records = list(self.records)
+    offset += self.strip_offset
+    index = bisect_right([record[1] for record in records], offset) - 1
+    if index < 0:
+      return None
+    component_index, start, length = records[index]
+    if offset >= start + length:
+      return None
+
+    component = self.components[component_index]
+    return ObjDict({
+      'component_index': component_index,
+      'template_fn': self.template_fn,
+      'lineno': component.lineno,
+      'field_name': component.field_name,
+      'offset': start - self.strip_offset,
+      'length': length,
+    })
@@ -1,8 +1,7 @@
-import sys
-from typing import Any
 import os
-import traceback
 import re
+import copy
+from collections import OrderedDict
 
 def ensure_folder_exists(fn):
   folder = os.path.dirname(fn)
@@ -10,6 +9,7 @@ def ensure_folder_exists(fn):
     os.makedirs(folder, exist_ok=True)
 
 def format_exception(exc):
+  import traceback
   return ''.join(traceback.format_exception_only(type(exc), exc)).strip()
 
 def indent_lines(s_lines: str, indent):
@@ -17,28 +17,132 @@ def indent_lines(s_lines: str, indent):
   s_indented, _ = re.subn(r'(^|\n)', fr'\1{indent_spaces}', s_lines)
   return s_indented
 
+def fence_length(content, min_fence_num=3):
+  max_block_fences = min_fence_num-1
+  for block_fence in re.finditer(r'\`{3,}', content):
+    max_block_fences = max(max_block_fences, block_fence.end() - block_fence.start())
+  return max_block_fences+1
+
 def fence_content(content, spec='', min_fence_num=3, marker='`'):
-  block_fences = re.findall(r'\`{3,}', content)
-  max_block_fences = max([*map(len, block_fences), min_fence_num-1])
-  fence = marker*(max_block_fences+1)
+  fence = marker*fence_length(content, min_fence_num)
   return f'{fence}{spec}\n{content}\n{fence}'
 
+def write_fenced_content(write, content, spec='', min_fence_num=3, marker='`'):
+  fence = marker*fence_length(content, min_fence_num)
+  write(f'{fence}{spec}\n')
+  write(content)
+  write(f'\n{fence}')
+
+HashableScalars = frozenset([str, int, bool, bytes, type(None)])
+
+def make_hashable(value):
+  # only plain data is supported, as the identity of other objects says nothing about their content
+  value_type = type(value)
+  if value_type in HashableScalars:
+    return (value_type, value)
+  if value_type is float:
+    # -0.0 == 0.0 but they are formatted differently
+    return (float, repr(value))
+  if isinstance(value, dict):
+    return (value_type, tuple([(make_hashable(k), make_hashable(v)) for k, v in value.items()]))
+  if isinstance(value, (list, tuple)):
+    return (value_type, tuple([make_hashable(item) for item in value]))
+  if isinstance(value, (set, frozenset)):
+    return (value_type, frozenset([make_hashable(item) for item in value]))
+  if isinstance(value, (str, int, float)):
+    return (value_type, value)
+  raise TypeError(f"Unable to make '{value_type.__name__}' hashable")
+
+PlainTypes = (str, int, float, bool, bytes, dict, list, tuple, set, frozenset, type(None))
+_PlainDataPickler = None
+
+def make_key(value):
+  """Return the content of `value`, plain data as for `make_hashable`, as bytes.
+
+  Much cheaper than `make_hashable` on large values, as the content is serialized by pickle.
+  Equal values may still give different keys, e.g. sets or values sharing objects differently.
+  """
+  global _PlainDataPickler
+  import io
+  import pickle
+
+  if _PlainDataPickler is None:
+    class _PlainDataPickler(pickle.Pickler):
+      # only called for the objects that are not exactly of a builtin type
+      def reducer_override(self, obj):
+        if isinstance(obj, dict):
+          return type(obj), (dict(obj),)
+        if isinstance(obj, list):
+          return type(obj), (list(obj),)
+        if isinstance(obj, PlainTypes) or (isinstance(obj, type) and issubclass(obj, PlainTypes)):
+          return NotImplemented
+        raise TypeError(f"Unable to make '{type(obj).__name__}' a key")
+
+  f = io.BytesIO()
+  try:
+    _PlainDataPickler(f, protocol=pickle.HIGHEST_PROTOCOL).dump(value)
+  except pickle.PicklingError as e:
+    raise TypeError(str(e)) from e
+  return f.getvalue()
+
+class LRUCache:
+  def __init__(self, maxsize=128):
+    self.maxsize = maxsize
+    self.data = OrderedDict()
+    self.hits = 0
+    self.misses = 0
+
+  def __len__(self):
+    return len(self.data)
+
+  def __contains__(self, key):
+    return key in self.data
+
+  def get(self, key, default=None):
+    if key in self.data:
+      self.data.move_to_end(key)
+      self.hits += 1
+      return self.data[key]
+    self.misses += 1
+    return default
+
+  def put(self, key, value):
+    self.data[key] = value
+    self.data.move_to_end(key)
+    if self.maxsize is not None and len(self.data) > self.maxsize:
+      self.data.popitem(last=False)
+
+  def clear(self):
+    self.data.clear()
+
 class ObjDict(dict):
   def __init__(self, *args, **kwargs):
     super().__init__(*args, **kwargs)
 
-  def __getattribute__(self, __name: str) -> Any:
+  def __getattribute__(self, __name: str) -> object:
     try:
       return super().__getattribute__(__name)
     except AttributeError:
+      pass
+    try:
       return self[__name]
+    except KeyError:
+      # getattr with a default, hasattr and pickle expect an AttributeError for missing attributes
+      raise AttributeError(f"'{type(self).__name__}' object has no attribute '{__name}'") from None
 
-  def __setattr__(self, __name: str, __value: Any) -> None:
+  def __setattr__(self, __name: str, __value: object) -> None:
     self[__name] = __value
 
   def __delattr__(self, __name: str) -> None:
     del self[__name]
 
+  def __deepcopy__(self, memo):
+    objdict = ObjDict()
+    memo[id(self)] = objdict
+    for k, v in self.items():
+      objdict[copy.deepcopy(k, memo)] = copy.deepcopy(v, memo)
+    return objdict
+
   @classmethod
   def convert_recursively(cls, _v):
     objdict = None
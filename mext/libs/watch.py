@@ -0,0 +1,32 @@
+import sys
+import time
+
+from mext.libs.build import stamp
+from mext.libs.utils import format_exception
+
+def wait_for_changes(files, interval=0.5):
+  """Poll the stamps of `files` until one of them changes. Returns the changed files."""
+  stamps = {fn: stamp(fn) for fn in files}
+  while True:
+    time.sleep(interval)
+    changed = [fn for fn, value in stamps.items() if stamp(fn) != value]
+    if len(changed) > 0:
+      return changed
+
+def watch(render, interval=0.5):
+  """Call `render` again each time one of the files it read changes, until interrupted.
+
+  `render` returns the files it read. If it raises, the error is printed and the files of the
+  previous call are watched again.
+  """
+  files = []
+  try:
+    while True:
+      try:
+        files = render()
+      except Exception as e:
+        print(format_exception(e), file=sys.stderr)
+      changed = wait_for_changes(dict.fromkeys(files), interval=interval)
+      print(f'Changed: {", ".join(changed)}', file=sys.stderr)
+  except KeyboardInterrupt:
+    pass
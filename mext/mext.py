@@ -13,20 +13,21 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
-import re
-import json
-from os import path
+from __future__ import annotations
+
+import os
 from string import Formatter
+from time import perf_counter
 from contextlib import contextmanager
-from typing import Union, Tuple, Coroutine, Callable
-import traceback
 
-from mext.libs.config_loader import CFG
-from mext.libs.utils import ObjDict
-from mext.mext_parser import MextParser
+from mext.libs.utils import ObjDict, LRUCache, make_hashable
+from mext.mext_parser import MextParser, file_stamp
+from mext.mext_compiler import CompiledTemplate
 
 class Mext:
   PROMPT_CACHE = {}
+  # the (mtime, size) of the files in PROMPT_CACHE when they were read
+  PROMPT_STAMPS = {}
 
   def __init__(self):
     self.parser = MextParser()
@@ -34,9 +35,17 @@ class Mext:
     self.template_fn = None
     self.params = {}
     self.callbacks = {}
+    self.render_cache = None
+    self.dependencies = {}
+    self.metrics = None
+    self.files_read = None
 
   def set_parser(self, parser: MextParser):
     self.parser = parser
+    if self.metrics is not None:
+      self.parser.metrics = self.metrics
+    if self.files_read is not None:
+      self.parser.files_read = self.files_read
 
   @contextmanager
   def use_template(self, template=None, template_fn=None):
@@ -70,7 +79,7 @@ class Mext:
       self.clear_callbacks()
       self.set_callbacks(**old_callbacks)
 
-  def set_template(self, template=None, template_fn=None):
+  def set_template(self, template: str | CompiledTemplate=None, template_fn=None):
     if template_fn is not None:
       template = self._load_template(template_fn)
     if template is None:
@@ -99,21 +108,168 @@ class Mext:
   def has_callback(self, callback_name):
     return callback_name in self.callbacks
 
+  def enable_render_cache(self, maxsize=128):
+    self.render_cache = LRUCache(maxsize)
+
+  def disable_render_cache(self):
+    self.render_cache = None
+    self.dependencies = {}
+
+  def enable_metrics(self, registry=None):
+    """Record render metrics in `registry`, or in a new MetricsRegistry. Returns the registry."""
+    from mext.libs.metrics import MetricsRegistry
+
+    self.metrics = registry if registry is not None else MetricsRegistry()
+    self.parser.metrics = self.metrics
+    return self.metrics
+
+  def disable_metrics(self):
+    self.metrics = None
+    self.parser.metrics = None
+
+  def enable_file_tracking(self):
+    """Record the files read by the following renders in `files_read`, in the order they are first read.
+
+    These are the rendered and included templates, and the imported files. Renders served from the
+    render cache record the files found by the dependency analysis.
+    """
+    self.files_read = {}
+    self.parser.files_read = self.files_read
+
+  def disable_file_tracking(self):
+    self.files_read = None
+    self.parser.files_read = None
+
+  def _render_cache_key(self, template, template_fn, params):
+    template_key = (template, template_fn)
+    # the dependencies are analyzed again when the template or a file it reads changed
+    cached = self.dependencies.get(template_key)
+    if cached is None or self._dependency_stamps(template_fn, cached[0]) != cached[1]:
+      deps = self.parser.analyze(template=template, template_fn=template_fn, template_loader=self._load_template)
+      cached = (deps, self._dependency_stamps(template_fn, deps))
+      self.dependencies[template_key] = cached
+    deps, stamps = cached
+
+    if not deps.complete or deps.has_input or not deps.formatters.issubset(self.parser.pure_formatters):
+      return None
+
+    str_formatter = Formatter()
+    values = []
+    for varname in sorted(deps.variables):
+      try:
+        value, _ = str_formatter.get_field(varname, args=[], kwargs=params)
+      except Exception:
+        values.append(None)
+        continue
+      try:
+        values.append(make_hashable(value))
+      except TypeError:
+        return None
+
+    if None in stamps:
+      return None
+
+    # formatters registered again under the same name render differently
+    formatters = tuple(self.parser.formatters[name] for name in sorted(deps.formatters))
+
+    return template_key, tuple(values), stamps, formatters
+
+  def _dependency_stamps(self, template_fn, deps):
+    files = [template_fn] if template_fn is not None else []
+    return tuple(file_stamp(fn) for fn in [*files, *sorted(deps.includes), *sorted(deps.imports)])
+
   def _load_template(self, template_fn):
     return self._load_prompt(f"{template_fn}")
 
   def _load_prompt(self, prompt_source, reload=False):
-    if not reload and prompt_source in Mext.PROMPT_CACHE:
-      return Mext.PROMPT_CACHE[prompt_source]
+    if not reload:
+      cached = prompt_source in Mext.PROMPT_CACHE
+      if self.metrics is not None:
+        self.metrics.cache_lookup('template', cached)
+      if cached:
+        return Mext.PROMPT_CACHE[prompt_source]
 
     with open(prompt_source) as f:
+      stat = os.fstat(f.fileno())
       prompt = ''.join(f.readlines())
     Mext.PROMPT_CACHE[prompt_source] = prompt
+    Mext.PROMPT_STAMPS[prompt_source] = (stat.st_mtime_ns, stat.st_size)
 
     return prompt
 
+  @classmethod
+  def refresh_prompt_cache(cls):
+    """Drop the cached templates whose files changed since they were read. Returns these files."""
+    changed = []
+    for fn, cached_stamp in list(cls.PROMPT_STAMPS.items()):
+      try:
+        stat = os.stat(fn)
+        file_stamp = (stat.st_mtime_ns, stat.st_size)
+      except OSError:
+        file_stamp = None
+      if file_stamp != cached_stamp:
+        changed.append(fn)
+        del cls.PROMPT_STAMPS[fn]
+        cls.PROMPT_CACHE.pop(fn, None)
+    return changed
+
   def compose(self, template=None, template_fn=None, params={}, callbacks={},
-      **kwargs) -> Union[str, Tuple[str, dict]]:
+      **kwargs) -> str | tuple[str, dict]:
+    if template is None and template_fn is None:
+      if len(self.template) == 0 and self.template_fn is None:
+        raise ValueError("Neither template or template file is provided. Check if the value is None.")
+      template = self.template
+      template_fn = self.template_fn
+
+    all_kwargs = {
+      **self.params,
+      **params,
+      **kwargs,
+    }
+
+    if self.metrics is not None:
+      start = perf_counter()
+
+    cache_key = None
+    if self.render_cache is not None and len(callbacks) == 0:
+      cache_key = self._render_cache_key(template, template_fn, all_kwargs)
+      if cache_key is not None:
+        cached_result = self.render_cache.get(cache_key)
+        if self.metrics is not None:
+          self.metrics.cache_lookup('render', cached_result is not None)
+        if cached_result is not None:
+          if self.metrics is not None:
+            self._record_render(template_fn, start, cached_result)
+          if self.files_read is not None:
+            deps, _ = self.dependencies[cache_key[0]]
+            for fn in [template_fn, *sorted(deps.includes), *sorted(deps.imports)]:
+              if fn is not None:
+                self.parser.track_file(fn)
+          return cached_result
+
+    parser = self.parser
+    try:
+      parsed_result = parser.parse(template=template, template_fn=template_fn, params=all_kwargs, callbacks=callbacks, template_loader=self._load_template)
+    except Exception:
+      if self.metrics is not None:
+        self.metrics.inc('mext_render_errors_total', template=template_fn)
+      raise
+    if cache_key is not None:
+      self.render_cache.put(cache_key, parsed_result)
+    if self.metrics is not None:
+      self._record_render(template_fn, start, parsed_result)
+
+    if len(callbacks) == 0:
+      return parsed_result
+    else:
+      return parsed_result, parser.input_results
+
+  async def compose_async(self, template=None, template_fn=None, params={}, callbacks={},
+      **kwargs) -> str | tuple[str, dict]:
+    """Like `compose`, but the async formatters are awaited in the running event loop. See `MextParser.parse_async`.
+
+    The render cache is not used.
+    """
     if template is None and template_fn is None:
       if len(self.template) == 0 and self.template_fn is None:
         raise ValueError("Neither template or template file is provided. Check if the value is None.")
@@ -126,10 +282,125 @@ class Mext:
       **kwargs,
     }
 
+    if self.metrics is not None:
+      start = perf_counter()
     parser = self.parser
-    parsed_result = parser.parse(template=template, template_fn=template_fn, params=all_kwargs, callbacks=callbacks, template_loader=self._load_template)
+    try:
+      parsed_result = await parser.parse_async(template=template, template_fn=template_fn, params=all_kwargs, callbacks=callbacks, template_loader=self._load_template)
+    except Exception:
+      if self.metrics is not None:
+        self.metrics.inc('mext_render_errors_total', template=template_fn)
+      raise
+    if self.metrics is not None:
+      self._record_render(template_fn, start, parsed_result)
 
     if len(callbacks) == 0:
       return parsed_result
     else:
       return parsed_result, parser.input_results
+
+  def compose_resumable(self, template=None, template_fn=None, params={}, callbacks={},
+      **kwargs) -> ObjDict:
+    """Like `compose`, but the render stops at the first `@input` without a callback. See `MextParser.parse_resumable`.
+
+    The continuation returned can be stored, and the render continued by `resume` in any process
+    once the input is available. The render cache is not used.
+    """
+    if template is None and template_fn is None:
+      if len(self.template) == 0 and self.template_fn is None:
+        raise ValueError("Neither template or template file is provided. Check if the value is None.")
+      template = self.template
+      template_fn = self.template_fn
+
+    all_kwargs = {
+      **self.params,
+      **params,
+      **kwargs,
+    }
+    return self._render_resumable(template_fn, lambda parser: parser.parse_resumable(
+      template=template, template_fn=template_fn, params=all_kwargs, callbacks=callbacks, template_loader=self._load_template))
+
+  def resume(self, continuation, input_value, template=None, template_fn=None, params={}, callbacks={},
+      **kwargs) -> ObjDict:
+    """Continue a render of `compose_resumable` with the value of its input. Returns like `compose_resumable`.
+
+    The template file is taken from the continuation. Other templates must be given again, along with the same params.
+    """
+    if template is None and template_fn is None and continuation.get('template_fn') is None:
+      template = self.template
+
+    all_kwargs = {
+      **self.params,
+      **params,
+      **kwargs,
+    }
+    template_fn = template_fn if template_fn is not None else continuation.get('template_fn')
+    return self._render_resumable(template_fn, lambda parser: parser.resume(continuation, input_value,
+      template=template, template_fn=template_fn, params=all_kwargs, callbacks=callbacks, template_loader=self._load_template))
+
+  def _render_resumable(self, template_fn, render):
+    if self.metrics is not None:
+      start = perf_counter()
+    try:
+      rendered = render(self.parser)
+    except Exception:
+      if self.metrics is not None:
+        self.metrics.inc('mext_render_errors_total', template=template_fn)
+      raise
+    if self.metrics is not None and rendered.result is not None:
+      self._record_render(template_fn, start, rendered.result)
+    return rendered
+
+  def _record_render(self, template_fn, start, result):
+    self.metrics.inc('mext_renders_total', template=template_fn)
+    self.metrics.observe('mext_render_duration_seconds', perf_counter() - start, template=template_fn)
+    self.metrics.observe('mext_output_size_bytes', len(result), template=template_fn)
+
+  def incremental(self, template=None, template_fn=None) -> 'IncrementalRender':
+    """Create a render handle that only renders the new iterations of append-only loops."""
+    from mext.mext_incremental import IncrementalRender
+
+    if template is None and template_fn is None:
+      template = self.template
+      template_fn = self.template_fn
+    return IncrementalRender(self, template=template, template_fn=template_fn)
+
+  def pool(self, jobs=None, template=None, template_fn=None) -> 'RenderPool':
+    """Create a pool of `jobs` forked processes rendering the template with the current params.
+
+    See `RenderPool`. Changes to this Mext after the pool is created are not seen by the pool.
+    """
+    from mext.mext_pool import RenderPool
+
+    if template is None and template_fn is None:
+      template = self.template
+      template_fn = self.template_fn
+    return RenderPool(self, jobs=jobs, template=template, template_fn=template_fn)
+
+  def specialize(self, template=None, template_fn=None, **static_params) -> 'Mext':
+    """Create a Mext whose template is pre-rendered against the current and given params.
+
+    The parts of the template that only depend on these params are folded at this point.
+    Overriding any of them in later calls to `compose` has no effect on the folded parts.
+    The longest static prefix of the output is available as `template.static_prefix`.
+    """
+    if template is None and template_fn is None:
+      if len(self.template) == 0 and self.template_fn is None:
+        raise ValueError("Neither template or template file is provided. Check if the value is None.")
+      template = self.template
+      template_fn = self.template_fn
+
+    params = {
+      **self.params,
+      **static_params,
+    }
+    residual = self.parser.specialize(template=template, template_fn=template_fn, params=params, template_loader=self._load_template)
+
+    specialized = Mext()
+    specialized.metrics = self.metrics
+    specialized.files_read = self.files_read
+    specialized.set_parser(self.parser)
+    specialized.set_template(template=residual)
+    specialized.set_params(**params)
+    specialized.set_callbacks(**self.callbacks)
+    return specialized
@@ -0,0 +1,763 @@
+# Copyright (C) 2024 Mext-lang team
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import re
+import operator
+from string import Formatter
+from collections import namedtuple
+from _string import formatter_field_name_split
+
+from mext.libs.utils import ObjDict
+
+# A component is a literal text followed by an optional field or statement.
+# Components produced by the optimization passes carry an `op` that is executed
+# in place of the original statement (see `MextParser.exec_*`).
+# `filters` are the formatters applied to a field, as in `{name|lower|escape}`.
+Component = namedtuple('Component', [
+  'literal_text',
+  'field_name',
+  'format_spec',
+  'conversion',
+  'keyword',
+  'statement',
+  'lineno',
+  'op',
+  'value',
+  'filters',
+], defaults=(None, None, None))
+
+class CompiledTemplate:
+  # bump when the layout of the compiled form changes to invalidate on-disk caches
+  FORMAT_VERSION = 3
+
+  def __init__(self, components, template=None, template_fn=None):
+    self.components = components
+    self.template = template
+    self.template_fn = template_fn
+    self.static_prefix = None
+    # the sources of the files inlined into this template, keyed by path
+    self.dependencies = {}
+
+  def __len__(self):
+    return len(self.components)
+
+  @classmethod
+  def compile(cls, template, template_fn=None):
+    components = []
+    lineno = 1
+    for literal_text, field_name, format_spec, conversion in Formatter().parse(template):
+      keyword = None
+      statement = field_name
+      filters = None
+      if field_name is not None and field_name.startswith("@"):
+        parts = field_name[1:].split(' ', 1)
+        keyword = parts[0]
+        statement = parts[1].strip() if len(parts) > 1 else None
+      elif field_name is not None and '|' in field_name:
+        field_name, filters = cls.split_filters(field_name)
+        statement = field_name
+
+      lineno += literal_text.count('\n')
+      components.append(Component(literal_text, field_name, format_spec, conversion, keyword, statement, lineno, filters=filters))
+    return cls(components, template=template, template_fn=template_fn)
+
+  @classmethod
+  def split_filters(cls, field_name):
+    # filters are taken from the end, so a `|` inside an index such as `{table[a|b]}` is kept
+    filters = []
+    while (m := re.search(r'\|\s*(\w+)\s*$', field_name)) is not None:
+      filters.append(m[1])
+      field_name = field_name[:m.start()]
+    if len(filters) == 0:
+      return field_name, None
+    return field_name.strip(), tuple(reversed(filters))
+
+class FieldAccessor:
+  """A field name such as `a.b[0].c`, split once and resolved with specialized steps.
+
+  Each step keeps the type of the last object it was applied to and the getter chosen for
+  that type. Attribute access on an `ObjDict` is done as a dict lookup when the key does not
+  name an attribute of `ObjDict` itself, which skips `ObjDict.__getattribute__`.
+  `resolve` raises on any failure, in which case `string.Formatter.get_field` is authoritative.
+  """
+
+  __slots__ = ['field_name', 'is_literal', 'literal', 'root', 'steps', 'cache']
+
+  def __init__(self, field_name, regexps):
+    self.field_name = field_name
+    self.is_literal = True
+    if re.match(fr'^{regexps.integer}$', field_name):
+      self.literal = int(field_name)
+    elif re.match(fr'^{regexps.float}$', field_name):
+      self.literal = float(field_name)
+    elif re.match(fr'^{regexps.quoted_string}$', field_name):
+      self.literal = str(field_name[1:-1])
+    else:
+      self.is_literal = False
+      self.literal = None
+      root, rest = formatter_field_name_split(field_name)
+      # a numeric root refers to a positional argument, which is left to `Formatter`
+      self.root = root if isinstance(root, str) else None
+      self.steps = [(key, is_attr and not hasattr(ObjDict, key)) if is_attr else (key, None) for is_attr, key in rest]
+      self.cache = [(None, None)] * len(self.steps)
+
+  def resolve(self, variables):
+    """Resolve the field in `variables`, a sequence of mappings searched in order."""
+    if self.is_literal:
+      return self.literal
+
+    root = self.root
+    if root is None:
+      raise LookupError(self.field_name)
+    for scope in variables:
+      if root in scope:
+        value = scope[root]
+        break
+    else:
+      raise KeyError(root)
+
+    cache = self.cache
+    for index, (key, objdict_key) in enumerate(self.steps):
+      value_type = type(value)
+      cached_type, getter = cache[index]
+      if value_type is not cached_type:
+        if objdict_key is None:
+          getter = operator.getitem
+        elif objdict_key and value_type is ObjDict:
+          getter = dict.__getitem__
+        else:
+          getter = getattr
+        cache[index] = (value_type, getter)
+      try:
+        value = getter(value, key)
+      except KeyError:
+        if getter is not dict.__getitem__:
+          raise
+        # as raised by ObjDict.__getattribute__
+        raise AttributeError(f"'ObjDict' object has no attribute '{key}'") from None
+    return value
+
+class UnstructuredTemplate(Exception):
+  pass
+
+class DynamicValue(Exception):
+  pass
+
+class MextSpecializer:
+  """Partially evaluates a compiled template against a set of static params.
+
+  Fields, conditions, assignments and imports that only depend on static values are
+  folded into ops, leaving the dynamic parts untouched. The result is a residual
+  `CompiledTemplate` that renders identically given the same static params.
+  """
+
+  # keywords that assign to a local variable named by the first word of the statement
+  AssigningKeywords = ['set', 'default', 'count', 'input']
+  # keywords that do not produce output and whose effect is fully known at compile time
+  StaticKeywords = ['option', 'trim_newline']
+
+  def __init__(self, evaluator, params, fold_imports=True, fold_filters=True):
+    self.evaluator = evaluator
+    self.params = params
+    self.fold_imports = fold_imports
+    self.fold_filters = fold_filters
+    self.env = {
+      **evaluator.Constants,
+      **params,
+    }
+    self.unknown = set()
+    self.final_strip = True
+    self.scopes = []
+    # params overridden by the params of the inlined include being specialized
+    self.shadowed = set()
+
+  def specialize(self, compiled: CompiledTemplate):
+    self.evaluator.set_template(template=compiled)
+    components = compiled.components
+    try:
+      residual, index = self.specialize_block(components, 0, dynamic=False)
+      if index != len(components):
+        raise UnstructuredTemplate()
+    except UnstructuredTemplate:
+      residual = list(components)
+      self.final_strip = None
+
+    specialized = CompiledTemplate(residual, template=compiled.template, template_fn=compiled.template_fn)
+    specialized.dependencies = compiled.dependencies
+    specialized.static_prefix = self.compute_static_prefix(specialized)
+    return specialized
+
+  def is_static(self, field_name):
+    reg = self.evaluator.RegExps
+    if re.match(fr'^(?:{reg.number}|{reg.quoted_string})$', field_name):
+      return True
+    root = re.match(r'[^.\[]*', field_name)[0]
+    return root in self.env and root not in self.unknown
+
+  def evaluate(self, component, fn, *args):
+    evaluator = self.evaluator
+    evaluator.state = component
+    evaluator.params = self.env
+    evaluator.locals = {}
+    return fn(*args)
+
+  def assign(self, varname, value, dynamic):
+    if dynamic:
+      self.unknown.add(varname)
+    else:
+      self.env[varname] = value
+      self.unknown.discard(varname)
+
+  def mark_unknown(self, components):
+    for component in components:
+      if component.op == 'assign':
+        self.unknown.add(component.value[0])
+      elif component.op == 'update':
+        self.poison()
+      elif component.keyword in self.AssigningKeywords and component.statement is not None:
+        self.unknown.add(component.statement.split(' ', 1)[0])
+      elif component.keyword == 'for' and component.statement is not None:
+        varnames = component.statement.split(' in ', 1)[0]
+        self.unknown.update(map(str.strip, varnames.split(',')))
+      elif component.keyword == 'import':
+        m = re.search(r'\s+as\s+(\S+)$', component.statement or '')
+        if m is None:
+          self.poison()
+        else:
+          self.unknown.add(m[1])
+      elif component.keyword == 'option' and (component.statement or '').startswith('final_strip'):
+        self.final_strip = None
+
+  def poison(self):
+    # an import without namespace may shadow any variable
+    self.env = {}
+    self.unknown = set()
+
+  def find_block_end(self, components, index, end_keyword, open_keywords):
+    depth = 0
+    while index < len(components):
+      keyword = components[index].keyword
+      if keyword in open_keywords:
+        depth += 1
+      elif keyword == end_keyword:
+        if depth == 0:
+          return index
+        depth -= 1
+      index += 1
+    raise UnstructuredTemplate()
+
+  def specialize_block(self, components, index, dynamic, stop_keywords=[]):
+    residual = []
+    while index < len(components):
+      component = components[index]
+      keyword = component.keyword
+
+      if keyword in stop_keywords:
+        return residual, index
+      elif component.op == 'assign':
+        self.assign(*component.value, dynamic)
+        residual.append(component)
+      elif component.op == 'update':
+        if dynamic:
+          self.poison()
+        else:
+          self.env.update(component.value)
+        residual.append(component)
+      elif component.op == 'enter_scope':
+        # an inlined include starts with the params only, see `MextParser.exec_enter_scope`
+        self.scopes.append((self.env, self.unknown, self.final_strip, self.shadowed, self.evaluator.template_fn))
+        self.evaluator.template_fn = component.value[0]
+        self.shadowed = self.shadowed.union(key for key, _ in component.value[1])
+        self.env = {
+          **self.evaluator.Constants,
+          **self.params,
+        }
+        self.unknown = set(self.shadowed)
+        self.final_strip = True
+        residual.append(component)
+      elif component.op == 'exit_scope':
+        self.env, self.unknown, self.final_strip, self.shadowed, self.evaluator.template_fn = self.scopes.pop()
+        residual.append(component)
+      elif component.op is not None or component.field_name is None:
+        residual.append(component)
+      elif keyword is None:
+        residual.append(self.specialize_field(component))
+      elif keyword == 'if':
+        index = self.specialize_if(components, index, residual, dynamic)
+        continue
+      elif keyword == 'for':
+        end_index = self.find_block_end(components, index+1, 'endfor', ['for'])
+        body = components[index+1:end_index]
+        self.mark_unknown([component, *body])
+        body_residual, _ = self.specialize_block(body, 0, dynamic=True)
+        residual.extend([component, *body_residual, components[end_index]])
+        index = end_index + 1
+        continue
+      elif keyword == 'cache':
+        # the block is skipped when its output is cached, while the locals it sets are restored
+        end_index = self.find_block_end(components, index+1, 'endcache', ['cache'])
+        body = components[index+1:end_index]
+        self.mark_unknown(body)
+        body_residual, _ = self.specialize_block(body, 0, dynamic=True)
+        residual.extend([component, *body_residual, components[end_index]])
+        index = end_index + 1
+        continue
+      elif keyword == 'comment':
+        end_index = self.find_block_end(components, index+1, 'endcomment', ['comment'])
+        residual.extend(components[index:end_index+1])
+        index = end_index + 1
+        continue
+      elif keyword in ['elif', 'else', 'endif', 'endfor', 'endcache', 'endcomment']:
+        raise UnstructuredTemplate()
+      else:
+        residual.append(self.specialize_statement(component, dynamic))
+      index += 1
+
+    return residual, index
+
+  def specialize_field(self, component):
+    evaluator = self.evaluator
+    if not self.is_static(component.field_name):
+      return component
+    if component.filters is not None and \
+        (not self.fold_filters or not evaluator.pure_formatters.issuperset(component.filters)
+          or not evaluator.async_formatters.isdisjoint(component.filters)):
+      return component
+    try:
+      field_value = self.evaluate(component, evaluator.get_field_value, component.field_name)
+      if component.filters is not None:
+        field_value = self.evaluate(component, evaluator.filter_field, field_value, component.filters)
+      field_value = evaluator.str_formatter.convert_field(field_value, component.conversion)
+      field_value = evaluator.str_formatter.format_field(field_value, component.format_spec)
+    except Exception:
+      return component
+    return component._replace(op='text', value=str(field_value))
+
+  def specialize_statement(self, component, dynamic):
+    evaluator = self.evaluator
+    keyword = component.keyword
+    statement = component.statement
+
+    if keyword in self.StaticKeywords:
+      if keyword == 'option' and (statement or '').startswith('final_strip'):
+        self.final_strip = None if dynamic else (statement.split(' ', 1)[-1] == 'on')
+      return component
+    if keyword not in ['set', 'default', 'count', 'import'] or (keyword == 'import' and not self.fold_imports):
+      self.mark_unknown([component])
+      return component
+
+    try:
+      if keyword == 'import':
+        m = re.match(evaluator.Statements['import'], statement)
+        if m is None or (m['filepath_var'] is not None and not self.is_static(m['filepath_var'])):
+          raise DynamicValue()
+        varname, imported = self.evaluate(component, evaluator.load_import)
+        if varname is None:
+          if dynamic:
+            self.poison()
+          else:
+            self.env.update(imported)
+            self.unknown.difference_update(imported.keys())
+          return component._replace(op='update', value=imported)
+        self.assign(varname, imported, dynamic)
+        return component._replace(op='assign', value=(varname, imported))
+
+      parts = statement.split(' ', 1)
+      varname = parts[0]
+      if keyword == 'count':
+        if not self.is_static(varname):
+          raise DynamicValue()
+        try:
+          value = self.evaluate(component, evaluator.get_field_value, varname) + 1
+        except Exception:
+          value = 0
+      else:
+        if len(parts) != 2 or not self.is_static(parts[1]):
+          raise DynamicValue()
+        if keyword == 'default':
+          if varname in self.env and varname not in self.unknown:
+            return component._replace(op='nop', value=0)
+          raise DynamicValue()
+        value = self.evaluate(component, evaluator.get_field_value, parts[1])
+    except Exception:
+      self.mark_unknown([component])
+      return component
+
+    self.assign(varname, value, dynamic)
+    return component._replace(op='assign', value=(varname, value))
+
+  def test_condition(self, component):
+    if component.keyword == 'else':
+      return True
+    m = re.match(self.evaluator.Statements['test'], component.statement or '')
+    if m is None or not self.is_static(m['varname']):
+      return None
+    try:
+      return self.evaluate(component, self.evaluator.test_statement, component.statement)
+    except Exception:
+      return None
+
+  def specialize_if(self, components, index, residual, dynamic):
+    head = components[index]
+    markers = [head]
+    conditions = []
+    branches = []
+    index += 1
+    while True:
+      marker = markers[-1]
+      if marker.keyword == 'else' and marker.statement is not None:
+        raise UnstructuredTemplate()
+
+      if True in conditions:
+        condition = False # unreachable branch
+      else:
+        condition = self.test_condition(marker)
+      conditions.append(condition)
+
+      if condition is False:
+        # the branch is never executed, so it must not affect the known variables
+        saved = (dict(self.env), set(self.unknown), self.final_strip)
+        body, index = self.specialize_block(components, index, dynamic=True, stop_keywords=['elif', 'else', 'endif'])
+        self.env, self.unknown, self.final_strip = saved
+      else:
+        is_dynamic = dynamic or None in conditions
+        body, index = self.specialize_block(components, index, dynamic=is_dynamic, stop_keywords=['elif', 'else', 'endif'])
+      branches.append(body)
+
+      if index >= len(components):
+        raise UnstructuredTemplate()
+      markers.append(components[index])
+      index += 1
+      if markers[-1].keyword == 'endif':
+        if markers[-1].statement is not None:
+          raise UnstructuredTemplate()
+        break
+
+    kept = []
+    for branch_index, condition in enumerate(conditions):
+      if condition is False:
+        continue
+      kept.append(branch_index)
+      if condition is True:
+        break
+
+    # Only the literal before the statement of the first marker, the bodies of the taken
+    # branch and the literal ending it are processed at runtime, so the residual keeps
+    # exactly those, with nops standing in for the removed statements.
+    if len(kept) == 0:
+      residual.append(head._replace(keyword=None, op='nop', value=0))
+    elif conditions[kept[0]] is True:
+      branch_index = kept[0]
+      residual.append(head._replace(keyword=None, op='nop', value=1))
+      residual.extend(branches[branch_index])
+      residual.append(markers[branch_index+1]._replace(keyword=None, op='nop', value=-1))
+    else:
+      literal_text = head.literal_text
+      for order, branch_index in enumerate(kept):
+        marker = markers[branch_index]
+        if order == 0:
+          marker = marker._replace(keyword='if')
+        elif conditions[branch_index] is True:
+          marker = marker._replace(keyword='else', statement=None)
+        residual.append(marker._replace(literal_text=literal_text))
+        residual.extend(branches[branch_index])
+        literal_text = markers[branch_index+1].literal_text
+      residual.append(markers[-1]._replace(literal_text=literal_text))
+    return index
+
+  def compute_static_prefix(self, compiled: CompiledTemplate):
+    evaluator = self.evaluator
+    evaluator.set_template(template=compiled)
+    evaluator.params = self.params
+
+    completed = True
+    for component in evaluator.next_component():
+      evaluator.process_literal()
+      if (component.op is None and component.keyword not in self.StaticKeywords and component.field_name is not None) \
+          or component.op == 'enter_scope':
+        completed = False
+        break
+      evaluator.process_component()
+
+    if completed:
+      if self.final_strip is None:
+        return ''
+      evaluator.options['final_strip'] = self.final_strip
+      return evaluator.parsed_result
+
+    prefix = evaluator.results.getvalue()
+    if self.final_strip is True:
+      prefix = prefix.strip()
+    elif self.final_strip is None:
+      prefix = prefix.rstrip() if not prefix[:1].isspace() else ''
+    return prefix
+
+class MextOptimizer:
+  """Rewrites a compiled template into an equivalent one that is cheaper to render.
+
+  Includes with a literal path are inlined between `enter_scope` and `exit_scope` ops, which
+  render them with the same params, locals and options as a nested parser would. Comment
+  blocks are dropped, and `@set` of literals and tests on constants are folded.
+  """
+
+  # keywords that must be balanced within an included template for it to be inlined
+  StructuralKeywords = ['if', 'elif', 'else', 'endif', 'for', 'endfor', 'cache', 'endcache']
+
+  def __init__(self, parser):
+    self.parser = parser
+
+  def optimize(self, compiled: CompiledTemplate):
+    dependencies = {}
+    components = self.inline_includes(compiled, dependencies, stack=(compiled.template_fn,))
+    inlined = CompiledTemplate(components, template=compiled.template, template_fn=compiled.template_fn)
+    inlined.dependencies = dependencies
+
+    # imports are left alone, the imported files are read on every render, and filters are
+    # left alone as the optimized template is shared by parsers with other formatters
+    specializer = MextSpecializer(self.parser, {}, fold_imports=False, fold_filters=False)
+    return specializer.specialize(inlined)
+
+  def strip_comments(self, components):
+    stripped = []
+    index = 0
+    while index < len(components):
+      component = components[index]
+      if component.keyword == 'comment' and component.statement is None \
+          and (end_index := self.find_comment_end(components, index+1)) is not None:
+        # skipping a comment block leaves the level one lower, see `MextParser.parse_comment`
+        stripped.append(component._replace(keyword=None, op='nop', value=-1))
+        index = end_index + 1
+        continue
+      stripped.append(component)
+      index += 1
+    return stripped
+
+  def find_comment_end(self, components, index):
+    depth = 0
+    while index < len(components):
+      keyword = components[index].keyword
+      if keyword in self.StructuralKeywords:
+        # these are still counted when the comment is skipped as part of an outer block
+        return None
+      elif keyword == 'comment':
+        depth += 1
+      elif keyword == 'endcomment':
+        if depth == 0:
+          return index
+        depth -= 1
+      index += 1
+    return None
+
+  def inline_includes(self, compiled: CompiledTemplate, dependencies, stack):
+    components = []
+    for component in self.strip_comments(compiled.components):
+      inlined = None
+      if component.keyword == 'include' and component.op is None:
+        inlined = self.inline_include(component, compiled.template_fn, dependencies, stack)
+      if inlined is None:
+        components.append(component)
+      else:
+        components.extend(inlined)
+    return components
+
+  def inline_include(self, component, template_fn, dependencies, stack):
+    parser = self.parser
+    m = re.match(parser.Statements['include'], component.statement or '')
+    if m is None or m['filepath'] is None:
+      return None
+
+    parser.template_fn = template_fn
+    include_fn = parser.resolve_include_path(m['filepath'])
+    if include_fn is None or include_fn in stack:
+      return None
+    try:
+      source = parser.template_loader(include_fn)
+      nested = parser.compile(template=source, template_fn=include_fn)
+    except Exception:
+      return None
+
+    nested_dependencies = {include_fn: source}
+    body = self.inline_includes(nested, nested_dependencies, stack=(*stack, include_fn))
+    if not self.is_self_contained(body):
+      return None
+    dependencies.update(nested_dependencies)
+
+    clauses = []
+    if m['params'] is not None:
+      clauses = [tuple(v.strip() for v in p.split('=', 1)) for p in m['params'].split(',')]
+    return [
+      component._replace(keyword=None, op='enter_scope', value=(include_fn, clauses)),
+      *body,
+      Component('', component.field_name, None, None, None, None, component.lineno, op='exit_scope', value=include_fn),
+    ]
+
+  def is_self_contained(self, components):
+    # Blocks must not extend past the end of the included template, otherwise skipping
+    # them would run into the template it is inlined into. `@input` needs its own output.
+    blocks = []
+    for component in components:
+      keyword = component.keyword
+      if keyword in ['input', 'comment', 'endcomment']:
+        return False
+      elif keyword in ['if', 'for', 'cache']:
+        blocks.append(keyword)
+      elif keyword in ['elif', 'else']:
+        if len(blocks) == 0 or blocks[-1] != 'if':
+          return False
+      elif keyword in ['endif', 'endfor', 'endcache']:
+        if len(blocks) == 0 or blocks.pop() != keyword[3:]:
+          return False
+    return len(blocks) == 0
+
+class TemplateDependencies:
+  def __init__(self):
+    self.variables = set()
+    self.includes = set()
+    self.imports = set()
+    self.formatters = set()
+    self.has_input = False
+    # False if the template includes or imports files that can not be resolved statically
+    self.complete = True
+
+  def update(self, other, exclude=()):
+    self.variables.update(v for v in other.variables if re.match(r'[^.\[]*', v)[0] not in exclude)
+    self.includes.update(other.includes)
+    self.imports.update(other.imports)
+    self.formatters.update(other.formatters)
+    self.has_input = self.has_input or other.has_input
+    self.complete = self.complete and other.complete
+
+class DependencyAnalyzer:
+  """Extracts the variable paths and files read by a compiled template and its includes."""
+
+  def __init__(self, parser):
+    self.parser = parser
+
+  def analyze(self, compiled: CompiledTemplate, stack=()):
+    deps = TemplateDependencies()
+    parser = self.parser
+    statements = parser.Statements
+    template_fn = compiled.template_fn
+    components = compiled.components
+
+    # the params provided by the enclosing inlined includes and the file being analyzed
+    scopes = [(set(), template_fn)]
+
+    def add_variable(field_name):
+      if field_name is None or field_name in parser.Constants:
+        return
+      if re.match(fr'^(?:{parser.RegExps.number}|{parser.RegExps.quoted_string})$', field_name):
+        return
+      if re.match(r'[^.\[]*', field_name)[0] in scopes[-1][0]:
+        return
+      deps.variables.add(field_name)
+
+    index = 0
+    while index < len(components):
+      component = components[index]
+      keyword = component.keyword
+      statement = component.statement
+      index += 1
+
+      if component.op == 'enter_scope':
+        include_fn, clauses = component.value
+        for _, val in clauses:
+          add_variable(val)
+        deps.includes.add(include_fn)
+        scopes.append((scopes[-1][0].union(key for key, _ in clauses), include_fn))
+        continue
+      if component.op == 'exit_scope':
+        scopes.pop()
+        continue
+      if component.op is not None or component.field_name is None:
+        continue
+      if keyword is None:
+        add_variable(component.field_name)
+        deps.formatters.update(component.filters or ())
+        continue
+      if keyword == 'input':
+        deps.has_input = True
+        continue
+      if keyword == 'comment':
+        depth = 0
+        while index < len(components):
+          index += 1
+          if components[index-1].keyword == 'comment':
+            depth += 1
+          elif components[index-1].keyword == 'endcomment':
+            if depth == 0:
+              break
+            depth -= 1
+        continue
+      if statement is None:
+        continue
+
+      if keyword in ['set', 'default']:
+        parts = statement.split(' ', 1)
+        if keyword == 'default':
+          add_variable(parts[0])
+        if len(parts) == 2:
+          add_variable(parts[1])
+      elif keyword == 'count':
+        add_variable(statement)
+      elif keyword in ['if', 'elif']:
+        if (m := re.match(statements['test'], statement)) is not None:
+          add_variable(m['varname'])
+      elif keyword == 'for':
+        if (m := re.match(statements['for'], statement)) is not None:
+          add_variable(m['iterable_name'])
+      elif keyword == 'cache':
+        if (m := re.match(statements['cache'], statement)) is not None:
+          add_variable(m['key'])
+          add_variable(m['ttl'])
+      elif keyword == 'format':
+        if (m := re.match(statements['format'], statement)) is not None:
+          deps.formatters.add(m['format'])
+          add_variable(m['varname'])
+          for clause in (m['params'] or '').split(','):
+            if '=' in clause:
+              add_variable(clause.split('=', 1)[1].strip())
+      elif keyword == 'import':
+        if (m := re.match(statements['import'], statement)) is None:
+          continue
+        parser.template_fn = scopes[-1][1]
+        if m['filepath'] is not None and (import_fn := parser.resolve_import_path(m['filepath'])) is not None:
+          deps.imports.add(import_fn)
+        else:
+          add_variable(m['filepath_var'])
+          deps.complete = False
+      elif keyword == 'include':
+        if (m := re.match(statements['include'], statement)) is None:
+          continue
+        include_params = set()
+        for clause in (m['params'] or '').split(','):
+          if '=' in clause:
+            key, val = map(str.strip, clause.split('=', 1))
+            include_params.add(key)
+            add_variable(val)
+        parser.template_fn = scopes[-1][1]
+        if m['filepath'] is None or (include_fn := parser.resolve_include_path(m['filepath'])) is None or include_fn in stack:
+          add_variable(m['filepath_var'])
+          deps.complete = False
+          continue
+        try:
+          nested = CompiledTemplate.compile(parser.template_loader(include_fn), template_fn=include_fn)
+        except Exception:
+          deps.complete = False
+          continue
+        deps.includes.add(include_fn)
+        deps.update(self.analyze(nested, stack=(*stack, include_fn)), exclude=include_params)
+
+    return deps
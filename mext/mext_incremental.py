@@ -0,0 +1,166 @@
+# Copyright (C) 2024 Mext-lang team
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import re
+import copy
+
+from mext.libs.utils import ObjDict
+from mext.mext_parser import MextParser
+from mext.mext_compiler import CompiledTemplate, DependencyAnalyzer
+
+class IncrementalRender:
+  """Re-renders a template whose loop iterables only grow between renders.
+
+  The first render is a full render that records the state at the end of every top-level
+  `@for` loop. When a later render only appends items to the lists iterated by such loops,
+  rendering resumes from the earliest affected loop instead of starting over.
+  """
+
+  def __init__(self, mext, template=None, template_fn=None):
+    self.mext = mext
+    self.parser = MextParser()
+    self.parser.formatters = mext.parser.formatters
+    self.parser.pure_formatters = mext.parser.pure_formatters
+    self.parser.formatter_caches = mext.parser.formatter_caches
+    self.parser.streaming_formatters = mext.parser.streaming_formatters
+    self.parser.async_formatters = mext.parser.async_formatters
+    self.parser.template_loader = mext._load_template
+    self.parser.enable_loop_checkpoints(True)
+
+    self.template = self.parser.compile(template=template, template_fn=template_fn)
+    self.loops = self.find_append_only_loops(self.template)
+    self.last_render = None
+    self.full_renders = 0
+    self.incremental_renders = 0
+
+  def find_append_only_loops(self, compiled: CompiledTemplate):
+    components = compiled.components
+
+    resolver = MextParser()
+    resolver.template_loader = self.parser.template_loader
+    deps = DependencyAnalyzer(resolver).analyze(compiled)
+    # the checkpoints would keep the placeholders of the async formatters
+    if deps.has_input or not deps.formatters.isdisjoint(self.parser.async_formatters):
+      return {}
+
+    loops = {}
+    depth = 0
+    loop_index = None
+    for index, component in enumerate(components):
+      if component.keyword == 'for':
+        depth += 1
+        if depth == 1:
+          loop_index = index
+      elif component.keyword == 'endfor':
+        depth -= 1
+        if depth != 0:
+          continue
+        m = re.match(MextParser.Statements['for'], components[loop_index].statement or '')
+        if m is None or not re.fullmatch(r'[A-Za-z_][0-9A-Za-z_]*', m['iterable_name']):
+          continue
+        if self.is_append_safe(compiled, loop_index, index, m['iterable_name']):
+          loops[loop_index] = m['iterable_name']
+
+    return loops
+
+  def is_append_safe(self, compiled: CompiledTemplate, loop_index, end_index, varname):
+    # Everything rendered before the end of the loop must not depend on the iterable other
+    # than through the loop itself, or through tests that can not change when items are appended.
+    components = []
+    for index, component in enumerate(compiled.components[:end_index]):
+      if index == loop_index:
+        continue
+      if component.keyword in ['if', 'elif'] and (m := re.match(MextParser.Statements['test'], component.statement or '')) is not None:
+        if m['varname'] == varname:
+          continue
+      if component.keyword in ['set', 'default', 'count', 'input'] and (component.statement or '').split(' ', 1)[0] == varname:
+        return False
+      if component.keyword == 'for' and varname in map(str.strip, (component.statement or '').split(' in ', 1)[0].split(',')):
+        return False
+      if component.keyword == 'import' and not re.search(fr'\s+as\s+(?!{varname}$)\S+$', component.statement or ''):
+        return False
+      if component.op in ['assign', 'update']:
+        return False
+      components.append(component)
+
+    resolver = MextParser()
+    resolver.template_loader = self.parser.template_loader
+    deps = DependencyAnalyzer(resolver).analyze(CompiledTemplate(components, template_fn=compiled.template_fn))
+    if not deps.complete:
+      return False
+    return all(re.match(r'[^.\[]*', v)[0] != varname for v in deps.variables)
+
+  def snapshot(self, value):
+    try:
+      return copy.deepcopy(value)
+    except Exception:
+      return value
+
+  def find_resume_point(self, params):
+    last_render = self.last_render
+    if last_render is None or params.keys() != last_render.params.keys():
+      return None
+
+    loop_params = set(self.loops.values())
+    grown = {}
+    for key, value in params.items():
+      old_value = last_render.params[key]
+      if key in loop_params and isinstance(value, (list, tuple)) and isinstance(old_value, list):
+        if len(value) < len(old_value) or list(value[:len(old_value)]) != old_value:
+          return None
+        if len(value) > len(old_value):
+          grown[key] = len(old_value)
+      elif not (value is old_value or value == old_value):
+        return None
+
+    if len(grown) == 0:
+      return None
+    for loop_index, varname in sorted(self.loops.items()):
+      if varname not in grown:
+        continue
+      checkpoint = last_render.checkpoints.get(loop_index)
+      if checkpoint is None or checkpoint.for_context[-1].index+1 != grown[varname]:
+        return None
+      return checkpoint, params[varname][grown[varname]:]
+    return None
+
+  def render(self, params={}, **kwargs) -> str:
+    all_kwargs = {
+      **self.mext.params,
+      **params,
+      **kwargs,
+    }
+
+    parser = self.parser
+    resume_point = self.find_resume_point(all_kwargs)
+    if resume_point is None:
+      parsed_result = parser.parse(template=self.template, params=all_kwargs)
+      self.full_renders += 1
+    else:
+      checkpoint, items = resume_point
+      output = self.last_render.output[:checkpoint.output_size]
+      parsed_result = parser.resume_loop(self.template, checkpoint, output, items, params=all_kwargs)
+      self.incremental_renders += 1
+
+    loop_params = set(self.loops.values())
+    self.last_render = ObjDict({
+      'params': {
+        k: self.snapshot(list(v)) if k in loop_params and isinstance(v, (list, tuple)) else self.snapshot(v)
+        for k, v in all_kwargs.items()
+      },
+      'checkpoints': parser.loop_checkpoints,
+      'output': parser.results.getvalue(),
+    })
+    return parsed_result
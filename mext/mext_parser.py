@@ -13,18 +13,43 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import os
 import re
-import json
 from os import path
+from itertools import islice
 from string import Formatter
-from contextlib import contextmanager
-from typing import Union, Tuple, Coroutine, Callable
+from time import perf_counter, time
 
 from mext.libs.config_loader import CFG
-from mext.libs.utils import format_exception, indent_lines, fence_content
-from mext.libs.utils import ObjDict
+from mext.libs.utils import format_exception, indent_lines, write_fenced_content
+from mext.libs.utils import ObjDict, LRUCache, make_hashable, make_key
+from mext.libs.output_buffer import OutputBuffer
+from mext.libs.tables import write_table, write_csv, write_bullets
+from mext.mext_compiler import CompiledTemplate, FieldAccessor, MextSpecializer, MextOptimizer, DependencyAnalyzer, TemplateDependencies
+
+class SuspendRender(Exception):
+  pass
+
+def file_stamp(fn):
+  try:
+    stat = os.stat(fn)
+  except OSError:
+    return None
+  return (stat.st_mtime_ns, stat.st_size)
 
 class MextParser:
+  COMPILE_CACHE = LRUCache(maxsize=256)
+  DISK_CACHE = None
+  DATA_CACHE = LRUCache(maxsize=64)
+  FRAGMENT_CACHE = LRUCache(maxsize=256)
+  FIELD_ACCESSORS = {}
+  FIELD_ACCESSORS_SIZE = 4096
+  FORMATTER_CACHE_SIZE = 64
+  FORMATTER_CACHE_MAX_LENGTH = 1 << 20
+  ESCAPE_TABLES = LRUCache(maxsize=64)
+  # the number of json tokens joined before writing them to the results
+  JSON_WRITE_BATCH = 4096
+
   Keywords = [
     'option',
     'set',
@@ -43,14 +68,35 @@ class MextParser:
     'format',
     'comment',
     'endcomment',
+    'cache',
+    'endcache',
   ]
   IncLevel = [
     'if',
     'for',
+    'cache',
   ]
   DescLevel = [
     'endif',
     'endfor',
+    'endcache',
+  ]
+
+  # bump when the layout of the continuations changes, see `parse_resumable`
+  ContinuationVersion = 1
+
+  # the state saved when entering the scope of an inlined include
+  ScopeAttributes = [
+    'template_fn',
+    'first_index',
+    'level',
+    'pending_whitespaces',
+    'params',
+    'locals',
+    'options',
+    'for_context',
+    'trim_newline_state',
+    'results',
   ]
 
   Constants = {
@@ -69,33 +115,71 @@ class MextParser:
     'value': (regexp_value := fr'(?:{regexp_quoted_string}|{regexp_number}|{regexp_variable})'),
   })
 
+  Statements = ObjDict({
+    'include': fr'^(?:\"(?P<filepath>{regexp_string})\"|(?P<filepath_var>{regexp_variable}))(?:\s+(?P<params>(?:{regexp_variable}\s*=\s*{regexp_variable})(?:,\s*{regexp_variable}\s*=\s*{regexp_variable})*))?$',
+    'import': fr'^(?:\"(?P<filepath>{regexp_string})\"|(?P<filepath_var>{regexp_variable}))(?:\s+as\s+(?P<namespace>{regexp_variable}))?$',
+    'test': fr'(?P<operators>(not\s+)?((?:empty|undefined|novalue)\s+)?)(?P<varname>{regexp_variable})',
+    'for': fr'(?P<varnames>{regexp_variable}(,\s*{regexp_variable})*)\s+in\s+(?P<iterable_name>{regexp_variable})',
+    'cache': fr'^(?P<key>{regexp_value})(?:\s+ttl\s*=\s*(?P<ttl>{regexp_value}))?$',
+    'format': fr'^(?P<format>{regexp_string})\s+(?P<varname>{regexp_variable})(?:\s+(?P<params>(?:{regexp_variable}\s*=\s*{regexp_value})(?:,\s*{regexp_variable}\s*=\s*{regexp_value})*))?$',
+  })
+
   def __init__(self):
     self.reset()
 
     self.formatters = {}
+    self.pure_formatters = set()
+    self.formatter_caches = {}
+    self.streaming_formatters = set()
+    self.async_formatters = set()
     default_formattters = {
-      'json': MextParser.format_json,
+      'json': MextParser.write_json,
       'repr': repr,
       'escape': MextParser.format_escape,
-      'fenced_block': fence_content,
+      'fenced_block': write_fenced_content,
       'lower': str.lower,
       'upper': str.upper,
       'capitalize': str.capitalize,
+      'table': write_table,
+      'csv': write_csv,
+      'bullets': write_bullets,
     }
+    # the results of the formatters whose cost grows with the size of the value are cached
+    cached_formatters = {'json', 'escape', 'fenced_block'}
+    streaming_formatters = {'json', 'fenced_block', 'table', 'csv', 'bullets'}
     for format_name, formatter in default_formattters.items():
-      self.register_formatter(format_name, formatter)
-
-    self.debug_trace = False
+      cache_size = MextParser.FORMATTER_CACHE_SIZE if format_name in cached_formatters else None
+      self.register_formatter(format_name, formatter, pure=True, cache_size=cache_size,
+        streaming=format_name in streaming_formatters)
+
+    self.trace = None
+    self.input_view = False
+    self.record_loop_checkpoints = False
+    self.suspendable = False
+    self.optimization = False
+    self.profiler = None
+    self.metrics = None
+    self.files_read = None
+    self.fragment_cache = MextParser.FRAGMENT_CACHE
+    self.outer_parser = None
+    # the results of the async formatters of the render, shared with the nested parsers
+    self.deferred = None
+    self.owns_deferred = True
 
   def reset(self):
     self.template = None
     self.template_fn = None
-    self.entries = None
+    self.components = None
     self.pos_index = -1
+    self.first_index = 0
     self.str_formatter = Formatter()
 
-    self.state = ObjDict()
-    self.linenumbers = [1]
+    self.state = ObjDict({
+      'field_name': None,
+      'keyword': None,
+      'statement': None,
+      'lineno': 1,
+    })
     self.level = 0
     self.pending_whitespaces = None
 
@@ -109,23 +193,135 @@ class MextParser:
     }
     self.for_context = []
     self.trim_newline_state = []
-    self.results = []
+    self.results = OutputBuffer()
+    self.input_mark = 0
     self.input_results = {}
+    self.loop_checkpoints = {}
+    self.scopes = []
+    self.cache_blocks = []
+    self.digest = None
+    self.tracing = False
+
+  def register_formatter(self, format_name, formatter, pure=False, cache_size=None, streaming=False):
+    """Register `formatter` for `@format`.
+
+    A pure formatter returns the same result for equal values and params, without side effects.
+    With `cache_size`, the results of a pure formatter are cached by the content of the value
+    and the params. Only plain data (see `make_key`) is cached.
+
+    A streaming formatter is called as `formatter(write, value, **params)` and writes its result
+    to the output by pieces with `write(text)`, instead of returning it.
+
+    An async formatter (a coroutine function) is not awaited where it is used. A placeholder is
+    written instead, and the calls of the render are awaited concurrently, before the next `@input`
+    or at the end of the render. Since the result is not known yet, the whitespace around the call
+    is laid out as for a non-empty result: an async formatter returning `''` does not remove the
+    line it stands on, and counts as output for `@trim_newline`.
+    """
+    if cache_size is not None and not pure:
+      raise ValueError(f'Format "{format_name}" must be pure to cache its results.')
+    # CO_COROUTINE, checked without importing inspect at startup
+    is_async = bool(getattr(getattr(formatter, '__code__', None), 'co_flags', 0) & 0x80)
+    if is_async and streaming:
+      raise ValueError(f'Format "{format_name}" can not be both async and streaming.')
 
-  def register_formatter(self, format_name, formatter):
     self.formatters[format_name] = formatter
+    if pure:
+      self.pure_formatters.add(format_name)
+    else:
+      self.pure_formatters.discard(format_name)
+    if streaming:
+      self.streaming_formatters.add(format_name)
+    else:
+      self.streaming_formatters.discard(format_name)
+    if is_async:
+      self.async_formatters.add(format_name)
+    else:
+      self.async_formatters.discard(format_name)
+    if cache_size is not None:
+      self.formatter_caches[format_name] = LRUCache(maxsize=cache_size)
+    else:
+      self.formatter_caches.pop(format_name, None)
 
   def remove_formatter(self, format_name):
     del self.formatters[format_name]
+    self.pure_formatters.discard(format_name)
+    self.formatter_caches.pop(format_name, None)
+    self.streaming_formatters.discard(format_name)
+    self.async_formatters.discard(format_name)
 
-  def enable_trace(self, enable):
+  def enable_trace(self, enable, capacity=4096, sample_rate=1):
+    """Record where the output comes from, see `RenderTrace`."""
     if enable:
-      assert len(self.results) == 0
-    self.debug_trace = enable
-    if self.debug_trace:
-      self.trace = []
-    elif hasattr(self, 'trace'):
-      del self.trace
+      from mext.libs.trace import RenderTrace
+      self.trace = RenderTrace(capacity=capacity, sample_rate=sample_rate)
+    else:
+      self.trace = None
+
+  def enable_input_view(self, enable):
+    self.input_view = enable
+
+  def enable_optimization(self, enable):
+    """Render templates through `MextOptimizer`.
+
+    Includes with a literal path are resolved and inlined when the template is compiled.
+    The inlined files are checked for changes through the template loader before each render.
+    """
+    self.optimization = enable
+
+  def enable_file_tracking(self, enable):
+    """Record the files read by renders in `files_read`, a dict used as an ordered set.
+
+    These are the rendered and included templates, and the imported files.
+    """
+    self.files_read = {} if enable else None
+
+  def track_file(self, fn):
+    fn = path.normpath(fn)
+    if self.files_read is not None:
+      self.files_read[fn] = None
+    # the files read by a `@cache` block are kept with its output, see `parse_endcache`
+    parser = self
+    while parser is not None:
+      for block in parser.cache_blocks:
+        block.files[fn] = None
+      parser = parser.outer_parser
+
+  def set_fragment_cache(self, cache):
+    """Store the outputs of `@cache` blocks in `cache`, any object with the `get` and `put` methods of LRUCache.
+
+    The keys are tuples of strings and hashable values. Use None to render the blocks without caching.
+    """
+    self.fragment_cache = cache
+
+  def enable_profile(self, enable):
+    if enable:
+      from mext.libs.profiler import RenderProfiler
+      self.profiler = RenderProfiler()
+    else:
+      self.profiler = None
+
+  def create_nested_parser(self):
+    nested_parser = MextParser()
+    nested_parser.formatters = self.formatters
+    nested_parser.pure_formatters = self.pure_formatters
+    nested_parser.formatter_caches = self.formatter_caches
+    nested_parser.streaming_formatters = self.streaming_formatters
+    nested_parser.async_formatters = self.async_formatters
+    if len(self.async_formatters) > 0:
+      if self.deferred is None:
+        from mext.libs.deferred import DeferredResults
+        self.deferred = DeferredResults()
+      nested_parser.deferred = self.deferred
+      nested_parser.owns_deferred = False
+    nested_parser.enable_input_view(self.input_view)
+    nested_parser.enable_optimization(self.optimization)
+    nested_parser.profiler = self.profiler
+    nested_parser.metrics = self.metrics
+    nested_parser.files_read = self.files_read
+    nested_parser.fragment_cache = self.fragment_cache
+    nested_parser.outer_parser = self
+    return nested_parser
 
   @property
   def all_variables(self):
@@ -140,42 +336,144 @@ class MextParser:
       lines = f.readlines()
       return ''.join(lines)
 
-  def set_template(self, template=None, template_fn=None):
+  def load_data(self, fn):
+    """Load a yaml or json file as ObjDicts. The parsed data is reused while the file is unchanged."""
+    stat = os.stat(fn)
+    key = path.abspath(fn)
+    file_stamp = (stat.st_mtime_ns, stat.st_size)
+    cached = MextParser.DATA_CACHE.get(key)
+    hit = cached is not None and cached[0] == file_stamp
+    if self.metrics is not None:
+      self.metrics.cache_lookup('data', hit)
+    if hit:
+      return cached[1]
+
+    data = ObjDict.convert_recursively(CFG.load_config(fn))
+    if data is None:
+      data = {}
+    MextParser.DATA_CACHE.put(key, (file_stamp, data))
+    return data
+
+  @classmethod
+  def enable_disk_cache(cls, cache_dir=None):
+    from mext import __version__
+    from mext.libs.compile_cache import CompileCache
+    cls.DISK_CACHE = CompileCache(cache_dir, tag=f'mext-{__version__}-{CompiledTemplate.FORMAT_VERSION}')
+
+  @classmethod
+  def disable_disk_cache(cls):
+    cls.DISK_CACHE = None
+
+  def compile(self, template=None, template_fn=None, optimize=None) -> CompiledTemplate:
+    if isinstance(template, CompiledTemplate):
+      return template
+    if optimize is None:
+      optimize = self.optimization
+    if optimize:
+      return self.compile_optimized(template=template, template_fn=template_fn)
+
+    disk_cache = MextParser.DISK_CACHE if template_fn is not None else None
+    checked_disk_cache = False
     if template is None:
-      if template_fn is not None:
-        template = self.template_loader(template_fn)
-      else:
+      if template_fn is None:
         raise ValueError('One of "template" or "template_fn" must not be None.')
+      if disk_cache is not None:
+        compiled = disk_cache.load(template_fn)
+        if self.metrics is not None:
+          self.metrics.cache_lookup('disk', compiled is not None)
+        if compiled is not None:
+          MextParser.COMPILE_CACHE.put((compiled.template, template_fn), compiled)
+          return compiled
+        checked_disk_cache = True
+      template = self.template_loader(template_fn)
+
+    cache_key = (template, template_fn)
+    compiled = MextParser.COMPILE_CACHE.get(cache_key)
+    if self.metrics is not None:
+      self.metrics.cache_lookup('compile', compiled is not None)
+    if compiled is not None:
+      return compiled
+
+    if disk_cache is not None and not checked_disk_cache:
+      compiled = disk_cache.load(template_fn, source=template)
+      if self.metrics is not None:
+        self.metrics.cache_lookup('disk', compiled is not None)
+    if compiled is None:
+      compiled = CompiledTemplate.compile(template, template_fn=template_fn)
+      if disk_cache is not None:
+        disk_cache.store(template_fn, template, compiled)
+    MextParser.COMPILE_CACHE.put(cache_key, compiled)
+    return compiled
+
+  def compile_optimized(self, template=None, template_fn=None) -> CompiledTemplate:
+    if template is None:
+      if template_fn is None:
+        raise ValueError('One of "template" or "template_fn" must not be None.')
+      template = self.template_loader(template_fn)
+
+    cache_key = (template, template_fn, 'optimized')
+    if (compiled := MextParser.COMPILE_CACHE.get(cache_key)) is not None:
+      try:
+        if all(self.template_loader(fn) == source for fn, source in compiled.dependencies.items()):
+          if self.metrics is not None:
+            self.metrics.cache_lookup('compile', True)
+          return compiled
+      except Exception:
+        pass
+    if self.metrics is not None:
+      self.metrics.cache_lookup('compile', False)
+
+    optimizer = self.create_nested_parser()
+    optimizer.enable_optimization(False)
+    optimizer.profiler = None
+    optimizer.metrics = None
+    optimizer.files_read = None
+    optimizer.template_loader = self.template_loader
+    compiled = MextOptimizer(optimizer).optimize(self.compile(template=template, template_fn=template_fn, optimize=False))
+    MextParser.COMPILE_CACHE.put(cache_key, compiled)
+    return compiled
+
+  def specialize(self, template=None, params={}, template_fn=None, template_loader=None) -> CompiledTemplate:
+    if template_loader is not None:
+      self.template_loader = template_loader
+    compiled = self.compile(template=template, template_fn=template_fn)
+
+    evaluator = MextParser()
+    evaluator.formatters = self.formatters
+    evaluator.pure_formatters = self.pure_formatters
+    evaluator.formatter_caches = self.formatter_caches
+    evaluator.streaming_formatters = self.streaming_formatters
+    evaluator.async_formatters = self.async_formatters
+    evaluator.template_loader = self.template_loader
+    specializer = MextSpecializer(evaluator, params)
+    return specializer.specialize(compiled)
+
+  def analyze(self, template=None, template_fn=None, template_loader=None) -> TemplateDependencies:
+    if template_loader is not None:
+      self.template_loader = template_loader
+    compiled = self.compile(template=template, template_fn=template_fn)
+
+    resolver = MextParser()
+    resolver.template_loader = self.template_loader
+    return DependencyAnalyzer(resolver).analyze(compiled)
+
+  def set_template(self, template=None, template_fn=None, template_loader=None):
+    if template_loader is not None:
+      self.template_loader = template_loader
+    compiled = self.compile(template=template, template_fn=template_fn)
 
     self.reset()
+    if template_loader is not None:
+      self.template_loader = template_loader
 
-    self.template = template
-    self.template_fn = template_fn
-    entries = self.str_formatter.parse(self.template)
-    self.entries = list(entries)
+    self.template = compiled.template
+    self.template_fn = template_fn if template_fn is not None else compiled.template_fn
+    self.components = compiled.components
 
   def next_component(self):
-    while self.pos_index+1 < len(self.entries):
+    while self.pos_index+1 < len(self.components):
       self.pos_index += 1
-      literal_text, field_name, format_spec, conversion = self.entries[self.pos_index]
-
-      keyword = None
-      statement = field_name
-      if field_name is not None and field_name.startswith("@"):
-        parts = field_name[1:].split(' ', 1)
-        keyword = parts[0]
-        statement = parts[1].strip() if len(parts) > 1 else None
-
-      self.linenumbers.append(self.linenumbers[-1] + literal_text.count('\n'))
-      self.state.update({
-        'literal_text': literal_text,
-        'field_name': field_name,
-        'format_spec': format_spec,
-        'conversion': conversion,
-        'keyword': keyword,
-        'statement': statement,
-      })
-
+      self.state = self.components[self.pos_index]
       yield self.state
 
   def seek(self, to_pos=None, delta=None):
@@ -185,7 +483,6 @@ class MextParser:
       if delta > 0:
         raise ValueError('Cannot seek forward.')
       self.pos_index += delta
-      self.linenumbers = self.linenumbers[:delta]
     else:
       raise ValueError('One of "to_pos" or "delta" must not be None.')
 
@@ -196,13 +493,13 @@ class MextParser:
         if len(self.pending_whitespaces) != 0:
           self.results.append(self.pending_whitespaces)
         self.pending_whitespaces = None
-      self.results.append(str(text))
-      if self.debug_trace:
-        self.trace.append((self.pos_index, self.state.copy()))
+      if self.tracing and len(self.scopes) == 0:
+        self.trace.append(self.pos_index, self.results.tell(), len(text))
+      self.results.append(text)
 
   @property
   def parsed_result(self):
-    parsed_result = ''.join(self.results)
+    parsed_result = self.results.getvalue()
     if self.options['final_strip']:
       parsed_result = parsed_result.strip()
     return parsed_result
@@ -222,9 +519,9 @@ class MextParser:
   def raise_error(self, error_type, msg):
     error_msg = ""
     if self.template_fn is not None:
-      error_msg += f'In file "{self.template_fn}", line {self.linenumbers[-1]}, around "{self.state.field_name}".'
+      error_msg += f'In file "{self.template_fn}", line {self.state.lineno}, around "{self.state.field_name}".'
     else:
-      error_msg += f'Line {self.linenumbers[-1]}, around "{self.state.field_name}".'
+      error_msg += f'Line {self.state.lineno}, around "{self.state.field_name}".'
     error_msg += f'\n{indent_lines(msg, indent=2)}'
     raise error_type(error_msg)
 
@@ -240,44 +537,313 @@ class MextParser:
       self.raise_syntax_error(f"Unexpected statement after {self.state.keyword}")
 
   def get_field_value(self, field_name):
-    reg = MextParser.RegExps
-    if re.match(fr'^{reg.integer}$', field_name):
-      return int(field_name)
-    if re.match(fr'^{reg.float}$', field_name):
-      return float(field_name)
-    if re.match(fr'^{reg.quoted_string}$', field_name):
-      return str(field_name[1:-1])
+    if (accessor := MextParser.FIELD_ACCESSORS.get(field_name)) is None:
+      if len(MextParser.FIELD_ACCESSORS) >= MextParser.FIELD_ACCESSORS_SIZE:
+        MextParser.FIELD_ACCESSORS.clear()
+      accessor = MextParser.FIELD_ACCESSORS[field_name] = FieldAccessor(field_name, MextParser.RegExps)
+    try:
+      return accessor.resolve((self.locals, self.params, MextParser.Constants))
+    except Exception:
+      pass
+
     try:
       field_value, _ = self.str_formatter.get_field(field_name, args=[], kwargs=self.all_variables)
     except Exception as e:
       self.raise_error(RuntimeError, format_exception(e))
     return field_value
 
+  def has_variable(self, varname):
+    return varname in self.locals or varname in self.params or varname in MextParser.Constants
+
   def parse(self, template=None, params={}, callbacks={}, template_fn=None, template_loader=None):
-    self.set_template(template=template, template_fn=template_fn) # this will reset all state
-    if template_loader is not None:
-      self.template_loader = template_loader
+    self.set_template(template=template, template_fn=template_fn, template_loader=template_loader) # this will reset all state
+    self.params = params
+    self.callbacks = callbacks
+    if template_fn is not None:
+      self.track_file(template_fn)
+    self.tracing = self.trace is not None and self.trace.begin(self)
+    if self.owns_deferred:
+      self.deferred = None
+
+    parsed_result = self.run()
+    if self.owns_deferred and self.deferred is not None:
+      self.deferred.resolve()
+      parsed_result = self.fill_deferred(parsed_result)
+    if self.tracing:
+      self.trace.finish(self)
+    return parsed_result
+
+  async def parse_async(self, template=None, params={}, callbacks={}, template_fn=None, template_loader=None):
+    """Render like `parse`, awaiting the async formatters in the running event loop.
+
+    The async formatters called before an `@input` of the template are awaited before its callback.
+    This is not possible for an `@input` in an included template that is not inlined.
+    """
+    self.set_template(template=template, template_fn=template_fn, template_loader=template_loader) # this will reset all state
     self.params = params
     self.callbacks = callbacks
+    if template_fn is not None:
+      self.track_file(template_fn)
+    self.tracing = self.trace is not None and self.trace.begin(self)
+    self.deferred = None
+
+    if self.profiler is not None:
+      parsed_result = self.run_profiled()
+    else:
+      for state in self.next_component():
+        self.process_literal()
+        if state.keyword == 'input' and self.deferred is not None and self.deferred.unresolved:
+          await self.deferred.gather()
+          self.fill_deferred_results()
+        self.process_component()
+      parsed_result = self.parsed_result
+    if self.deferred is not None:
+      await self.deferred.gather()
+      parsed_result = self.fill_deferred(parsed_result)
+    if self.tracing:
+      self.trace.finish(self)
+    return parsed_result
+
+  def wrap_deferred_error(self, call):
+    # the errors of async formatters are raised after the render moved on, so they are located here
+    template_fn, state = self.template_fn, self.state
+    async def deferred_call():
+      try:
+        return await call()
+      except Exception as e:
+        self.template_fn, self.state = template_fn, state
+        self.raise_error(RuntimeError, format_exception(e))
+    return deferred_call
+
+  def defer(self, call):
+    """Write the placeholder of the result of `call`, an async function without arguments, to the results."""
+    if self.deferred is None:
+      from mext.libs.deferred import DeferredResults
+      self.deferred = DeferredResults()
+    self.append_text(self.deferred.add(self.wrap_deferred_error(call)))
+
+  def fill_deferred(self, parsed_result):
+    parsed_result = self.deferred.fill(parsed_result)
+    if self.options['final_strip']:
+      parsed_result = parsed_result.strip()
+    return parsed_result
+
+  def fill_deferred_results(self):
+    # the placeholders are all after the last input mark, so it is still valid
+    for results in [self.results, *(scope[MextParser.ScopeAttributes.index('results')] for scope in self.scopes)]:
+      filled = self.deferred.fill(results.getvalue())
+      results.clear()
+      results.append(filled)
+
+  def run(self):
+    if self.profiler is not None:
+      return self.run_profiled()
 
     for state in self.next_component():
       self.process_literal()
+      self.process_component()
 
-      if state.keyword is not None:
-        if state.keyword not in self.Keywords:
-          self.raise_syntax_error(f'"{state.keyword}" is not a valid keyword.')
-        if state.keyword in self.IncLevel:
-          self.level += 1
-        elif state.keyword in self.DescLevel:
-          self.level -= 1
+    return self.parsed_result
 
-        parse_fn = getattr(self, f"parse_{state.keyword}")
-        parse_fn()
-      elif state.field_name is not None:
-        self.parse_field()
+  def run_profiled(self):
+    profiler = self.profiler
+    depth = len(profiler.frames)
+    nested_depth = len(profiler.nested)
+    scope_depth = len(profiler.scope_fns)
+    if depth == 0:
+      profiler.renders += 1
+    profiler.push_frame(self.template_fn)
+    try:
+      for state in self.next_component():
+        token = profiler.start(self)
+        self.process_literal()
+        self.process_component()
+        profiler.stop(token, state)
+    finally:
+      del profiler.frames[depth:]
+      del profiler.nested[nested_depth:]
+      del profiler.scope_fns[scope_depth:]
 
     return self.parsed_result
 
+  def capture_state(self):
+    return ObjDict({
+      'pos_index': self.pos_index,
+      'level': self.level,
+      'pending_whitespaces': self.pending_whitespaces,
+      'locals': dict(self.locals),
+      'options': dict(self.options),
+      'for_context': [ObjDict({k: v for k, v in context.items() if k != 'itr'}) for context in self.for_context],
+      'trim_newline_state': list(self.trim_newline_state),
+      'input_results': dict(self.input_results),
+      'input_mark': self.input_mark,
+      'output_size': self.results.tell(),
+      'output_chunks': len(self.results),
+    })
+
+  def restore_state(self, state, output):
+    self.pos_index = state.pos_index
+    self.state = self.components[self.pos_index]
+    self.level = state.level
+    self.pending_whitespaces = state.pending_whitespaces
+    self.locals = dict(state.locals)
+    self.options = dict(state.options)
+    self.for_context = [ObjDict(context) for context in state.for_context]
+    self.trim_newline_state = list(state.trim_newline_state)
+    self.input_results = dict(state.input_results)
+    self.input_mark = state.input_mark
+
+    self.results = OutputBuffer()
+    if len(output) != state.output_size:
+      raise ValueError(f'Expecting {state.output_size} characters of output but got {len(output)}.')
+    if len(output) > 0:
+      self.results.append(output)
+    self.results.num_chunks = state.output_chunks
+
+  def enable_loop_checkpoints(self, enable):
+    self.record_loop_checkpoints = enable
+
+  def resume_loop(self, template, checkpoint, output, items, params={}, callbacks={}, template_loader=None):
+    """Continue a render from a checkpoint taken at the `@endfor` of a top-level loop.
+
+    `output` is the rendered text up to the checkpoint and `items` are the remaining items of the
+    iterable. The loop goes on with these items and then renders the rest of the template.
+    """
+    self.set_template(template=template)
+    if template_loader is not None:
+      self.template_loader = template_loader
+    self.params = params
+    self.callbacks = callbacks
+    self.restore_state(checkpoint, output)
+    self.for_context[-1].itr = iter(items)
+    self.deferred = None
+
+    self.parse_endfor()
+    parsed_result = self.run()
+    if self.deferred is not None:
+      self.deferred.resolve()
+      parsed_result = self.fill_deferred(parsed_result)
+    return parsed_result
+
+  def parse_resumable(self, template=None, params={}, callbacks={}, template_fn=None, template_loader=None):
+    """Render like `parse`, but stop at the first `@input` of the template without a callback.
+
+    Returns an ObjDict with the `result` of the render once it completes, and the `input_results`.
+    Until then `result` is None, `input` is the name of the input variable, `output` is the output
+    rendered so far, as its callback would see it, and `continuation` holds the state of the render
+    for `resume`.
+    Only an `@input` of the template itself can stop the render, those of included templates need callbacks.
+    """
+    self.suspendable = True
+    try:
+      return self.resumed(self.parse(template=template, params=params, callbacks=callbacks, template_fn=template_fn, template_loader=template_loader))
+    except SuspendRender as suspend:
+      return self.suspend(*suspend.args)
+    finally:
+      self.suspendable = False
+
+  def resume(self, continuation, input_value, template=None, params={}, callbacks={}, template_fn=None, template_loader=None):
+    """Continue a render of `parse_resumable` from its `continuation`, with `input_value` as the value of the input.
+
+    The prefix of the output is not rendered again. The params must be the same as those of the
+    suspended render, and the iterables of the loops being rendered must iterate in the same order.
+    Returns like `parse_resumable`.
+    """
+    continuation = ObjDict.convert_recursively(continuation)
+    if continuation.get('version') != MextParser.ContinuationVersion:
+      raise ValueError('The continuation is not from this version of mext.')
+    if template is None and template_fn is None:
+      template_fn = continuation.template_fn
+    if template is None and template_fn is None:
+      raise ValueError('The template of the continuation must be provided.')
+
+    self.suspendable = True
+    try:
+      self.set_template(template=template, template_fn=template_fn, template_loader=template_loader)
+      if self.template_digest() != continuation.digest:
+        raise ValueError('The template changed since the render was suspended.')
+      self.params = params
+      self.callbacks = callbacks
+      if template_fn is not None:
+        self.track_file(template_fn)
+      if self.owns_deferred:
+        self.deferred = None
+      self.restore_state(continuation.state, continuation.output)
+      self.restore_loops()
+      self.receive_input(continuation.input, input_value)
+
+      parsed_result = self.run()
+      if self.owns_deferred and self.deferred is not None:
+        self.deferred.resolve()
+        parsed_result = self.fill_deferred(parsed_result)
+      return self.resumed(parsed_result)
+    except SuspendRender as suspend:
+      return self.suspend(*suspend.args)
+    finally:
+      self.suspendable = False
+
+  def resumed(self, parsed_result):
+    return ObjDict({
+      'result': parsed_result,
+      'input': None,
+      'output': None,
+      'continuation': None,
+      'input_results': dict(self.input_results),
+    })
+
+  def suspend(self, varname, output):
+    # the continuation is JSON serializable as long as the locals and input values are
+    return ObjDict({
+      'result': None,
+      'input': varname,
+      'output': output,
+      'continuation': ObjDict({
+        'version': MextParser.ContinuationVersion,
+        'template_fn': self.template_fn,
+        'digest': self.template_digest(),
+        'input': varname,
+        'state': self.capture_state(),
+        'output': self.results.getvalue(),
+      }),
+      'input_results': dict(self.input_results),
+    })
+
+  def template_digest(self):
+    # the positions of the components are only valid for the same compiled template
+    if self.digest is None:
+      import hashlib
+      digest = hashlib.sha256((self.template or "").encode())
+      digest.update(f'{self.optimization}:{len(self.components)}'.encode())
+      self.digest = digest.hexdigest()[:32]
+    return self.digest
+
+  def restore_loops(self):
+    # the iterators of the loops are rebuilt from their iterables, then moved past the items already rendered
+    for context in self.for_context:
+      iterable = self.get_field_value(context.iterable_name)
+      itr = iter(iterable.items()) if isinstance(iterable, dict) else iter(iterable)
+      if sum(1 for _ in islice(itr, context.index+1)) != context.index+1:
+        raise ValueError(f'"{context.iterable_name}" has less items than when the render was suspended.')
+      context.itr = itr
+
+  def process_component(self):
+    state = self.state
+    if state.op is not None:
+      exec_fn = getattr(self, f"exec_{state.op}")
+      exec_fn()
+    elif state.keyword is not None:
+      if state.keyword not in self.Keywords:
+        self.raise_syntax_error(f'"{state.keyword}" is not a valid keyword.')
+      if state.keyword in self.IncLevel:
+        self.level += 1
+      elif state.keyword in self.DescLevel:
+        self.level -= 1
+
+      parse_fn = getattr(self, f"parse_{state.keyword}")
+      parse_fn()
+    elif state.field_name is not None:
+      self.parse_field()
+
   def process_literal(self):
     whitespaces = r'[ \t]'
 
@@ -310,11 +876,11 @@ class MextParser:
             break
           last_state = self.trim_newline_state[-1]
 
-    if self.pos_index != 0 and len(text) == 0:
+    if self.pos_index != self.first_index and len(text) == 0:
       pending_whitespaces = self.pending_whitespaces
       self.pending_whitespaces = None
     elif self.state.field_name is not None and ((m := re.search(fr'\n{whitespaces}*\Z', text))
-          or ((self.pos_index == 0 or self.pending_whitespaces == '') and (m := re.fullmatch(fr'{whitespaces}*', text)))):
+          or ((self.pos_index == self.first_index or self.pending_whitespaces == '') and (m := re.fullmatch(fr'{whitespaces}*', text)))):
       text = text[:-len(m[0])]
       pending_whitespaces = m[0]
 
@@ -360,7 +926,7 @@ class MextParser:
 
     var1_name = parts[0]
     var2_name = parts[1]
-    if var1_name not in self.all_variables:
+    if not self.has_variable(var1_name):
       var2_val = self.get_field_value(var2_name)
       self.locals[var1_name] = var2_val
 
@@ -380,8 +946,7 @@ class MextParser:
     self.assert_missing_statement()
     statement = self.state.statement
 
-    reg = MextParser.RegExps
-    parts = re.match(fr'^(?:\"(?P<filepath>{reg.string})\"|(?P<filepath_var>{reg.variable}))(?:\s+(?P<params>(?:{reg.variable}\s*=\s*{reg.variable})(?:,\s*{reg.variable}\s*=\s*{reg.variable})*))?$', statement)
+    parts = re.match(MextParser.Statements['include'], statement)
     if parts is None:
       self.raise_syntax_error(f'Keyword "include" requries \'@include ("filename"|filename_variable) [param=var,...]\' syntax.')
 
@@ -396,23 +961,10 @@ class MextParser:
 
     if nested_template_fn is None:
       self.raise_error(RuntimeError, f'Filepath cannot be None.')
-    nested_template_fn = str(nested_template_fn)
-    ogn_nested_fn = nested_template_fn
-    if not path.exists(nested_template_fn):
-      file_found = False
-      if not nested_template_fn.endswith('.mext') and path.exists(nested_template_fn+'.mext'):
-          nested_template_fn += '.mext'
-          file_found = True
-      if not file_found and self.template_fn is not None:
-        nested_template_fn = path.join(path.dirname(self.template_fn), nested_template_fn)
-        if path.exists(nested_template_fn):
-          file_found = True
-        else:
-          if not nested_template_fn.endswith('.mext') and path.exists(nested_template_fn+'.mext'):
-            nested_template_fn += '.mext'
-            file_found = True
-      if not file_found:
-        self.raise_error(FileNotFoundError, f'File not found: "{ogn_nested_fn}".')
+    ogn_nested_fn = str(nested_template_fn)
+    nested_template_fn = self.resolve_include_path(ogn_nested_fn)
+    if nested_template_fn is None:
+      self.raise_error(FileNotFoundError, f'File not found: "{ogn_nested_fn}".')
 
     additional_params = {}
     if parts['params'] is not None:
@@ -431,7 +983,9 @@ class MextParser:
       **additional_params,
     }
 
-    nested_parser = MextParser()
+    if self.metrics is not None:
+      self.metrics.inc('mext_includes_total', template=self.template_fn)
+    nested_parser = self.create_nested_parser()
     nested_result = nested_parser.parse(
       template=nested_template,
       template_fn=nested_template_fn,
@@ -441,24 +995,73 @@ class MextParser:
     )
     self.append_text(nested_result)
 
+  def resolve_include_path(self, fn):
+    if path.exists(fn):
+      return fn
+    if not fn.endswith('.mext') and path.exists(fn+'.mext'):
+      return fn+'.mext'
+    if self.template_fn is not None:
+      fn = path.join(path.dirname(self.template_fn), fn)
+      if path.exists(fn):
+        return fn
+      if not fn.endswith('.mext') and path.exists(fn+'.mext'):
+        return fn+'.mext'
+    return None
+
+  def resolve_import_path(self, fn):
+    if path.exists(fn):
+      return fn
+    if self.template_fn is not None:
+      fn = path.join(path.dirname(self.template_fn), fn)
+      if path.exists(fn):
+        return fn
+    return None
+
   def parse_input(self):
     self.assert_missing_statement()
 
     varname = self.state.statement
-    if varname not in self.callbacks:
+    if len(self.cache_blocks) > 0:
+      self.raise_error(RuntimeError, f'Input variable "{varname}" cannot be in a "@cache" block.')
+    if varname not in self.callbacks and not self.suspendable:
       self.raise_error(RuntimeError, f'Missing callback for input variable "{varname}".')
-    input_val = self.callbacks[varname](self.parsed_result)
+    if self.deferred is not None and self.deferred.unresolved:
+      self.deferred.resolve()
+      self.fill_deferred_results()
+    if self.input_view:
+      output = self.results.view(self.input_mark, final_strip=self.options['final_strip'])
+    else:
+      output = self.parsed_result
+    if varname not in self.callbacks:
+      raise SuspendRender(varname, str(output))
+    if self.metrics is not None:
+      start = perf_counter()
+      input_val = self.callbacks[varname](output)
+      self.metrics.observe('mext_input_duration_seconds', perf_counter() - start, variable=varname)
+    else:
+      input_val = self.callbacks[varname](output)
+    self.receive_input(varname, input_val)
 
+  def receive_input(self, varname, input_val):
     self.append_text(input_val)
     self.locals[varname] = input_val
     self.input_results[varname] = input_val
+    self.input_mark = self.results.tell()
 
   def parse_import(self):
+    if self.metrics is not None:
+      self.metrics.inc('mext_imports_total', template=self.template_fn)
+    varname, imported = self.load_import()
+    if varname is None:
+      self.locals.update(imported)
+    else:
+      self.locals[varname] = imported
+
+  def load_import(self):
     self.assert_missing_statement()
     statement = self.state.statement
 
-    reg = MextParser.RegExps
-    parts = re.match(fr'^(?:\"(?P<filepath>{reg.string})\"|(?P<filepath_var>{reg.variable}))(?:\s+as\s+(?P<namespace>{reg.variable}))?$', statement)
+    parts = re.match(MextParser.Statements['import'], statement)
     if parts is None:
       self.raise_syntax_error(f'Keyword "import" requries \'@import ("filename"|filename_variable) [as varname]\' syntax.')
 
@@ -474,30 +1077,21 @@ class MextParser:
     if import_fn is None:
       self.raise_error(RuntimeError, f'Filepath cannot be None.')
     import_fn = str(import_fn)
-    if not path.exists(import_fn):
-      file_found = False
+    if (resolved_fn := self.resolve_import_path(import_fn)) is None:
       if self.template_fn is not None:
         import_fn = path.join(path.dirname(self.template_fn), import_fn)
-        if path.exists(import_fn):
-          file_found = True
-      if not file_found:
-        self.raise_error(FileNotFoundError, f'File not found: "{parts["filepath"] or import_fn}".')
+      self.raise_error(FileNotFoundError, f'File not found: "{parts["filepath"] or import_fn}".')
+    import_fn = resolved_fn
+    self.track_file(import_fn)
 
     varname = parts['namespace']
 
     if path.splitext(import_fn)[1] in CFG.supported_extensions:
       try:
-        imported_vars = CFG.load_config(import_fn)
-        imported_vars = ObjDict.convert_recursively(imported_vars)
-        if imported_vars is None:
-          imported_vars = {}
-
-        if varname is None:
-          self.locals.update(imported_vars)
-        else:
-          self.locals[varname] = imported_vars
+        imported_vars = self.load_data(import_fn)
       except Exception as e:
         self.raise_error(RuntimeError, f'Failed to import file "{parts["filepath"]}".\n{format_exception(e)}')
+      return varname, imported_vars
     else:
       if varname is None:
         self.raise_syntax_error(f'Trying to import file "{parts["filepath"]}" as text but missing the as clause. Usage: \'@import "text_file" as varname\'.')
@@ -506,13 +1100,12 @@ class MextParser:
         with open(import_fn, 'r') as f:
           lines = f.readlines()
           imported_content = ''.join(lines)
-          self.locals[varname] = imported_content
       except Exception as e:
         self.raise_error(RuntimeError, f'Failed to import file "{parts["filepath"]}".\n{format_exception(e)}')
+      return varname, imported_content
 
   def test_statement(self, statement):
-    reg = MextParser.RegExps
-    parts = re.match(fr'(?P<operators>(not\s+)?((?:empty|undefined|novalue)\s+)?)(?P<varname>{reg.variable})', statement)
+    parts = re.match(MextParser.Statements['test'], statement)
     if parts is None:
       self.raise_syntax_error(f'Keyword "if" requires "@if [not] [empty|undefined|novalue] varname" syntax.')
 
@@ -580,8 +1173,7 @@ class MextParser:
     self.assert_missing_statement()
     statement = self.state.statement
 
-    reg = MextParser.RegExps
-    parts = re.match(fr'(?P<varnames>{reg.variable}(,\s*{reg.variable})*)\s+in\s+(?P<iterable_name>{reg.variable})', statement)
+    parts = re.match(MextParser.Statements['for'], statement)
     if parts is None:
       self.raise_syntax_error('Keyword "for" requires "@for item in iterable" syntax.')
 
@@ -606,6 +1198,7 @@ class MextParser:
         'itr': itr,
         'index': 0,
         'entry_mark': self.pos_index,
+        'iterable_name': iterable_name,
       })
       self.for_context.append(context)
       if len(varnames) == 1:
@@ -623,6 +1216,9 @@ class MextParser:
     if len(self.for_context) == 0:
       self.raise_syntax_error(f'Rebundant keyword "endfor".')
 
+    if self.record_loop_checkpoints and len(self.for_context) == 1 and len(self.scopes) == 0 and len(self.cache_blocks) == 0:
+      self.loop_checkpoints[self.for_context[-1].entry_mark] = self.capture_state()
+
     try:
       context = self.for_context[-1]
       varnames = context.varnames
@@ -641,6 +1237,79 @@ class MextParser:
     except StopIteration:
       self.for_context.pop()
 
+  def parse_cache(self):
+    self.assert_missing_statement()
+
+    parts = re.match(MextParser.Statements['cache'], self.state.statement)
+    if parts is None:
+      self.raise_syntax_error('Keyword "cache" requires "@cache key [ttl=seconds]" syntax.')
+    key_value = self.get_field_value(parts['key'])
+    ttl = None
+    if parts['ttl'] is not None:
+      ttl = self.get_field_value(parts['ttl'])
+      if not isinstance(ttl, (int, float)) or isinstance(ttl, bool) or ttl <= 0:
+        self.raise_error(RuntimeError, f'The ttl of "@cache" must be a positive number of seconds, got {ttl!r}.')
+
+    # The output of the block also depends on the whitespaces pending before it, and the block
+    # is only cached when it does not interact with the `@trim_newline` outside of it.
+    cache_key = None
+    if self.fragment_cache is not None and all(state.level < self.level for state in self.trim_newline_state):
+      try:
+        cache_key = (self.template_fn, self.template_digest(), self.pos_index, self.pending_whitespaces, make_hashable(key_value))
+      except TypeError:
+        self.raise_error(RuntimeError, f'The key of "@cache" is not hashable: {parts["key"]}.')
+      entry = self.fragment_cache.get(cache_key)
+      hit = entry is not None and (entry[0] is None or entry[0] > time()) \
+        and all(file_stamp(fn) == stamp for fn, stamp in entry[5].items())
+      if self.metrics is not None:
+        self.metrics.cache_lookup('fragment', hit)
+      if hit:
+        _, output, pending_whitespaces, updated_locals, options, files = entry
+        for fn in files:
+          self.track_file(fn)
+        if len(output) > 0:
+          if self.tracing and len(self.scopes) == 0:
+            self.trace.append(self.pos_index, self.results.tell(), len(output))
+          self.results.append(output)
+        self.pending_whitespaces = pending_whitespaces
+        self.locals.update(updated_locals)
+        self.options.update(options)
+        self.skip_until(['endcache'], ['cache'], ['endcache'])
+        return
+
+    self.cache_blocks.append(ObjDict({
+      'key': cache_key,
+      'ttl': ttl,
+      'output_mark': self.results.tell(),
+      'locals': dict(self.locals),
+      'options': dict(self.options),
+      'trim_newline_state': list(self.trim_newline_state),
+      'deferred': len(self.deferred) if self.deferred is not None else 0,
+      'files': {},
+    }))
+
+  def parse_endcache(self):
+    self.assert_unexpected_statement()
+
+    if len(self.cache_blocks) == 0:
+      self.raise_syntax_error(f'Rebundant keyword "endcache".')
+    block = self.cache_blocks.pop()
+    if block.key is None:
+      return
+    # outputs with the placeholders of async formatters are not cached
+    if (len(self.deferred) if self.deferred is not None else 0) != block.deferred:
+      return
+    if len(self.trim_newline_state) != len(block.trim_newline_state) \
+        or any(a is not b for a, b in zip(self.trim_newline_state, block.trim_newline_state)):
+      return
+
+    updated_locals = {k: v for k, v in self.locals.items() if k not in block.locals or block.locals[k] is not v}
+    options = self.options if self.options != block.options else {}
+    expires = time() + block.ttl if block.ttl is not None else None
+    # the output is rendered again once any of the templates or data files read by the block changed
+    files = {fn: file_stamp(fn) for fn in block.files}
+    self.fragment_cache.put(block.key, (expires, self.results.read(block.output_mark), self.pending_whitespaces, updated_locals, dict(options), files))
+
   def parse_trim_newline(self):
     self.assert_unexpected_statement()
 
@@ -659,8 +1328,7 @@ class MextParser:
     self.assert_missing_statement()
     statement = self.state.statement
 
-    reg = MextParser.RegExps
-    parts = re.match(fr'^(?P<format>{reg.string})\s+(?P<varname>{reg.variable})(?:\s+(?P<params>(?:{reg.variable}\s*=\s*{reg.value})(?:,\s*{reg.variable}\s*=\s*{reg.value})*))?$', statement)
+    parts = re.match(MextParser.Statements['format'], statement)
     if parts is None:
       self.raise_syntax_error(f'Keyword "format" requries \'@format "format" variable [param=var,...]\' syntax.')
 
@@ -678,8 +1346,95 @@ class MextParser:
       for k, v in formatter_params.items():
         formatter_params[k] = self.get_field_value(v)
 
-    format_res = self.formatters[format](field_value, **formatter_params)
-    self.append_text(format_res)
+    self.write_formatted(format, field_value, formatter_params)
+
+  def get_formatter(self, format):
+    if format not in self.formatters:
+      self.raise_error(RuntimeError, f'Format "{format}" is not registered.')
+    return self.formatters[format]
+
+  def get_formatter_cache(self, format, value, params):
+    if (cache := self.formatter_caches.get(format)) is None:
+      return None, None
+    try:
+      return cache, make_key((value, params))
+    except TypeError:
+      return None, None
+
+  def get_cached_format(self, cache, cache_key):
+    format_res = cache.get(cache_key)
+    if self.metrics is not None:
+      self.metrics.cache_lookup('formatter', format_res is not None)
+    return format_res
+
+  def apply_formatter(self, format, value, params={}):
+    """Return the formatted value. The pieces written by a streaming formatter are joined."""
+    formatter = self.get_formatter(format)
+    cache, cache_key = self.get_formatter_cache(format, value, params)
+    if cache is not None and (format_res := self.get_cached_format(cache, cache_key)) is not None:
+      return format_res
+
+    if format in self.streaming_formatters:
+      chunks = []
+      formatter(lambda text: chunks.append(str(text)), value, **params)
+      format_res = ''.join(chunks)
+    else:
+      format_res = formatter(value, **params)
+    if cache is not None and (not isinstance(format_res, str) or len(format_res) <= MextParser.FORMATTER_CACHE_MAX_LENGTH):
+      cache.put(cache_key, format_res)
+    return format_res
+
+  async def apply_formatter_async(self, format, value, params={}):
+    formatter = self.get_formatter(format)
+    cache, cache_key = self.get_formatter_cache(format, value, params)
+    if cache is not None and (format_res := self.get_cached_format(cache, cache_key)) is not None:
+      return format_res
+
+    format_res = await formatter(value, **params)
+    if cache is not None and (not isinstance(format_res, str) or len(format_res) <= MextParser.FORMATTER_CACHE_MAX_LENGTH):
+      cache.put(cache_key, format_res)
+    return format_res
+
+  async def format_field_async(self, field_value, filters, conversion=None, format_spec=''):
+    # the formatters after an async one in a chain are applied when its result arrives
+    for format in filters:
+      if format in self.async_formatters:
+        field_value = await self.apply_formatter_async(format, field_value)
+      else:
+        field_value = self.apply_formatter(format, field_value)
+    field_value = self.str_formatter.convert_field(field_value, conversion)
+    return self.str_formatter.format_field(field_value, format_spec)
+
+  def write_formatted(self, format, value, params={}):
+    if format in self.async_formatters:
+      self.defer(lambda: self.apply_formatter_async(format, value, params))
+      return
+    if format not in self.streaming_formatters:
+      self.append_text(self.apply_formatter(format, value, params))
+      return
+
+    formatter = self.get_formatter(format)
+    cache, cache_key = self.get_formatter_cache(format, value, params)
+    if cache is None:
+      formatter(self.append_text, value, **params)
+      return
+    if (format_res := self.get_cached_format(cache, cache_key)) is not None:
+      self.append_text(format_res)
+      return
+
+    chunks = []
+    def write(text):
+      text = str(text)
+      chunks.append(text)
+      self.append_text(text)
+    formatter(write, value, **params)
+    if sum(map(len, chunks)) <= MextParser.FORMATTER_CACHE_MAX_LENGTH:
+      cache.put(cache_key, ''.join(chunks))
+
+  def filter_field(self, field_value, filters):
+    for format in filters:
+      field_value = self.apply_formatter(format, field_value)
+    return field_value
 
   def parse_comment(self):
     self.assert_unexpected_statement()
@@ -691,28 +1446,100 @@ class MextParser:
 
     self.raise_syntax_error(f'Rebundant keyword "endcomment".')
 
+  def exec_text(self):
+    self.append_text(self.state.value)
+
+  def exec_nop(self):
+    self.level += self.state.value
+
+  def exec_assign(self):
+    varname, value = self.state.value
+    self.locals[varname] = value
+
+  def exec_update(self):
+    self.locals.update(self.state.value)
+
+  def exec_enter_scope(self):
+    # render an inlined include as if by a nested parser, see `parse_include`
+    template_fn, clauses = self.state.value
+    if self.metrics is not None:
+      self.metrics.inc('mext_includes_total', template=self.template_fn)
+    self.track_file(template_fn)
+    params = {
+      **self.params,
+      **{key: self.get_field_value(val) for key, val in clauses},
+    }
+    self.scopes.append(tuple(getattr(self, attr) for attr in MextParser.ScopeAttributes))
+
+    self.template_fn = template_fn
+    self.first_index = self.pos_index + 1
+    self.level = 0
+    self.pending_whitespaces = None
+    self.params = params
+    self.locals = {}
+    self.options = {
+      'final_strip': True,
+    }
+    self.for_context = []
+    self.trim_newline_state = []
+    self.results = OutputBuffer()
+    if self.profiler is not None:
+      self.profiler.push_frame(template_fn)
+
+  def exec_exit_scope(self):
+    nested_result = self.parsed_result
+    for attr, value in zip(MextParser.ScopeAttributes, self.scopes.pop()):
+      setattr(self, attr, value)
+    if self.profiler is not None:
+      self.profiler.pop_frame()
+    self.append_text(nested_result)
+
   def parse_field(self):
     field_value = self.get_field_value(self.state.field_name)
+    if (filters := self.state.filters) is not None:
+      if len(self.async_formatters) > 0 and not self.async_formatters.isdisjoint(filters):
+        conversion, format_spec = self.state.conversion, self.state.format_spec or ''
+        self.defer(lambda: self.format_field_async(field_value, filters, conversion, format_spec))
+        return
+      if self.state.conversion is None and not self.state.format_spec:
+        # the last formatter writes into the results directly
+        self.write_formatted(filters[-1], self.filter_field(field_value, filters[:-1]))
+        return
+      field_value = self.filter_field(field_value, filters)
     field_value = self.str_formatter.convert_field(field_value, self.state.conversion)
     field_value = self.str_formatter.format_field(field_value, self.state.format_spec)
     self.append_text(field_value)
 
   @classmethod
   def format_json(self, value):
+    import json
     return json.dumps(value, indent=2, ensure_ascii=False)
 
+  @classmethod
+  def write_json(self, write, value):
+    import json
+    chunks = json.JSONEncoder(indent=2, ensure_ascii=False).iterencode(value)
+    while len(batch := ''.join(islice(chunks, MextParser.JSON_WRITE_BATCH))) > 0:
+      write(batch)
+
+  @classmethod
+  def escape_table(self, esc_chars: str):
+    if (table := MextParser.ESCAPE_TABLES.get(esc_chars)) is None:
+      chars = set(esc_chars.encode().decode('unicode_escape'))
+      # backslashes are escaped first, so the escapes of the other characters are kept
+      table = [('\\', '\\\\')] if '\\' in chars else []
+      for char in chars - {'\\'}:
+        escaped_chr = char.encode('unicode_escape').decode()
+        if escaped_chr == char:
+          escaped_chr = '\\' + char
+        table.append((char, escaped_chr))
+      MextParser.ESCAPE_TABLES.put(esc_chars, table)
+    return table
+
   @classmethod
   def format_escape(self, value: str, esc_chars: str="\\n"):
     value = str(value)
-    esc_chars = esc_chars.encode().decode('unicode_escape')
-    esc_chars = set(esc_chars)
-
-    if '\\' in esc_chars:
-      esc_chars.remove('\\')
-      esc_chars = ['\\'] + list(esc_chars)
-    for char in esc_chars:
-      escaped_chr = char.encode('unicode_escape').decode()
-      if escaped_chr == char:
-        escaped_chr = '\\' + char
+    # str.replace is much faster than str.translate with multi-character replacements
+    for char, escaped_chr in MextParser.escape_table(esc_chars):
       value = value.replace(char, escaped_chr)
     return value
@@ -0,0 +1,123 @@
+# Copyright (C) 2024 Mext-lang team
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import os
+import gc
+import multiprocessing
+from threading import BrokenBarrierError
+from collections import deque
+from itertools import count, islice
+from concurrent.futures import ProcessPoolExecutor
+
+from mext.libs.utils import ObjDict
+
+# the contexts of the pools created in this process, inherited by their forked workers
+POOL_CONTEXTS = {}
+pool_ids = count()
+
+class RenderPool:
+  """Renders a template in a pool of forked processes.
+
+  The template, its includes and imported data files are compiled and loaded once in the
+  parent process. The workers are forked after `gc.freeze()`, so they share this context,
+  the params of the Mext and its formatters with the parent by copy-on-write. Only the params
+  of each render and the results are sent between the processes.
+  """
+
+  def __init__(self, mext, jobs=None, template=None, template_fn=None):
+    if 'fork' not in multiprocessing.get_all_start_methods():
+      raise RuntimeError('RenderPool requires the "fork" start method.')
+    self.jobs = jobs if jobs is not None and jobs > 0 else os.cpu_count()
+    self.pool_id = next(pool_ids)
+
+    parser = mext.parser
+    parser.template_loader = mext._load_template
+    compiled = parser.compile(template=template, template_fn=template_fn)
+    self.warm_up(parser, compiled)
+    mp_context = multiprocessing.get_context('fork')
+    POOL_CONTEXTS[self.pool_id] = ObjDict({
+      'mext': mext,
+      'template': compiled,
+      'template_fn': template_fn,
+      'started': mp_context.Barrier(self.jobs),
+    })
+
+    # objects created before the fork are left out of the garbage collection of the workers,
+    # which would otherwise write to, and so copy, every page holding them
+    gc.freeze()
+    try:
+      self.executor = ProcessPoolExecutor(max_workers=self.jobs, mp_context=mp_context)
+      # every worker waits for the others in one task, so they are all started now, also on the
+      # versions of Python that start them on demand
+      for future in [self.executor.submit(wait_started, self.pool_id) for _ in range(self.jobs)]:
+        future.result()
+    finally:
+      gc.unfreeze()
+
+  def warm_up(self, parser, compiled):
+    """Compile the included templates and load the imported data files that can be resolved statically."""
+    deps = parser.analyze(template=compiled, template_loader=parser.template_loader)
+    for fn in deps.includes:
+      try:
+        parser.compile(template_fn=fn)
+      except Exception:
+        pass
+    for fn in deps.imports:
+      try:
+        parser.load_data(fn)
+      except Exception:
+        pass
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc_info):
+    self.close()
+
+  def render(self, **params):
+    """Render the template with `params` in a worker. Returns a future of the result."""
+    return self.executor.submit(render_rows, self.pool_id, [params], single=True)
+
+  def map(self, rows, chunksize=16):
+    """Render the template once for each dict of params in `rows`. Yields the results in order.
+
+    Rows are sent by chunks of `chunksize`, and at most 4 chunks per worker are pending, so
+    `rows` can be a long iterator.
+    """
+    rows = iter(rows)
+    pending = deque()
+    while len(chunk := list(islice(rows, chunksize))) > 0:
+      if len(pending) >= self.jobs * 4:
+        yield from pending.popleft().result()
+      pending.append(self.executor.submit(render_rows, self.pool_id, chunk))
+    while len(pending) > 0:
+      yield from pending.popleft().result()
+
+  def close(self):
+    if self.executor is not None:
+      self.executor.shutdown()
+      self.executor = None
+      POOL_CONTEXTS.pop(self.pool_id, None)
+
+def wait_started(pool_id):
+  try:
+    POOL_CONTEXTS[pool_id].started.wait(timeout=60)
+  except BrokenBarrierError:
+    pass
+
+def render_rows(pool_id, rows, single=False):
+  context = POOL_CONTEXTS[pool_id]
+  results = [context.mext.compose(template=context.template, template_fn=context.template_fn, params=params) for params in rows]
+  return results[0] if single else results
@@ -1,28 +1,134 @@
+import os
 import sys
 import argparse
 from os import path
 
-from mext.libs.config_loader import CFG
-from mext.libs.utils import ensure_folder_exists
-from mext.libs.utils import ObjDict
-from mext import Mext
+from mext.libs.utils import ensure_folder_exists, format_exception
+from mext import Mext, MextParser
 
 def parse_args(argv=sys.argv[1:]):
   parser = argparse.ArgumentParser()
-  parser.add_argument(dest="mextfile", type=str, help="The mextfile to render.")
+  parser.add_argument(dest="mextfile", type=str, nargs="?", help="The mextfile to render.")
   parser.add_argument("-o", "--output", type=str, help="The destination to output the rendered file.")
   parser.add_argument("-p", "--params", action="append", type=str, default=[], help="The file that definited the parameters in the mextfile.")
+  parser.add_argument("--no-cache", action="store_true", help="Do not read or write compiled templates in the cache directory.")
+  parser.add_argument("-O", "--optimize", action="store_true", help="Inline included templates and fold constants before rendering.")
+  parser.add_argument("--profile", nargs="?", const="", type=str, help="Print a profile of the render to stderr, and write the collapsed stacks for flamegraph tools to the given file.")
+  parser.add_argument("--cache-dir", type=str, default=os.environ.get("MEXT_CACHE_DIR"), help="The directory to store compiled templates. Defaults to $MEXT_CACHE_DIR, or __mextcache__ next to each template.")
+  parser.add_argument("--deps", type=str, help="Write the files read by the render to this file, as make rules for the output.")
+  parser.add_argument("--watch", action="store_true", help="Keep running, and render again when the files read by the last render change.")
+  parser.add_argument("--watch-interval", type=float, default=0.5, help="The seconds between two checks for changes in watch mode.")
+  parser.add_argument("--manifest", type=str, help="Render the jobs listed in this yaml or json file instead of a single mextfile.")
+  parser.add_argument("--jsonl-in", type=str, help="Render the mextfile once for each JSON object of params in this file, or stdin for -.")
+  parser.add_argument("--jsonl-out", type=str, help="Write the results of --jsonl-in to this file, or stdout for - (default), one JSON object per line.")
+  parser.add_argument("--serve", type=str, metavar="SOCKET", help="Render the requests sent as JSON lines to this Unix socket, until interrupted.")
+  parser.add_argument("-j", "--jobs", type=int, default=1, help="The number of processes rendering the jobs of the manifest, the lines of --jsonl-in or the requests of the server. 0 uses all CPUs.")
+  parser.add_argument("--force", action="store_true", help="Render the jobs of the manifest even if their inputs are unchanged.")
   args = parser.parse_args(argv)
+  if [args.mextfile, args.manifest, args.serve].count(None) != 2:
+    parser.error("Exactly one of a mextfile, --manifest or --serve is required.")
+  if args.deps is not None and args.output is None:
+    parser.error("--deps requires --output.")
+  if args.jsonl_out is not None and args.jsonl_in is None:
+    parser.error("--jsonl-out requires --jsonl-in.")
+  if args.jsonl_in is not None and args.mextfile is None:
+    parser.error("--jsonl-in requires a mextfile.")
+  if args.jsonl_in is not None and (args.output is not None or args.deps is not None or args.watch):
+    parser.error("--jsonl-in can not be used with -o, --deps or --watch, its results are written to --jsonl-out.")
   return args
 
+def build_manifest(args):
+  from mext.libs.build import Builder
+
+  builder = Builder(args.manifest, jobs=args.jobs, optimize=args.optimize, force=args.force,
+    cache_dir=args.cache_dir, disk_cache=not args.no_cache, keep_workers=args.watch)
+  def build():
+    summary = builder.run()
+    for output, error in summary.errors.items():
+      print(f'Failed to render "{output}":\n{error}', file=sys.stderr)
+    print(f'Rendered {summary.rendered}, unchanged {summary.unchanged}, up to date {summary.skipped}, failed {summary.failed}.', file=sys.stderr)
+    return summary
+
+  if args.watch:
+    from mext.libs.watch import watch
+    def rebuild():
+      build()
+      # --force only applies to the first build
+      builder.force = False
+      return builder.watched_files()
+    try:
+      watch(rebuild, interval=args.watch_interval)
+    finally:
+      builder.close()
+  elif build().failed > 0:
+    sys.exit(1)
+
+def render_batch(args):
+  from mext.libs.batch import render_jsonl, open_jsonl
+
+  with open_jsonl(args.jsonl_in, 'r') as input, open_jsonl(args.jsonl_out or '-', 'w') as output:
+    rendered, failed = render_jsonl(args.mextfile, input, output, params_fns=args.params, jobs=args.jobs,
+      optimize=args.optimize, cache_dir=args.cache_dir, disk_cache=not args.no_cache)
+  print(f'Rendered {rendered}, failed {failed}.', file=sys.stderr)
+  if failed > 0:
+    sys.exit(1)
+
+def write_depfile(fn, target, deps):
+  """Write a make rule of `target` on `deps`, and an empty rule for each of `deps` so that
+  make does not fail when one of them is removed."""
+  escape = lambda fn: path.normpath(fn).replace('$', '$$').replace('#', '\\#').replace(' ', '\\ ')
+  deps = list(dict.fromkeys(map(escape, deps)))
+  lines = [f'{escape(target)}:' + ''.join(f' \\\n  {dep}' for dep in deps), '']
+  lines.extend(f'{dep}:' for dep in deps)
+
+  ensure_folder_exists(fn)
+  with open(fn, 'w') as f:
+    f.write('\n'.join(lines) + '\n')
+
 def render_mext():
   args = parse_args()
+  if args.manifest is not None:
+    build_manifest(args)
+    return
+  if args.serve is not None:
+    from mext.libs.server import serve
+    serve(args.serve, jobs=args.jobs, optimize=args.optimize, cache_dir=args.cache_dir, disk_cache=not args.no_cache)
+    return
+  if args.jsonl_in is not None:
+    render_batch(args)
+    return
+
+  if not args.no_cache:
+    MextParser.enable_disk_cache(args.cache_dir)
   context_mgr = Mext()
+  context_mgr.parser.enable_optimization(args.optimize)
+  context_mgr.parser.enable_profile(args.profile is not None)
+  if args.deps is not None or args.watch:
+    context_mgr.enable_file_tracking()
+
+  if args.watch:
+    from mext.libs.watch import watch
+    def render():
+      try:
+        render_template(args, context_mgr)
+      except Exception as e:
+        print(format_exception(e), file=sys.stderr)
+      else:
+        print(f'Rendered "{args.mextfile}".', file=sys.stderr)
+      return [args.mextfile, *args.params, *context_mgr.files_read]
+    watch(render, interval=args.watch_interval)
+  else:
+    render_template(args, context_mgr)
+
+def render_template(args, context_mgr):
+  # templates and params files are parsed again only if they changed since the last render
+  context_mgr.refresh_prompt_cache()
+  if context_mgr.files_read is not None:
+    context_mgr.files_read.clear()
 
   params = {}
   for param_file in args.params:
-    partial_params = CFG.load_config(param_file)
-    params.update(ObjDict.convert_recursively(partial_params))
+    params.update(context_mgr.parser.load_data(param_file))
 
   prompt = context_mgr.compose(
     template_fn=args.mextfile,
@@ -37,5 +143,16 @@ def render_mext():
     with open(args.output, 'w') as f:
       f.write(prompt)
 
+  if args.deps is not None:
+    write_depfile(args.deps, args.output, [*args.params, *context_mgr.files_read])
+
+  if args.profile is not None:
+    profiler = context_mgr.parser.profiler
+    print(profiler.report(), file=sys.stderr)
+    if len(args.profile) > 0:
+      ensure_folder_exists(args.profile)
+      with open(args.profile, 'w') as f:
+        f.write(profiler.collapsed_stacks() + '\n')
+
 if __name__ == "__main__":
   render_mext()
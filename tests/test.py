@@ -1,5 +1,10 @@
 import unittest
 
 from tests.test_objdict import TestObjDict
+from tests.test_output_buffer import TestOutputBuffer
 from tests.test_mext_parser import TestMextParser, TestBuiltInFormatter
 from tests.test_mext import TestMext
+from tests.test_compile_cache import TestCompileCache
+from tests.test_build import TestBuild
+from tests.test_server import TestServer
+from tests.test_batch import TestBatch
@@ -0,0 +1,53 @@
+import unittest
+import io
+import json
+import tempfile
+from os import path
+
+from mext.libs import batch
+from mext.libs.batch import render_jsonl
+
+class TestBatch(unittest.TestCase):
+  def setUp(self):
+    self.tmpdir = tempfile.TemporaryDirectory()
+    self.template_fn = path.join(self.tmpdir.name, 'qa.mext')
+    self.params_fn = path.join(self.tmpdir.name, 'params.yaml')
+    with open(self.template_fn, 'w') as f:
+      f.write("{prefix}{question}")
+    with open(self.params_fn, 'w') as f:
+      f.write("prefix: 'Q: '\n")
+
+  def tearDown(self):
+    self.tmpdir.cleanup()
+
+  def render(self, lines, **kwargs):
+    output = io.StringIO()
+    counts = render_jsonl(self.template_fn, io.StringIO(''.join(lines)), output, params_fns=[self.params_fn], disk_cache=False, **kwargs)
+    return counts, [json.loads(line) for line in output.getvalue().splitlines()]
+
+  def test_render_jsonl(self):
+    lines = [json.dumps({'question': f"#{index}"}) + '\n' for index in range(10)]
+    lines[3] = '{"prefix": "> ", "question": "override"}\n'
+    lines[5] = '\n'
+    lines[7] = '{"answer": 1}\n'
+    lines[8] = '[1]\n'
+
+    counts, records = self.render(lines)
+    self.assertEqual(counts, (7, 2))
+    self.assertEqual(records[0], {'result': "Q: #0"})
+    self.assertEqual(records[3], {'result': "> override"})
+    self.assertEqual([record.get('line') for record in records], [None] * 6 + [8, 9, None])
+    self.assertIn("KeyError", records[6]['error'])
+    # the files read are not tracked, as nothing reads them
+    self.assertIsNone(batch.worker.mext.files_read)
+
+  def test_render_jsonl_jobs(self):
+    lines = [json.dumps({'question': f"#{index}"}) + '\n' for index in range(100)]
+    lines[42] = 'null\n'
+    original_batch_lines = batch.BATCH_LINES
+    # many small batches, to check that the results come back in order
+    batch.BATCH_LINES = 7
+    try:
+      self.assertEqual(self.render(lines, jobs=2), self.render(lines))
+    finally:
+      batch.BATCH_LINES = original_batch_lines
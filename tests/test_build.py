@@ -0,0 +1,141 @@
+import unittest
+import os
+import tempfile
+from os import path
+
+from mext.libs.build import Builder
+
+class TestBuild(unittest.TestCase):
+  def setUp(self):
+    self.tmpdir = tempfile.TemporaryDirectory()
+    self.write('common.yaml', "greeting: Hello\n")
+    self.write('names.yaml', "names: [Alice, Bob]\n")
+    self.write('header.mext', "# {title}")
+    self.write('page.mext', """{@include "header.mext" title=name}
+{greeting} {name}.""")
+    self.write('list.mext', """{@for name in names}
+{greeting} {name}.
+{@endfor}""")
+    self.write('manifest.yaml', """defaults:
+  params: [common.yaml]
+jobs:
+  - template: page.mext
+    params: page.yaml
+    output: out/page.md
+  - template: list.mext
+    params: [names.yaml]
+    output: out/list.md
+""")
+    self.write('page.yaml', "name: Alice\n")
+
+  def tearDown(self):
+    self.tmpdir.cleanup()
+
+  def file(self, fn):
+    return path.join(self.tmpdir.name, fn)
+
+  def write(self, fn, content):
+    with open(self.file(fn), 'w') as f:
+      f.write(content)
+    # make sure each change is seen even on filesystems with a coarse mtime
+    self.clock = getattr(self, 'clock', 0) + 1
+    stat = os.stat(self.file(fn))
+    os.utime(self.file(fn), ns=(stat.st_atime_ns, stat.st_mtime_ns + self.clock * 1_000_000_000))
+
+  def read(self, fn):
+    with open(self.file(fn)) as f:
+      return f.read()
+
+  def build(self, **kwargs):
+    return Builder(self.file('manifest.yaml'), disk_cache=False, **kwargs).run()
+
+  def test_build(self):
+    summary = self.build()
+    self.assertEqual((summary.rendered, summary.skipped, summary.failed), (2, 0, 0))
+    self.assertEqual(self.read('out/page.md'), "# Alice\nHello Alice.")
+    self.assertEqual(self.read('out/list.md'), "Hello Alice.\nHello Bob.")
+
+    summary = self.build()
+    self.assertEqual((summary.rendered, summary.skipped), (0, 2))
+
+    # an included template is an input of the job
+    self.write('header.mext', "## {title}")
+    summary = self.build()
+    self.assertEqual((summary.rendered, summary.skipped), (1, 1))
+    self.assertEqual(self.read('out/page.md'), "## Alice\nHello Alice.")
+
+    # so are the default params
+    self.write('common.yaml', "greeting: Hi\n")
+    summary = self.build(jobs=2)
+    self.assertEqual((summary.rendered, summary.skipped), (2, 0))
+    self.assertEqual(self.read('out/list.md'), "Hi Alice.\nHi Bob.")
+
+    # unchanged results are not rewritten
+    summary = self.build(force=True)
+    self.assertEqual((summary.rendered, summary.unchanged, summary.skipped), (0, 2, 0))
+
+  def test_build_error(self):
+    self.write('list.mext', '{@include "missing.mext"}')
+    summary = self.build()
+    self.assertEqual((summary.rendered, summary.failed), (1, 1))
+    self.assertIn(self.file('out/list.md'), summary.errors)
+    self.assertFalse(path.exists(self.file('out/list.md')))
+
+    # failed jobs are retried on the next build
+    summary = self.build()
+    self.assertEqual((summary.skipped, summary.failed), (1, 1))
+
+  def test_build_dynamic_include(self):
+    self.write('page.yaml', "name: Alice\nheader: header.mext\n")
+    self.write('page.mext', """{@include header title=name}
+{greeting} {name}.""")
+    self.build()
+
+    # the files read by the render are known even if the analysis can not resolve them
+    summary = self.build()
+    self.assertEqual((summary.rendered, summary.skipped), (0, 2))
+    self.write('header.mext', "## {title}")
+    summary = self.build()
+    self.assertEqual((summary.rendered, summary.skipped), (1, 1))
+    self.assertEqual(self.read('out/page.md'), "## Alice\nHello Alice.")
+
+  def test_build_cached_include(self):
+    self.write('part.mext', "Part 1")
+    self.write('cached.mext', """{@cache "part"}
+{@include "part.mext"}
+{@endcache}
+{greeting}.""")
+    self.write('manifest.yaml', """defaults:
+  params: [common.yaml]
+jobs:
+  - template: cached.mext
+    output: out/a.md
+  - template: cached.mext
+    output: out/b.md
+""")
+    self.build()
+
+    # the job served from the fragment cache also depends on the included file
+    self.write('part.mext', "Part 2")
+    summary = self.build()
+    self.assertEqual((summary.rendered, summary.skipped), (2, 0))
+    self.assertEqual(self.read('out/b.md'), "Part 2\nHello.")
+
+  def test_keep_workers(self):
+    builder = Builder(self.file('manifest.yaml'), jobs=2, disk_cache=False, keep_workers=True)
+    try:
+      summary = builder.run()
+      self.assertEqual(summary.rendered, 2)
+      self.assertIn(self.file('header.mext'), builder.watched_files())
+      self.assertIn(self.file('names.yaml'), builder.watched_files())
+
+      # the workers see the changes of the templates and params files they already loaded
+      for greeting in ["Hi", "Hey"]:
+        self.write('common.yaml', f"greeting: {greeting}\n")
+        self.write('header.mext', f"# {greeting} {{title}}")
+        summary = builder.run()
+        self.assertEqual((summary.rendered, summary.failed), (2, 0))
+        self.assertEqual(self.read('out/page.md'), f"# {greeting} Alice\n{greeting} Alice.")
+        self.assertEqual(self.read('out/list.md'), f"{greeting} Alice.\n{greeting} Bob.")
+    finally:
+      builder.close()
@@ -0,0 +1,63 @@
+import unittest
+import os
+import tempfile
+from os import path
+
+from mext import MextParser
+from mext.libs.compile_cache import CompileCache
+from mext.libs.utils import LRUCache
+
+class TestCompileCache(unittest.TestCase):
+  def setUp(self):
+    self.tmpdir = tempfile.TemporaryDirectory()
+    self.template_fn = path.join(self.tmpdir.name, 'template.mext')
+    with open(self.template_fn, 'w') as f:
+      f.write("Hello {name}.")
+    MextParser.COMPILE_CACHE = LRUCache(maxsize=256)
+    MextParser.enable_disk_cache()
+
+  def tearDown(self):
+    MextParser.disable_disk_cache()
+    MextParser.COMPILE_CACHE = LRUCache(maxsize=256)
+    self.tmpdir.cleanup()
+
+  def compile(self):
+    MextParser.COMPILE_CACHE.clear()
+    return MextParser().compile(template_fn=self.template_fn)
+
+  def test_cache(self):
+    disk_cache = MextParser.DISK_CACHE
+    self.compile()
+    self.assertEqual(disk_cache.misses, 1)
+    self.assertTrue(path.exists(disk_cache.cache_path(self.template_fn)))
+    self.assertEqual(path.basename(path.dirname(disk_cache.cache_path(self.template_fn))), CompileCache.Folder)
+
+    compiled = self.compile()
+    self.assertEqual(disk_cache.hits, 1)
+    self.assertEqual(MextParser().parse(compiled, params={'name': "Alice"}), "Hello Alice.")
+
+    with open(self.template_fn, 'w') as f:
+      f.write("Bye {name}.")
+    compiled = self.compile()
+    self.assertEqual(disk_cache.misses, 2)
+    self.assertEqual(MextParser().parse(compiled, params={'name': "Alice"}), "Bye Alice.")
+
+  def test_fallback(self):
+    disk_cache = MextParser.DISK_CACHE
+    self.compile()
+    with open(disk_cache.cache_path(self.template_fn), 'wb') as f:
+      f.write(b'corrupted')
+    compiled = self.compile()
+    self.assertEqual(disk_cache.misses, 2)
+    self.assertEqual(MextParser().parse(compiled, params={'name': "Alice"}), "Hello Alice.")
+
+    other_version = CompileCache(tag='mext-0.0.0-0')
+    self.assertIsNone(other_version.load(self.template_fn))
+
+  def test_cache_dir(self):
+    cache_dir = path.join(self.tmpdir.name, 'cache')
+    MextParser.enable_disk_cache(cache_dir)
+    self.compile()
+    self.assertEqual(len(os.listdir(cache_dir)), 1)
+    self.compile()
+    self.assertEqual(MextParser.DISK_CACHE.hits, 1)
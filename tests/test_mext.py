@@ -1,12 +1,20 @@
 import unittest
 import os
 import subprocess
+import tempfile
+import multiprocessing
 from pathlib import Path
 from functools import partial
 
 from mext import Mext
 from mext.libs.utils import ObjDict
 
+def write_file(fn, content, mtime):
+  """Write `content` to `fn`, with `mtime` in nanoseconds, so changes are seen whatever the resolution of the file system."""
+  with open(fn, 'w') as f:
+    f.write(content)
+  os.utime(fn, ns=(mtime, mtime))
+
 class TestMext(unittest.TestCase):
   dirs = ObjDict({
     'template_language_usage': Path("tests/mext/readme/template_language_usage"),
@@ -33,3 +41,262 @@ class TestMext(unittest.TestCase):
         if proc.stdout.endswith('\n'):
           stdout = proc.stdout[:-1]
         self.assertEqual(stdout, expected_result, msg=proc.stderr or None)
+
+  def test_lazy_imports(self):
+    # the optional features import these modules when first used, keeping `import mext` fast
+    modules = ['yaml', 'mext.libs.deferred', 'mext.libs.metrics', 'mext.libs.profiler', 'mext.libs.trace',
+      'mext.libs.compile_cache', 'mext.libs.build', 'mext.libs.batch', 'mext.libs.server', 'mext.libs.watch',
+      'mext.mext_pool', 'mext.mext_incremental']
+    proc = subprocess.run(["python3", "-c", f"import sys, mext; print(*[m for m in {modules!r} if m in sys.modules])"],
+      stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, env={**os.environ, 'PYTHONPATH': os.getcwd()})
+    self.assertEqual(proc.returncode, 0, msg=proc.stderr)
+    self.assertEqual(proc.stdout.split(), [])
+
+  def test_specialize(self):
+    mext = Mext()
+    mext.set_template(template="""\
+{@import "tests/mext/data/data1.yaml"}
+{@default name "Bob"}
+{name} is {age} years old.
+{question}
+""")
+    specialized = mext.specialize()
+    self.assertEqual(specialized.template.static_prefix, "Alice is 19 years old.")
+    self.assertEqual(specialized.compose(question="Why?"), "Alice is 19 years old.\nWhy?")
+    self.assertEqual(specialized.compose(question="Why?"), mext.compose(question="Why?"))
+
+  def test_render_cache(self):
+    mext = Mext()
+    mext.enable_render_cache()
+    mext.set_template(template="Hello {user.name}.")
+
+    user = ObjDict({'name': "Alice"})
+    self.assertEqual(mext.compose(user=user, request_id=1), "Hello Alice.")
+    self.assertEqual(mext.compose(user=user, request_id=2), "Hello Alice.")
+    self.assertEqual(mext.render_cache.hits, 1)
+    self.assertEqual(mext.compose(user=ObjDict({'name': "Bob"}), request_id=3), "Hello Bob.")
+    self.assertEqual(mext.render_cache.hits, 1)
+    self.assertEqual(len(mext.render_cache), 2)
+
+    # impure formatters bypass the cache
+    counter = iter(range(10))
+    mext.parser.register_formatter('counter', lambda _: next(counter))
+    mext.set_template(template="{@format counter user}")
+    self.assertEqual(mext.compose(user=user), "0")
+    self.assertEqual(mext.compose(user=user), "1")
+    self.assertEqual(len(mext.render_cache), 2)
+
+    # the cached renders follow the formatters registered again, or removed
+    mext.parser.register_formatter('tag', lambda value: f"<{value}>", pure=True)
+    mext.set_template(template="{name|tag}")
+    self.assertEqual(mext.compose(name="Alice"), "<Alice>")
+    mext.parser.register_formatter('tag', lambda value: f"[{value}]", pure=True)
+    self.assertEqual(mext.compose(name="Alice"), "[Alice]")
+    mext.parser.remove_formatter('tag')
+    with self.assertRaises(RuntimeError):
+      mext.compose(name="Alice")
+
+  def test_incremental(self):
+    mext = Mext()
+    mext.set_template(template="""\
+{system}
+{@if not empty history}
+History:
+{@endif}
+{@for message in history}
+{@count turn}
+{@trim_newline}
+{@if message.hidden}
+(hidden)
+{@else}
+[{turn}] {message.role}: {message.content}
+{@endif}
+{@endfor}
+Turns so far: {turn}
+""")
+    mext.set_params(system="You are a helpful assistant.")
+
+    history = [
+      ObjDict({'role': "user", 'content': "Hi", 'hidden': False}),
+      ObjDict({'role': "assistant", 'content': "Hello!", 'hidden': False}),
+    ]
+    handle = mext.incremental()
+    self.assertEqual(handle.render(history=history), mext.compose(history=history))
+
+    for content in ["How are you?", "Fine.", "Bye"]:
+      history.append(ObjDict({'role': "user", 'content': content, 'hidden': content == "Fine."}))
+      self.assertEqual(handle.render(history=history), mext.compose(history=history))
+    self.assertEqual(handle.full_renders, 1)
+    self.assertEqual(handle.incremental_renders, 3)
+
+    # a change in another param requires a full render
+    self.assertEqual(handle.render(history=history, system="Be brief."), mext.compose(history=history, system="Be brief."))
+    # as well as modifying previous items
+    history[0].content = "Hey"
+    self.assertEqual(handle.render(history=history, system="Be brief."), mext.compose(history=history, system="Be brief."))
+    self.assertEqual(handle.full_renders, 3)
+
+  def test_metrics(self):
+    mext = Mext()
+    metrics = mext.enable_metrics()
+    mext.enable_render_cache()
+    mext.set_template(template="""\
+{@include "tests/mext/prompts/include1.mext" var1=name}
+{@input answer}
+{answer}
+""")
+    result, _ = mext.compose(name="a", callbacks={'answer': lambda _: "42"})
+    self.assertEqual(result, mext.compose(name="a", callbacks={'answer': lambda _: "42"})[0])
+
+    mext.set_template(template="Hello {name}.")
+    mext.compose(name="Alice")
+    mext.compose(name="Alice")
+    with self.assertRaises(Exception):
+      mext.compose()
+
+    snapshot = metrics.snapshot()
+    values = lambda name: {tuple(sorted(value['labels'].items())): value for value in snapshot[name]['values']}
+    self.assertEqual(values('mext_renders_total')[(('template', '<string>'),)]['value'], 4)
+    self.assertEqual(values('mext_render_errors_total')[(('template', '<string>'),)]['value'], 1)
+    self.assertEqual(values('mext_includes_total')[(('template', '<string>'),)]['value'], 2)
+    self.assertEqual(values('mext_cache_hits_total')[(('cache', 'render'),)]['value'], 1)
+    self.assertEqual(values('mext_cache_misses_total')[(('cache', 'render'),)]['value'], 2)
+    self.assertEqual(values('mext_input_duration_seconds')[(('variable', 'answer'),)]['count'], 2)
+    sizes = values('mext_output_size_bytes')[(('template', '<string>'),)]
+    self.assertEqual(sizes['count'], 4)
+    self.assertEqual(sizes['buckets']['+Inf'], 4)
+
+    exposition = metrics.to_prometheus()
+    self.assertIn('# TYPE mext_render_duration_seconds histogram', exposition)
+    self.assertIn('mext_renders_total{template="<string>"} 4', exposition)
+    self.assertIn('mext_output_size_bytes_bucket{template="<string>",le="+Inf"} 4', exposition)
+
+  def test_file_tracking(self):
+    mext = Mext()
+    mext.enable_file_tracking()
+    mext.enable_render_cache()
+    template = """\
+{@import "tests/mext/data/data1.yaml"}
+{@include include_fn var1=name}
+"""
+    mext.compose(template=template, include_fn="tests/mext/prompts/include1.mext", name="a")
+    self.assertEqual(list(mext.files_read), ["tests/mext/data/data1.yaml", "tests/mext/prompts/include1.mext"])
+
+    mext.files_read.clear()
+    mext.compose(template_fn="tests/mext/prompts/include1.mext")
+    mext.compose(template_fn="tests/mext/prompts/include1.mext")
+    self.assertEqual(list(mext.files_read), ["tests/mext/prompts/include1.mext"])
+
+    # inlined includes are recorded when they are rendered
+    mext.files_read.clear()
+    mext.disable_render_cache()
+    mext.parser.enable_optimization(True)
+    mext.compose(template='{@include "tests/mext/prompts/include1.mext"}')
+    self.assertEqual(list(mext.files_read), ["tests/mext/prompts/include1.mext"])
+
+    mext.disable_file_tracking()
+    mext.compose(template_fn="tests/mext/prompts/empty.mext")
+    self.assertIsNone(mext.files_read)
+
+  def test_reload_changed_files(self):
+    with tempfile.TemporaryDirectory() as tmpdir:
+      template_fn = os.path.join(tmpdir, 'template.mext')
+      data_fn = os.path.join(tmpdir, 'data.yaml')
+      write_file(template_fn, '{@import "data.yaml"}\n{greeting} {name}.', 1_000_000_000)
+      write_file(data_fn, "greeting: Hello\n", 1_000_000_000)
+      mext = Mext()
+      metrics = mext.enable_metrics()
+      self.assertEqual(mext.compose(template_fn=template_fn, name="Alice"), "Hello Alice.")
+      self.assertNotIn(template_fn, mext.refresh_prompt_cache())
+      self.assertEqual(mext.compose(template_fn=template_fn, name="Bob"), "Hello Bob.")
+      data = metrics.snapshot()
+      self.assertEqual([value['value'] for value in data['mext_cache_hits_total']['values'] if value['labels'] == {'cache': 'data'}], [1])
+
+      write_file(template_fn, '{@import "data.yaml"}\n{greeting}, {name}!', 2_000_000_000)
+      write_file(data_fn, "greeting: Hi\n", 2_000_000_000)
+      self.assertIn(template_fn, mext.refresh_prompt_cache())
+      self.assertEqual(mext.compose(template_fn=template_fn, name="Alice"), "Hi, Alice!")
+
+  def test_fragment_cache_files(self):
+    with tempfile.TemporaryDirectory() as tmpdir:
+      part_fn = os.path.join(tmpdir, 'part.mext')
+      write_file(part_fn, "Part 1", 1_000_000_000)
+      mext = Mext()
+      mext.enable_file_tracking()
+      template = '{@cache "part"}{@include part_fn}{@endcache}'
+      self.assertEqual(mext.compose(template=template, part_fn=part_fn), "Part 1")
+      mext.files_read.clear()
+      self.assertEqual(mext.compose(template=template, part_fn=part_fn), "Part 1")
+      self.assertEqual(list(mext.files_read), [part_fn])
+
+      write_file(part_fn, "Part 2", 2_000_000_000)
+      mext.refresh_prompt_cache()
+      self.assertEqual(mext.compose(template=template, part_fn=part_fn), "Part 2")
+
+  def test_render_cache_files(self):
+    with tempfile.TemporaryDirectory() as tmpdir:
+      template_fn = os.path.join(tmpdir, 'main.mext')
+      part_fn = os.path.join(tmpdir, 'part.mext')
+      write_file(template_fn, "Hello {name}", 1_000_000_000)
+      write_file(part_fn, "!", 1_000_000_000)
+      mext = Mext()
+      mext.enable_render_cache()
+      self.assertEqual(mext.compose(template_fn=template_fn, name="x"), "Hello x")
+
+      # edits to the template file
+      write_file(template_fn, '{@include "part.mext"}Bye {name}', 2_000_000_000)
+      mext.refresh_prompt_cache()
+      self.assertEqual(mext.compose(template_fn=template_fn, name="x"), "!Bye x")
+      self.assertEqual(mext.compose(template_fn=template_fn, name="x"), "!Bye x")
+      self.assertEqual(mext.render_cache.hits, 1)
+
+      # and to the files it includes
+      write_file(part_fn, "?", 2_000_000_000)
+      mext.refresh_prompt_cache()
+      self.assertEqual(mext.compose(template_fn=template_fn, name="x"), "?Bye x")
+
+  @unittest.skipUnless('fork' in multiprocessing.get_all_start_methods(), "requires fork")
+  def test_pool(self):
+    mext = Mext()
+    mext.set_template(template="""\
+{@include "tests/mext/prompts/include1.mext" var1=enabled}
+{greeting|shout} {name}.""")
+    mext.set_params(greeting="Hello")
+    # formatters are shared with the workers without being pickled
+    mext.parser.register_formatter('shout', lambda value: value.upper())
+    rows = [{'name': f"#{index}", 'enabled': index % 2 == 0} for index in range(50)]
+    expected = [mext.compose(**row) for row in rows]
+
+    with mext.pool(jobs=2) as pool:
+      # the workers are all forked when the pool is created
+      self.assertEqual(len(pool.executor._processes), 2)
+      self.assertEqual(list(pool.map(rows, chunksize=3)), expected)
+      self.assertEqual(pool.render(name="Alice", enabled=True).result(), "Using default value.\nHELLO Alice.")
+      with self.assertRaises(RuntimeError):
+        pool.render(enabled=True).result()
+
+    # the rows are pickled, ObjDicts included
+    mext.set_template(template="{user.name} ({user.team.name})")
+    rows = [{'user': ObjDict.convert_recursively({'name': f"#{index}", 'team': {'name': "A"}})} for index in range(4)]
+    with mext.pool(jobs=2) as pool:
+      self.assertEqual(list(pool.map(rows)), [f"#{index} (A)" for index in range(4)])
+      self.assertEqual(pool.render(**rows[0]).result(), "#0 (A)")
+
+  def test_resume(self):
+    with tempfile.TemporaryDirectory() as tmpdir:
+      template_fn = os.path.join(tmpdir, 'chain.mext')
+      with open(template_fn, 'w') as f:
+        f.write('{@include "tests/mext/prompts/include1.mext" var1=enabled}\nQuestion: {question}\nAnswer: {@input answer}\nSummary: {@input summary}')
+      mext = Mext()
+      mext.set_params(enabled=True)
+      metrics = mext.enable_metrics()
+
+      rendered = mext.compose_resumable(template_fn=template_fn, question="Why?")
+      self.assertEqual(rendered.output, "Using default value.\nQuestion: Why?\nAnswer:")
+      rendered = Mext().resume(rendered.continuation, "Because.", enabled=True, question="Why?")
+      self.assertEqual((rendered.input, rendered.output), ("summary", "Using default value.\nQuestion: Why?\nAnswer: Because.\nSummary:"))
+      rendered = mext.resume(rendered.continuation, "Done.", question="Why?")
+      self.assertEqual(rendered.result, "Using default value.\nQuestion: Why?\nAnswer: Because.\nSummary: Done.")
+      self.assertEqual(rendered.input_results, {'answer': "Because.", 'summary': "Done."})
+      # a render is recorded once it completes
+      self.assertEqual([value['value'] for value in metrics.snapshot()['mext_renders_total']['values']], [1])
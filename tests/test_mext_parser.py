@@ -1,9 +1,12 @@
 import unittest
 import os
+import json
+import time
+import asyncio
 from os import path
 from enum import Enum
 
-from mext.libs.utils import ObjDict
+from mext.libs.utils import ObjDict, LRUCache
 from mext import MextParser
 
 class TestMextParser(unittest.TestCase):
@@ -218,6 +221,31 @@ We now know that Alice is 19 year old.\
       'age': 19,
     })
 
+  def test_input_view(self):
+    outputs = []
+    def record(value):
+      def callback(output):
+        outputs.append((output.delta, str(output)))
+        return value
+      return callback
+
+    parser = MextParser()
+    parser.enable_input_view(True)
+    res = parser.parse("""\
+Prompt: hi
+name: {@input name}
+age: {@input age}
+""",
+      callbacks={
+        'name': record("Alice"),
+        'age': record(19),
+    })
+    self.assertEqual(res, "Prompt: hi\nname: Alice\nage: 19")
+    self.assertListEqual(outputs, [
+      ("Prompt: hi\nname: ", "Prompt: hi\nname:"),
+      ("\nage: ", "Prompt: hi\nname: Alice\nage:"),
+    ])
+
   def test_import(self):
     parser = MextParser()
     res = parser.parse("""\
@@ -900,6 +928,483 @@ Some sentences without indents.
 End of the some clauses.\
 """)
 
+  def test_specialize(self):
+    template = """\
+You are {persona.name}.
+{@set greeting "Hello"}
+{@if persona.formal}
+{greeting}, {user}.
+{@elif polite}
+Hi, {user}.
+{@else}
+Hey.
+{@endif}
+{@for item in items}
+- {item} by {persona.name}
+{@endfor}
+"""
+    persona = ObjDict({
+      'name': "Mext",
+      'formal': False,
+    })
+    params = {
+      'persona': persona,
+      'polite': True,
+      'user': "Alice",
+      'items': ["a", "b"],
+    }
+
+    parser = MextParser()
+    expected = parser.parse(template, params=params)
+
+    residual = parser.specialize(template, params={'persona': persona})
+    ops = [component.op for component in residual.components]
+    self.assertIn('text', ops)
+    self.assertIn('assign', ops)
+    self.assertNotIn('@if persona.formal', [component.field_name for component in residual.components if component.keyword == 'if'])
+    self.assertEqual(residual.static_prefix, "You are Mext.")
+    self.assertEqual(parser.parse(residual, params=params), expected)
+    self.assertEqual(parser.parse(residual, params={**params, 'polite': False}), expected.replace("Hi, Alice.", "Hey."))
+
+    residual = parser.specialize(template, params=params)
+    self.assertEqual(residual.static_prefix, "You are Mext.\nHi, Alice.")
+    self.assertEqual(parser.parse(residual, params=params), expected)
+
+  def test_analyze(self):
+    parser = MextParser()
+    deps = parser.analyze("""\
+{@default title "Report"}
+{@if show_user}
+{user.name} ({user["age"]})
+{@endif}
+{@for item in items}
+{@format json item.value indent=width}
+{@endfor}
+{@comment}{ignored}{@endcomment}
+{@include "tests/mext/prompts/include1" var1=flag}
+{@import "tests/mext/data/data1.yaml"}
+""")
+    self.assertSetEqual(deps.variables, {'title', 'show_user', 'user.name', 'user["age"]', 'items', 'item.value', 'width', 'flag', 'var2'})
+    self.assertSetEqual(deps.includes, {'tests/mext/prompts/include1.mext'})
+    self.assertSetEqual(deps.imports, {'tests/mext/data/data1.yaml'})
+    self.assertSetEqual(deps.formatters, {'json'})
+    self.assertTrue(deps.complete)
+    self.assertFalse(deps.has_input)
+
+    deps = parser.analyze("""{@include prompts.template1}{@input answer}""")
+    self.assertSetEqual(deps.variables, {'prompts.template1'})
+    self.assertFalse(deps.complete)
+    self.assertTrue(deps.has_input)
+
+  def test_optimize(self):
+    template = """\
+{@comment}
+Not rendered.
+{@endcomment}
+{@set mode "strict"}
+Header
+  {@include "tests/mext/prompts/include1" var1=flag}
+{@if mode}
+Mode: {mode}
+{@endif}
+{@if false}
+Never.
+{@endif}
+{@for item in items}
+- {@include "tests/mext/prompts/include1" var2=item}
+{@endfor}
+"""
+    params = {
+      'flag': False,
+      'items': ["a", ""],
+    }
+
+    parser = MextParser()
+    expected = parser.parse(template, params=params)
+
+    parser.enable_optimization(True)
+    compiled = parser.compile(template)
+    ops = [component.op for component in compiled.components]
+    self.assertEqual(ops.count('enter_scope'), 2)
+    self.assertEqual(ops.count('exit_scope'), 2)
+    self.assertNotIn('comment', [component.keyword for component in compiled.components])
+    self.assertNotIn('@if mode', [component.field_name for component in compiled.components if component.keyword == 'if'])
+    self.assertSetEqual(set(compiled.dependencies.keys()), {'tests/mext/prompts/include1.mext'})
+    self.assertEqual(parser.parse(template, params=params), expected)
+    self.assertEqual(parser.parse(template, params={**params, 'flag': True, 'items': []}),
+      MextParser().parse(template, params={**params, 'flag': True, 'items': []}))
+
+    deps = parser.analyze(template)
+    self.assertSetEqual(deps.variables, {'flag', 'items', 'item', 'var1', 'var2'})
+    self.assertSetEqual(deps.includes, {'tests/mext/prompts/include1.mext'})
+
+    # an included template that can not be rendered on its own is left to a nested parser
+    parser.template_loader = lambda fn: "{@if false}\nUnclosed."
+    compiled = parser.compile("Before {@include \"tests/mext/prompts/include1\"} after.")
+    self.assertNotIn('enter_scope', [component.op for component in compiled.components])
+    self.assertEqual(parser.parse(compiled, template_loader=parser.template_loader), "Before  after.")
+
+    # errors in an inlined template are reported against the included file
+    with self.assertRaisesRegex(RuntimeError, 'include1.mext", line 2'):
+      parser.parse("{@include \"tests/mext/prompts/include1\"}", template_loader=lambda fn: "\n{missing}")
+
+  def test_profile(self):
+    template = """\
+{@for item in items}
+- {item}
+{@endfor}
+{@include "tests/mext/prompts/include1" var2=flag}
+"""
+    params = {
+      'items': ["a", "b", "c"],
+      'flag': "on",
+    }
+
+    for optimize in [False, True]:
+      parser = MextParser()
+      parser.enable_optimization(optimize)
+      parser.enable_profile(True)
+      res = parser.parse(template, params=params)
+      res = parser.parse(template, params=params)
+
+      profiler = parser.profiler
+      self.assertEqual(profiler.renders, 2)
+      entries = profiler.entries
+      self.assertEqual(entries[(('<template>',), None, 2, '{item}')].calls, 6)
+      include_entry = entries[(('<template>',), None, 4, '@include "tests/mext/prompts/include1" var2=flag')]
+      self.assertEqual(include_entry.calls, 2)
+      self.assertEqual(entries[(('<template>', 'tests/mext/prompts/include1.mext'), 'tests/mext/prompts/include1.mext', 9, '{var2}')].calls, 2)
+      self.assertGreaterEqual(sum(entry.bytes for entry in entries.values()), 2*len(res))
+      self.assertLessEqual(sum(entry.time for entry in entries.values()), profiler.total_time + 1e-6)
+
+      report = profiler.report()
+      self.assertIn('{item}  (<template>:2)', report)
+      self.assertIn('tests/mext/prompts/include1.mext:9', report)
+      stacks = profiler.collapsed_stacks(value='bytes').splitlines()
+      self.assertIn('<template>;tests/mext/prompts/include1.mext;{var2} (tests/mext/prompts/include1.mext:9) 56', stacks)
+
+    parser.enable_profile(False)
+    self.assertIsNone(parser.profiler)
+
+  def test_trace(self):
+    template = """\
+
+Name: {name}
+{@for item in items}
+- {item}
+{@endfor}
+"""
+    params = {
+      'name': "Alice",
+      'items': ["apple", "banana", "cherry"],
+    }
+
+    parser = MextParser()
+    parser.enable_trace(True)
+    res = parser.parse(template, params=params)
+    self.assertEqual(res, "Name: Alice\n- apple\n- banana\n- cherry")
+    self.assertTrue(parser.trace.sampled)
+
+    location = parser.trace.locate(res.index("Alice"))
+    self.assertEqual(location.lineno, 2)
+    self.assertEqual(location.field_name, "name")
+    self.assertEqual(res[location.offset:location.offset+location.length], "Alice")
+    location = parser.trace.locate(res.index("banana"))
+    self.assertEqual(location.lineno, 4)
+    self.assertEqual(location.field_name, "item")
+    self.assertEqual(parser.trace.locate(0).field_name, "name")
+
+    parser.enable_trace(True, capacity=2, sample_rate=2)
+    parser.parse(template, params=params)
+    self.assertTrue(parser.trace.sampled)
+    self.assertEqual(len(parser.trace), 2)
+    self.assertIsNone(parser.trace.locate(0))
+    self.assertEqual(parser.trace.locate(len(res)-1).field_name, "item")
+
+    records = list(parser.trace)
+    parser.parse(template, params=params)
+    self.assertFalse(parser.trace.sampled)
+    self.assertListEqual(list(parser.trace), records)
+
+    parser.enable_trace(False)
+    self.assertIsNone(parser.trace)
+
+  def test_formatter_cache(self):
+    calls = []
+    def shout(value, suffix='!'):
+      calls.append(value)
+      return str(value).upper() + suffix
+
+    parser = MextParser()
+    parser.register_formatter('shout', shout, pure=True, cache_size=2)
+    template = """\
+{@for item in items}
+{@format shout item}
+{@endfor}
+{@format shout item suffix="?"}
+"""
+    self.assertEqual(parser.parse(template, params={'items': ["a", "b", "a"], 'item': "a"}), "A!\nB!\nA!\nA?")
+    self.assertListEqual(calls, ["a", "b", "a"])
+
+    # the cache is keyed by content, so mutated values are formatted again
+    data = {'value': 1}
+    self.assertEqual(parser.parse("{@format json data}", params={'data': data}), '{\n  "value": 1\n}')
+    data['value'] = 2
+    self.assertEqual(parser.parse("{@format json data}", params={'data': data}), '{\n  "value": 2\n}')
+    self.assertEqual(parser.parse("{@format json data}", params={'data': {'value': True}}), '{\n  "value": true\n}')
+    rows = [ObjDict({'value': 1})]
+    self.assertEqual(parser.parse("{@format shout rows}", params={'rows': rows}), "[{'VALUE': 1}]!")
+    rows[0].value = 2
+    self.assertEqual(parser.parse("{@format shout rows}", params={'rows': rows}), "[{'VALUE': 2}]!")
+
+    # values that are not plain data are not cached
+    calls.clear()
+    obj = object()
+    parser.parse("{@format shout obj}{@format shout obj}", params={'obj': obj})
+    self.assertListEqual(calls, [obj, obj])
+
+    with self.assertRaises(ValueError):
+      parser.register_formatter('shout', shout, cache_size=2)
+    parser.register_formatter('shout', shout, pure=True)
+    self.assertNotIn('shout', parser.formatter_caches)
+
+  def test_field_accessor(self):
+    parser = MextParser()
+    template = "{user.name} {user.tags[1]} {user[tags][0]} {user.items.__name__}"
+    user = ObjDict({'name': "Alice", 'tags': ["a", "b"]})
+    self.assertEqual(parser.parse(template, params={'user': user}), "Alice b a items")
+    # the cached steps must follow a change of type
+    user = {'name': "Bob", 'tags': ["c", "d"]}
+    with self.assertRaisesRegex(RuntimeError, "'dict' object has no attribute 'name'"):
+      parser.parse(template, params={'user': user})
+    user = Enum('User', ['name', 'tags'])
+    self.assertEqual(parser.parse("{user.name.name}", params={'user': user}), "name")
+
+    # locals shadow params, which shadow constants
+    self.assertEqual(parser.parse("{true} {@set true name}{true}", params={'name': "Carol"}), "True Carol")
+    with self.assertRaisesRegex(RuntimeError, "AttributeError: 'ObjDict' object has no attribute 'age'"):
+      parser.parse("{user.age}", params={'user': ObjDict({'name': "Alice"})})
+
+  def test_filter(self):
+    parser = MextParser()
+    params = {
+      'doc': ObjDict({'title': "Hello\nWorld", 'tags': ["a", "b"]}),
+      'table': {'a|b': "Pipe"},
+    }
+    self.assertEqual(parser.parse("{doc.title|lower|escape}", params=params), "hello\\nworld")
+    self.assertEqual(parser.parse("{doc.title | upper}", params=params), "HELLO\nWORLD")
+    self.assertEqual(parser.parse("[{doc.title|capitalize!r:>16}]", params=params), "[  'Hello\\nworld']")
+    self.assertEqual(parser.parse("{doc.tags|json}", params=params), '[\n  "a",\n  "b"\n]')
+    self.assertEqual(parser.parse("{table[a|b]|upper}", params=params), "PIPE")
+
+    with self.assertRaisesRegex(RuntimeError, 'Format "title" is not registered.'):
+      parser.parse("{doc|title}", params=params)
+
+    deps = parser.analyze(template="{doc.title|lower|escape}")
+    self.assertSetEqual(deps.variables, {'doc.title'})
+    self.assertSetEqual(deps.formatters, {'lower', 'escape'})
+
+    compiled = parser.specialize(template="{doc.title|lower} {name|upper}", params=params)
+    self.assertEqual(compiled.components[0].op, 'text')
+    self.assertEqual(compiled.components[0].value, "hello\nworld")
+    self.assertIsNone(compiled.components[1].op)
+    self.assertEqual(parser.parse(compiled, params={**params, 'name': "Bob"}), "hello\nworld BOB")
+
+  def test_streaming_formatter(self):
+    def lines(write, items, bullet='-'):
+      for item in items:
+        write(f'{bullet} {item}\n')
+
+    parser = MextParser()
+    parser.register_formatter('lines', lines, streaming=True)
+    template = """\
+Items:
+{@format lines items bullet="*"}
+Done.
+"""
+    self.assertEqual(parser.parse(template, params={'items': ["a", "b"]}), "Items:\n* a\n* b\n\nDone.")
+    self.assertEqual(parser.parse(template, params={'items': []}), "Items:\nDone.")
+
+    parser.register_formatter('lines', lines, pure=True, cache_size=4, streaming=True)
+    self.assertEqual(parser.parse(template, params={'items': ["a", "b"]}), "Items:\n* a\n* b\n\nDone.")
+    self.assertEqual(parser.parse(template, params={'items': ["a", "b"]}), "Items:\n* a\n* b\n\nDone.")
+    self.assertEqual(parser.formatter_caches['lines'].hits, 1)
+
+    # large values are written by pieces
+    value = {'rows': [{'id': i, 'text': "Lorem ipsum."} for i in range(MextParser.JSON_WRITE_BATCH)]}
+    parser.enable_trace(True)
+    self.assertEqual(parser.parse("{@format json value}", params={'value': value}), json.dumps(value, indent=2, ensure_ascii=False))
+    self.assertGreater(len(parser.trace), 1)
+
+  def test_async_formatter(self):
+    running = {'now': 0, 'max': 0}
+    async def lookup(value, suffix=""):
+      running['now'] += 1
+      running['max'] = max(running['max'], running['now'])
+      await asyncio.sleep(0.01)
+      running['now'] -= 1
+      return f"<{value}{suffix}>"
+
+    parser = MextParser()
+    parser.register_formatter('lookup', lookup)
+    template = """\
+{@for name in names}
+{name|lookup|upper}
+{@endfor}
+{@format lookup last suffix="?"}
+"""
+    params = {'names': ["a", "b", "c"], 'last': "d"}
+    self.assertEqual(parser.parse(template, params=params), "<A>\n<B>\n<C>\n<d?>")
+    # the calls are awaited together
+    self.assertEqual(running['max'], 4)
+
+    # the calls before an @input are awaited before its callback
+    template = """\
+{first|lookup}
+{@input answer}
+{second|lookup:>6}
+"""
+    callbacks = {'answer': lambda output: f" [{output}]"}
+    expected = "<1>\n [<1>]\n   <2>"
+    self.assertEqual(parser.parse(template, params={'first': 1, 'second': 2}, callbacks=callbacks), expected)
+    self.assertEqual(asyncio.run(parser.parse_async(template, params={'first': 1, 'second': 2}, callbacks=callbacks)), expected)
+
+    async def fail(value):
+      raise ValueError("Lookup failed.")
+    parser.register_formatter('fail', fail)
+    with self.assertRaisesRegex(RuntimeError, 'Line 2, around "name".\n  ValueError: Lookup failed.'):
+      parser.parse("Hello\n{name|fail}", params={'name': "Alice"})
+    with self.assertRaisesRegex(RuntimeError, 'parse_async'):
+      asyncio.run(self.parse_in_event_loop(parser, "{name|lookup}", {'name': "Alice"}))
+    with self.assertRaises(ValueError):
+      parser.register_formatter('lookup', lookup, streaming=True)
+
+    # an async result is laid out as non-empty, even if it is empty
+    async def empty(value):
+      return ""
+    parser.register_formatter('empty', empty)
+    self.assertEqual(parser.parse("a\n{@trim_newline}\n{@format empty x}\n\nb", params={'x': 1}), "a\n\n\nb")
+    self.assertEqual(parser.parse("a\n  {@format empty x}\nb", params={'x': 1}), "a\n  \nb")
+    parser.register_formatter('empty', lambda value: "")
+    self.assertEqual(parser.parse("a\n  {@format empty x}\nb", params={'x': 1}), "a\nb")
+
+    # async formatters are not folded
+    compiled = parser.specialize(template="{name|lookup}", params={'name': "Alice"})
+    self.assertIsNone(compiled.components[0].op)
+
+  async def parse_in_event_loop(self, parser, template, params):
+    return parser.parse(template, params=params)
+
+  def test_resumable_input(self):
+    template = """\
+Questions.
+{@for step in steps}
+Step {step}:
+{@trim_newline}
+{@if verbose}
+(verbose)
+{@endif}
+{@for q in questions}
+{q}? {@input answer}
+{@endfor}
+{@endfor}
+Last: {answer|upper}
+"""
+    params = {'steps': [1, 2], 'questions': {'a': 1, 'b': 2}, 'verbose': False}
+    for optimize in [False, True]:
+      with self.subTest(optimize=optimize):
+        answers = iter(range(4))
+        parser = MextParser()
+        parser.enable_optimization(optimize)
+        expected = parser.parse(template, params=params, callbacks={'answer': lambda output: f"ans{next(answers)}"})
+
+        rendered = parser.parse_resumable(template, params=params)
+        self.assertEqual(rendered.input, "answer")
+        self.assertEqual(rendered.output, "Questions.\nStep 1:\n('a', 1)?")
+        outputs = []
+        for index in range(4):
+          self.assertIsNone(rendered.result)
+          # the continuation is resumed by a new parser after a round trip through json
+          parser = MextParser()
+          parser.enable_optimization(optimize)
+          rendered = parser.resume(json.loads(json.dumps(rendered.continuation)), f"ans{index}", template=template, params=params)
+          outputs.append(rendered.output)
+        self.assertEqual(rendered.result, expected)
+        self.assertEqual(rendered.input_results, {'answer': "ans3"})
+        self.assertEqual(outputs[1], "Questions.\nStep 1:\n('a', 1)? ans0\n('b', 2)? ans1\nStep 2:\n('a', 1)?")
+
+    parser = MextParser()
+    continuation = parser.parse_resumable(template, params=params).continuation
+    with self.assertRaisesRegex(ValueError, 'less items'):
+      parser.resume(continuation, "ans", template=template, params={**params, 'steps': []})
+    with self.assertRaisesRegex(ValueError, 'template changed'):
+      parser.resume(continuation, "ans", template=template + "\nMore.", params=params)
+    # the inputs with callbacks do not stop the render
+    self.assertEqual(parser.parse_resumable("{@input a} {@input b}", callbacks={'a': lambda output: "A"}).output, "A")
+    self.assertEqual(parser.parse_resumable("Done.").result, "Done.")
+
+  def test_cache(self):
+    class DictCache:
+      def __init__(self):
+        self.data = {}
+      def get(self, key, default=None):
+        return self.data.get(key, default)
+      def put(self, key, value):
+        self.data[key] = value
+
+    calls = []
+    def describe(tool):
+      calls.append(tool.name)
+      return tool.description
+
+    template = """\
+Tools:
+{@cache version}
+{@for tool in tools}
+- {tool.name}: {tool|describe}
+{@endfor}
+{@set count 2}
+{@endcache}
+{count} tools, {name}.
+"""
+    tools = [ObjDict({'name': "search", 'description': "Search the web."}), ObjDict({'name': "calc", 'description': "Calculate."})]
+    expected = "Tools:\n- search: Search the web.\n- calc: Calculate.\n2 tools, {}."
+    for optimize in [False, True]:
+      with self.subTest(optimize=optimize):
+        parser = MextParser()
+        parser.enable_optimization(optimize)
+        parser.register_formatter('describe', describe)
+        cache = DictCache()
+        parser.set_fragment_cache(cache)
+
+        calls.clear()
+        self.assertEqual(parser.parse(template, params={'version': 1, 'tools': tools, 'name': "Alice"}), expected.format("Alice"))
+        # the block is skipped on a hit, and the locals it set are restored
+        self.assertEqual(parser.parse(template, params={'version': 1, 'tools': [], 'name': "Bob"}), expected.format("Bob"))
+        self.assertEqual(calls, ["search", "calc"])
+        self.assertEqual(parser.parse(template, params={'version': 2, 'tools': tools[:1], 'name': "Bob"}), "Tools:\n- search: Search the web.\n2 tools, Bob.")
+        self.assertEqual(len(cache.data), 2)
+
+    # the output expires after ttl seconds
+    parser = MextParser()
+    parser.set_fragment_cache(LRUCache())
+    template = "{@cache key ttl=0.05}{value}{@endcache}"
+    self.assertEqual(parser.parse(template, params={'key': 1, 'value': "a"}), "a")
+    self.assertEqual(parser.parse(template, params={'key': 1, 'value': "b"}), "a")
+    time.sleep(0.06)
+    self.assertEqual(parser.parse(template, params={'key': 1, 'value': "b"}), "b")
+    # blocks of included templates are cached as well
+    include_fn = "tests/mext/prompts/include1.mext"
+    self.assertEqual(parser.parse('{@cache 1}{@include include_fn var1=value}{@endcache}', params={'include_fn': include_fn, 'value': True}), "Using default value.")
+    self.assertEqual(parser.parse('{@cache 1}{@include include_fn var1=value}{@endcache}', params={'include_fn': include_fn, 'value': False}), "Using default value.")
+
+    with self.assertRaisesRegex(SyntaxError, 'requires "@cache key'):
+      parser.parse("{@cache a b}{@endcache}")
+    with self.assertRaisesRegex(RuntimeError, 'positive number'):
+      parser.parse('{@cache 1 ttl="soon"}{@endcache}')
+    with self.assertRaisesRegex(RuntimeError, 'cannot be in a "@cache" block'):
+      parser.parse("{@cache 1}{@input answer}{@endcache}", callbacks={'answer': lambda output: "yes"})
+
   def test_readme_syntax(self):
     parser = MextParser()
     readme_files = os.listdir(self.dirs.readme_syntax)
@@ -1110,3 +1615,102 @@ print('It contains code block.')
     })
     self.assertEqual(res, "First letter get capitalized")
 
+
+  def test_format_table(self):
+    parser = MextParser()
+    res = parser.parse("""\
+{@format table var1}
+""",
+      params={
+        'var1': [
+          { 'name': "Alice", 'favorite': "Apple", },
+          { 'name': "Bob", 'favorite': "Banana | Cherry", 'note': "Two\nlines", },
+        ],
+    })
+    self.assertEqual(res, """\
+| name | favorite | note |
+|---|---|---|
+| Alice | Apple |  |
+| Bob | Banana \\| Cherry | Two<br>lines |\
+""")
+
+    res = parser.parse("""\
+{@format table var1 columns="favorite=Fruit name"}
+""",
+      params={
+        'var1': {
+          'name': ["Alice", "Bob"],
+          'favorite': ["Apple", "Banana"],
+        },
+    })
+    self.assertEqual(res, """\
+| Fruit | name |
+|---|---|
+| Apple | Alice |
+| Banana | Bob |\
+""")
+
+    class Column(list):
+      def tolist(self):
+        return list(self)
+
+    class StructuredArray:
+      dtype = ObjDict({'names': ('id', 'score')})
+
+      def __getitem__(self, key):
+        return Column({'id': [1, 2], 'score': [0.5, 1.0]}[key])
+
+    res = parser.parse("{@format table var1}", params={'var1': StructuredArray()})
+    self.assertEqual(res, "| id | score |\n|---|---|\n| 1 | 0.5 |\n| 2 | 1.0 |")
+
+  def test_format_csv(self):
+    parser = MextParser()
+    res = parser.parse("""\
+{@format csv var1}
+""",
+      params={
+        'var1': [
+          { 'name': "Alice", 'favorite': "Apple", },
+          { 'name': "Bob", 'favorite': "Banana, Cherry", },
+        ],
+    })
+    self.assertEqual(res, """\
+name,favorite
+Alice,Apple
+Bob,"Banana, Cherry"\
+""")
+
+    res = parser.parse("""\
+{@format csv var1 columns="name", delimiter=";", header=false}
+""",
+      params={
+        'var1': [("Alice", 19), ("Bob", 20)],
+    })
+    self.assertEqual(res, "Alice\nBob")
+
+  def test_format_bullets(self):
+    parser = MextParser()
+    res = parser.parse("""\
+{@format bullets var1}
+""",
+      params={
+        'var1': ["Apple", ["Red", "Green"], "Banana\nYellow"],
+    })
+    self.assertEqual(res, """\
+- Apple
+  - Red
+  - Green
+- Banana
+  Yellow\
+""")
+
+    res = parser.parse("""\
+{@format bullets var1 columns="name favorite", bullet="*"}
+""",
+      params={
+        'var1': [
+          { 'name': "Alice", 'favorite': "Apple", 'age': 19, },
+          { 'name': "Bob", 'favorite': "Banana", 'age': 20, },
+        ],
+    })
+    self.assertEqual(res, "* Alice: Apple\n* Bob: Banana")
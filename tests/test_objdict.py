@@ -1,4 +1,5 @@
 import unittest
+import pickle
 
 from mext.libs.utils import ObjDict
 
@@ -88,3 +89,15 @@ class TestObjDict(unittest.TestCase):
       },
       'd': 3,
     })
+
+  def test_missing_attribute(self):
+    a = ObjDict({'b': ObjDict({'c': 1})})
+    self.assertEqual(a.b.c, 1)
+    with self.assertRaises(AttributeError):
+      a.d
+    self.assertIsNone(getattr(a, 'd', None))
+    self.assertFalse(hasattr(a, 'd'))
+
+    restored = pickle.loads(pickle.dumps(a))
+    self.assertIs(type(restored.b), ObjDict)
+    self.assertEqual(restored, a)
@@ -0,0 +1,41 @@
+import unittest
+
+from mext.libs.output_buffer import OutputBuffer
+
+class TestOutputBuffer(unittest.TestCase):
+  def test_append(self):
+    buffer = OutputBuffer()
+    for text in ['Hello', ', ', 'world', '!']:
+      buffer.append(text)
+    self.assertEqual(len(buffer), 4)
+    self.assertEqual(buffer.tell(), 13)
+    self.assertEqual(buffer.getvalue(), "Hello, world!")
+    self.assertIs(buffer.getvalue(), buffer.getvalue())
+
+    buffer.append("\n")
+    self.assertEqual(buffer.getvalue(), "Hello, world!\n")
+
+  def test_read(self):
+    buffer = OutputBuffer()
+    buffer.append("abc")
+    buffer.append("def")
+    buffer.coalesce()
+    buffer.append("gh")
+    buffer.append("ij")
+    self.assertEqual(buffer.read(), "abcdefghij")
+    self.assertEqual(buffer.read(6), "ghij")
+    self.assertEqual(buffer.read(2, 7), "cdefg")
+    self.assertEqual(buffer.read(7, 7), "")
+
+  def test_view(self):
+    buffer = OutputBuffer()
+    buffer.append("  first\n")
+    view1 = buffer.view(0, final_strip=True)
+    buffer.append("second\n")
+    view2 = buffer.view(view1.end)
+    buffer.append("third")
+
+    self.assertEqual(view1.delta, "  first\n")
+    self.assertEqual(str(view1), "first")
+    self.assertEqual(view2.delta, "second\n")
+    self.assertEqual(view2.prefix, "  first\nsecond\n")
@@ -0,0 +1,53 @@
+import unittest
+import asyncio
+import json
+import tempfile
+from os import path
+
+from mext.libs.server import RenderServer
+
+class TestServer(unittest.IsolatedAsyncioTestCase):
+  async def asyncSetUp(self):
+    self.tmpdir = tempfile.TemporaryDirectory()
+    self.socket_path = path.join(self.tmpdir.name, 'mext.sock')
+    self.template_fn = path.join(self.tmpdir.name, 'greeting.mext')
+    with open(self.template_fn, 'w') as f:
+      f.write("Hello {name}.")
+
+    self.server = RenderServer(self.socket_path, disk_cache=False)
+    ready = asyncio.Event()
+    self.server_task = asyncio.create_task(self.server.serve(ready=ready))
+    await ready.wait()
+
+  async def asyncTearDown(self):
+    self.server_task.cancel()
+    with self.assertRaises(asyncio.CancelledError):
+      await self.server_task
+    self.assertFalse(path.exists(self.socket_path))
+    self.tmpdir.cleanup()
+
+  async def test_serve(self):
+    reader, writer = await asyncio.open_unix_connection(self.socket_path)
+    requests = [
+      {'id': 1, 'template_fn': self.template_fn, 'params': {'name': "Alice"}},
+      {'id': 2, 'template': "{@for name in names}{name} {@endfor}", 'params': {'names': ["a", "b"]}},
+      {'id': 3, 'template_fn': self.template_fn},
+      {'id': 4, 'template': "x", 'template_fn': self.template_fn},
+      {'id': 5, 'stats': True},
+    ]
+    # the requests are sent before reading any response
+    writer.write(''.join(json.dumps(request) + '\n' for request in requests).encode())
+    writer.write(b'{"id": 6\n')
+    await writer.drain()
+    responses = [json.loads(await reader.readline()) for _ in range(len(requests) + 1)]
+    writer.close()
+    await writer.wait_closed()
+
+    self.assertEqual([response['id'] for response in responses], [1, 2, 3, 4, 5, None])
+    self.assertEqual(responses[0]['result'], "Hello Alice.")
+    self.assertEqual(responses[1]['result'], "a b")
+    self.assertIn("KeyError", responses[2]['error'])
+    self.assertIn("Invalid request", responses[3]['error'])
+    self.assertIn("Invalid request", responses[5]['error'])
+    stats = responses[4]['stats']
+    self.assertEqual((stats['connections'], stats['requests'], stats['errors']), (1, 3, 2))